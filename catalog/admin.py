@@ -1,7 +1,10 @@
-from django.contrib import admin
+import datetime
+
+from django.contrib import admin, messages
 
 # Register your models here.
-from catalog.models import Genre, Language, Book, BookInstance, Author
+from catalog.models import Genre, Language, Book, BookInstance, Author, Hold, Task
+from catalog import circulation
 
 admin.site.register(Genre)
 admin.site.register(Language)
@@ -30,7 +33,7 @@ class BooksInstanceInline(admin.TabularInline):
 @admin.register(Book)
 # Define the admin class
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'display_genre', 'language')
+    list_display = ('title', 'author', 'display_genre', 'language', 'num_instances')
     inlines = [BooksInstanceInline]
 
 # Register the Admin classes for BookInstance using the decorator, before class definition
@@ -39,6 +42,7 @@ class BookAdmin(admin.ModelAdmin):
 class BookInstanceAdmin(admin.ModelAdmin):
     list_display = ('display_title', 'language', 'imprint', 'status', 'due_back', 'borrower', 'id')
     list_filter = ('status', 'due_back')
+    actions = ['renew_loans']
     fieldsets = (
         (None, {
             'fields': ('book', 'imprint', 'id', 'language')
@@ -47,3 +51,29 @@ class BookInstanceAdmin(admin.ModelAdmin):
             'fields': ('status', 'due_back', 'borrower')
         }),
     )
+
+    def renew_loans(self, request, queryset):
+        """Renew the selected loans (all the filtered ones with "Select all") for the default loan period."""
+        due_back = datetime.date.today() + circulation.LOAN_PERIOD
+        renewed, rejected = circulation.renew(queryset, due_back)
+        self.message_user(
+            request, f'{renewed} loan(s) renewed until {due_back}, {rejected} rejected (not on loan, or due later).',
+            messages.SUCCESS if renewed else messages.WARNING,
+        )
+    renew_loans.short_description = 'Renew the selected loans for 3 weeks'
+    renew_loans.allowed_permissions = ('mark_returned',)
+
+    def has_mark_returned_permission(self, request):
+        return request.user.has_perm('catalog.can_mark_returned')
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'patron', 'status', 'created_at', 'ready_at', 'bookinstance')
+    list_filter = ('status',)
+    raw_id_fields = ('book', 'patron', 'bookinstance')
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'run_at', 'attempts', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
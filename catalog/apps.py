@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CatalogConfig(AppConfig):
     name = 'catalog'
+
+    def ready(self):
+        # Connect the signal receivers (cache invalidation, search documents)
+        from catalog import signals
+        post_migrate.connect(signals.restore_search_index, sender=self)
@@ -0,0 +1,155 @@
+"""HTTP caching of the public catalog views.
+
+CachedResponseMixin caches the rendered responses on the server,
+ConditionalGetMixin answers the conditional requests of browsers and proxies,
+and patch_public_cache_control() lets a front proxy keep the anonymous pages.
+
+Responses are cached under a key made of the URL (path and query string, so
+the page number), the user and their permissions, and the current version of
+each model the page displays. A version is a counter kept in the cache and
+bumped by the signal receivers of catalog.signals whenever a row of the model
+changes: the next request computes a new key and renders the page again, and
+the stale entries expire with the timeout.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+# Seconds rendered responses are kept. Versions make edits visible at once in a
+# shared cache; the timeout frees the memory of stale versions (and bounds their
+# staleness with a local memory cache across several workers).
+VIEW_CACHE_TIMEOUT = getattr(settings, 'CATALOG_VIEW_CACHE_TIMEOUT', 600)
+
+# Seconds shared caches (a front proxy) and browsers may keep the anonymous
+# pages without asking the server again: edits show up after at most this delay.
+PUBLIC_MAX_AGE = getattr(settings, 'CATALOG_PUBLIC_MAX_AGE', 60)
+
+
+def version_key(model):
+    return f'catalog:version:{model._meta.label_lower}'
+
+
+def get_versions(models):
+    """Return the current versions of models, in order."""
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock, not 1: a version evicted from the cache is never reused
+            version = int(time.time() * 1000)
+            versions[key] = version if cache.add(key, version, None) else cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(model):
+    try:
+        cache.incr(version_key(model))
+    except ValueError:
+        # Not in cache: the next get_versions() starts a new version
+        pass
+
+
+def bump_version(*models):
+    """Change the versions of models, so that the pages displaying them are rendered again."""
+    for model in models:
+        _bump(model)
+        # Again once committed: a request may have cached the page with the uncommitted version
+        transaction.on_commit(lambda model=model: _bump(model))
+
+
+def user_key(request):
+    """Return the parts of a cache key for the user of request: the pages display their name and permissions."""
+    user = request.user
+    permissions = sorted(user.get_all_permissions()) if user.is_authenticated else []
+    return [str(user.pk), hashlib.md5(','.join(permissions).encode()).hexdigest()]
+
+
+def patch_public_cache_control(request, response):
+    """Mark the pages of anonymous visitors public, those of users private (they display their name)."""
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True)
+    else:
+        patch_cache_control(response, public=True, max_age=PUBLIC_MAX_AGE)
+
+
+class CachedResponseMixin:
+    """
+    View mixin caching the rendered GET responses with status 200.
+
+    cache_models are the models displayed by the page: their versions are part
+    of the cache key.
+    """
+    cache_models = ()
+    cache_timeout = VIEW_CACHE_TIMEOUT
+
+    def get_cache_key(self, request):
+        parts = [request.get_full_path()] + user_key(request) + [str(version) for version in get_versions(self.cache_models)]
+        return 'catalog:view:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        response = cache.get(key)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            patch_public_cache_control(request, response)
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(lambda response: cache.set(key, response, self.cache_timeout))
+            else:
+                cache.set(key, response, self.cache_timeout)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    View mixin answering conditional GET requests (If-None-Match, If-Modified-Since)
+    with 304 Not Modified, before the page is looked up in cache or rendered.
+
+    get_change_marker() returns (last change time, row count) of what the page
+    displays, computed with a cheap aggregate query (the count catches deletions,
+    which leave no timestamp), or None to answer unconditionally. The ETag, made
+    of the whole marker (microseconds included) and of the user, is the only
+    validator: no Last-Modified is sent, since its one-second resolution misses
+    the changes within a second and its date the deletions, and If-Modified-Since
+    alone is answered in full.
+
+    Pages rendering forms to their users (renders_forms) also version their ETag
+    with the CSRF token of the user, rotated at login: a page kept across a new
+    login would post a stale token.
+    """
+    renders_forms = False
+
+    def get_change_marker(self):
+        """Return (last change time, row count) of what the page displays, or None (the default) for no validator."""
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        marker = self.get_change_marker()
+        if marker is None or marker[0] is None:
+            return super().dispatch(request, *args, **kwargs)
+        last_modified, count = marker
+        parts = [last_modified.isoformat(), str(count)] + user_key(request)
+        if self.renders_forms and request.user.is_authenticated:
+            # The token rendered is a salted form of the one of the CSRF cookie
+            get_token(request)
+            parts.append(request.META['CSRF_COOKIE'])
+        etag = quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            patch_public_cache_control(request, response)
+        return response
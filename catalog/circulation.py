@@ -0,0 +1,273 @@
+"""Loan operations on book copies: checkout, return and reservation.
+
+Each operation is a single conditional UPDATE of the copy (... WHERE status IN
+the statuses it starts from): of two concurrent requests for the same copy,
+the database lets only one find it in the expected status, and the other one
+gets a LoanConflict instead of silently overwriting the first. No row is read
+and locked beforehand, so the operations take one round trip on the copy.
+
+batch_circulate() checks out or returns the copies scanned at the desk in one
+transaction, with a query reading them all and a bulk update. renew() extends
+the loans of a set of copies with one conditional UPDATE.
+
+Patrons queue for the copies of a book with holds. Whatever makes a copy
+available (a return, a cancelled hold, a new copy, an admin edit), it is
+reserved in the same transaction for the first waiting hold of its book by the
+copy counters refresh (see HoldQuerySet.serve()). An available copy is not lent
+nor reserved over the heads of the patrons waiting for its book (HoldsWaiting).
+"""
+
+import datetime
+import uuid
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from catalog.models import BookInstance, Hold
+
+# Default loan period of a checkout (renewals are limited to 4 weeks, see catalog.forms)
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+AVAILABLE, ON_LOAN, RESERVED = 'a', 'o', 'r'
+
+# Time a patron has to check out the copy reserved for their hold (see expire_holds())
+HOLD_PICKUP_PERIOD = datetime.timedelta(weeks=1)
+
+
+class LoanConflict(Exception):
+    """The copy was not in a status the operation starts from (e.g. another librarian checked it out first)."""
+    held = False
+
+    def __init__(self, copy_id, status, borrower_id):
+        self.copy_id = copy_id
+        self.status = status
+        self.borrower_id = borrower_id
+        super().__init__(f'Copy {copy_id} is {dict(BookInstance.LOAN_STATUS).get(status, status).lower()}.')
+
+
+class HoldsWaiting(LoanConflict):
+    """The copy is available, but kept for the patrons waiting for its book (see Hold)."""
+    held = True
+
+    def __init__(self, copy_id):
+        super().__init__(copy_id, AVAILABLE, None)
+        self.args = (f'Copy {copy_id} is kept for the patrons waiting for its book.',)
+
+
+# An available copy nobody waits for
+ON_SHELF = Q(status=AVAILABLE) & ~Q(book__hold__status=Hold.WAITING)
+
+
+def _change(copy_id, condition, **changes):
+    """
+    Update the copy copy_id if it matches condition and return its book id, or raise LoanConflict
+    (or BookInstance.DoesNotExist). The caller refreshes the copy counters of the book.
+    """
+    copies = BookInstance.objects.filter(pk=copy_id)
+    # The conditional update of the base QuerySet: BookInstanceQuerySet.update() would
+    # read the books of the copies matching condition before updating them
+    updated = models.QuerySet.update(copies.filter(condition), updated_at=timezone.now(), **changes)
+    current = copies.values_list('status', 'borrower_id', 'book_id').first()
+    if current is None:
+        raise BookInstance.DoesNotExist(f'No copy {copy_id}.')
+    status, borrower_id, book_id = current
+    if not updated:
+        raise LoanConflict(copy_id, status, borrower_id)
+    return book_id
+
+
+def _off_shelf(copy_id, condition, **changes):
+    """
+    _change() for the operations taking an available copy off the shelf (condition includes ON_SHELF):
+    raise HoldsWaiting rather than LoanConflict for an available copy kept for waiting holds.
+    """
+    try:
+        return _change(copy_id, condition, **changes)
+    except LoanConflict as conflict:
+        if conflict.status == AVAILABLE:
+            raise HoldsWaiting(copy_id) from None
+        raise
+
+
+def checkout(copy_id, borrower, due_back=None):
+    """Lend an available copy nobody waits for, or a copy reserved for borrower, to borrower until due_back."""
+    with transaction.atomic():
+        book_id = _off_shelf(
+            copy_id,
+            ON_SHELF | Q(status=RESERVED, borrower=borrower),
+            status=ON_LOAN,
+            borrower=borrower,
+            due_back=due_back or datetime.date.today() + LOAN_PERIOD,
+        )
+        # The hold the copy was reserved for
+        Hold.objects.filter(bookinstance_id=copy_id, patron=borrower, status=Hold.READY).update(status=Hold.FULFILLED)
+        # No copy made available: no hold to serve
+        BookInstance.objects.all()._copies_changed({book_id}, serve_holds=False)
+
+
+def return_copy(copy_id):
+    """Make a copy on loan available again, or reserve it for the first waiting hold on its book."""
+    with transaction.atomic():
+        book_id = _change(copy_id, Q(status=ON_LOAN), status=AVAILABLE, borrower=None, due_back=None)
+        BookInstance.objects.all()._copies_changed({book_id})
+
+
+def reserve(copy_id, borrower):
+    """Hold an available copy nobody waits for for borrower, until they check it out."""
+    with transaction.atomic():
+        book_id = _off_shelf(copy_id, ON_SHELF, status=RESERVED, borrower=borrower, due_back=None)
+        BookInstance.objects.all()._copies_changed({book_id}, serve_holds=False)
+
+
+# Largest batch of batch_circulate(): the copies are read with one IN lookup
+MAX_BATCH_SIZE = 500
+
+BATCH_ACTIONS = ('checkout', 'return')
+
+
+def batch_circulate(action, copy_ids, borrower=None, due_back=None):
+    """
+    Check out (to borrower, until due_back) or return the copies copy_ids, as scanned at the desk.
+
+    All the copies are read, and locked on databases supporting SELECT ... FOR UPDATE,
+    with one query; those in a status the action starts from are changed with one
+    UPDATE, in the same transaction, provided they still are in that status (the others
+    are conflicts). Return a list of (copy id, result, status) in the
+    order of copy_ids (without repeats), result being 'ok', 'conflict' (status is the
+    current status), 'held' (an available copy kept for the holds waiting for its book),
+    'not_found' or 'invalid' (not a UUID). The copies returned go to the waiting holds.
+    """
+    if action not in BATCH_ACTIONS:
+        raise ValueError(f'Unknown action {action!r}.')
+    if action == 'checkout' and borrower is None:
+        raise ValueError('A checkout needs a borrower.')
+    ids = {}
+    for copy_id in copy_ids:
+        try:
+            ids.setdefault(str(copy_id).strip(), uuid.UUID(str(copy_id).strip()))
+        except ValueError:
+            ids.setdefault(str(copy_id).strip(), None)
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} copies per batch.')
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+
+    results = []
+    with transaction.atomic():
+        copies = BookInstance.objects.select_for_update().only('id', 'book_id', 'status', 'borrower_id')
+        copies = copies.in_bulk([pk for pk in ids.values() if pk is not None])
+        held = set()
+        shelved = {copy.book_id for copy in copies.values() if copy.status == AVAILABLE}
+        if action == 'checkout' and shelved:
+            held = Hold.objects.filter(book_id__in=shelved, status=Hold.WAITING).order_by().values_list('book_id', flat=True)
+            held = set(held.distinct())
+        changed = []
+        for copy_id, pk in ids.items():
+            copy = copies.get(pk)
+            if pk is None:
+                results.append((copy_id, 'invalid', None))
+            elif copy is None:
+                results.append((copy_id, 'not_found', None))
+            elif action == 'checkout' and copy.status == AVAILABLE and copy.book_id in held:
+                results.append((copy_id, 'held', AVAILABLE))
+            elif action == 'checkout' and (
+                copy.status == AVAILABLE or copy.status == RESERVED and copy.borrower_id == borrower.pk
+            ):
+                changed.append(pk)
+                results.append((copy_id, 'ok', ON_LOAN))
+            elif action == 'return' and copy.status == ON_LOAN:
+                changed.append(pk)
+                results.append((copy_id, 'ok', AVAILABLE))
+            else:
+                results.append((copy_id, 'conflict', copy.status))
+        if action == 'checkout':
+            expected = ON_SHELF | Q(status=RESERVED, borrower=borrower)
+            fields = {'status': ON_LOAN, 'borrower': borrower, 'due_back': due_back}
+        else:
+            expected = Q(status=ON_LOAN)
+            fields = {'status': AVAILABLE, 'borrower': None, 'due_back': None}
+        if changed:
+            # The statuses read are checked again by the UPDATE: without row locks (SQLite),
+            # another desk may have changed copies since. The rows updated are told apart by
+            # their updated_at.
+            now = timezone.now()
+            copies_changed = BookInstance.objects.filter(expected, pk__in=changed)
+            if models.QuerySet.update(copies_changed, updated_at=now, **fields) < len(changed):
+                current = BookInstance.objects.filter(pk__in=changed).values_list('pk', 'status', 'updated_at')
+                current = {pk: (status, updated_at) for pk, status, updated_at in current}
+                changed = [pk for pk in changed if pk in current and current[pk][1] == now]
+                for i, (copy_id, result, status) in enumerate(results):
+                    if result == 'ok' and ids[copy_id] not in changed:
+                        # Changed by another desk, or deleted
+                        status = current.get(ids[copy_id], (None,))[0]
+                        results[i] = (copy_id, 'conflict' if status else 'not_found', status)
+            # The copy counters of the books are refreshed, and the returned copies reserved
+            # for the holds waiting for their books
+            book_ids = {copies[pk].book_id for pk in changed}
+            BookInstance.objects.all()._copies_changed(book_ids, serve_holds=action == 'return')
+        if action == 'checkout':
+            holds = Hold.objects.filter(bookinstance_id__in=changed, patron=borrower, status=Hold.READY)
+            holds.update(status=Hold.FULFILLED)
+    return results
+
+
+def renew(copies, due_back):
+    """
+    Renew the loans of copies (a BookInstance queryset) until due_back, with one UPDATE.
+
+    Only copies on loan and due before due_back are renewed: the others (returned,
+    or already due later) are rejected, and left unchanged. Return (renewed, rejected).
+    """
+    with transaction.atomic():
+        selected = copies.count()
+        renewed = copies.filter(Q(due_back__lt=due_back) | Q(due_back__isnull=True), status=ON_LOAN)
+        # BookInstanceQuerySet.update() marks the books changed (their pages show the due dates)
+        renewed = renewed.update(due_back=due_back)
+    return renewed, selected - renewed
+
+
+def place_hold(book_id, patron):
+    """
+    Queue patron for a copy of the book book_id, and return their hold (their current one if
+    they already wait for the book). A copy available is reserved at once for the first hold.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(book_id=book_id, patron=patron)
+        except IntegrityError:
+            return Hold.objects.get(book_id=book_id, patron=patron, status__in=Hold.ACTIVE)
+        if Hold.objects.serve({book_id}):
+            BookInstance.objects.all()._copies_changed({book_id}, serve_holds=False)
+    hold.refresh_from_db()
+    return hold
+
+
+def _cancel(hold_id, **conditions):
+    """
+    Cancel the hold hold_id if it is active and matches conditions, passing the copy reserved
+    for it on to the next hold. Return False if it was not cancelled.
+    """
+    holds = Hold.objects.filter(pk=hold_id)
+    with transaction.atomic():
+        # Writing first: SQLite fails at once a transaction upgrading its read lock (see catalog.tasks.claim())
+        if not holds.filter(status__in=Hold.ACTIVE, **conditions).update(status=Hold.CANCELLED):
+            return False
+        book_id, copy_id, patron_id = holds.values_list('book_id', 'bookinstance_id', 'patron_id').get()
+        copies = BookInstance.objects.filter(pk=copy_id, status=RESERVED, borrower_id=patron_id)
+        if copy_id is not None and models.QuerySet.update(copies, status=AVAILABLE, borrower=None, updated_at=timezone.now()):
+            # Reserved for the next hold, if any
+            BookInstance.objects.all()._copies_changed({book_id})
+    return True
+
+
+def cancel_hold(hold_id, patron):
+    """Cancel a waiting or ready hold of patron. Return False if there is no such hold."""
+    return _cancel(hold_id, patron=patron)
+
+
+def expire_holds():
+    """Cancel the holds ready for longer than HOLD_PICKUP_PERIOD, and return their number."""
+    cutoff = timezone.now() - HOLD_PICKUP_PERIOD
+    expired = list(Hold.objects.filter(status=Hold.READY, ready_at__lt=cutoff).values_list('pk', flat=True))
+    return sum(_cancel(pk, status=Hold.READY, ready_at__lt=cutoff) for pk in expired)
@@ -0,0 +1,147 @@
+"""Page view counters, buffered in memory and flushed to PageView in bulk.
+
+Incrementing a row per request would make concurrent requests for the same
+page wait for each other's row lock. Views are added up in a dictionary of the
+process instead, and written with one bulk upsert (INSERT ... ON CONFLICT DO
+UPDATE on PostgreSQL and SQLite) when the buffer is older than
+CATALOG_COUNTERS_FLUSH_INTERVAL seconds or holds CATALOG_COUNTERS_MAX_PENDING
+pages, and when the process exits. A crashing worker loses at most the views of
+one interval. The buffer belongs to the database it was counted for: it is
+dropped rather than written to another one (e.g. once the test database is
+destroyed). On the request path, a failed flush is logged and the views are
+kept for the next one.
+
+Totals read from PageView lag the pending views of every worker; pending()
+adds those of the current process.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+
+from catalog.models import PageView
+
+logger = logging.getLogger('catalog.counters')
+
+FLUSH_INTERVAL = getattr(settings, 'CATALOG_COUNTERS_FLUSH_INTERVAL', 10)
+MAX_PENDING = getattr(settings, 'CATALOG_COUNTERS_MAX_PENDING', 1000)
+
+_lock = threading.Lock()
+_pending = Counter()
+_last_flush = time.monotonic()
+# The database of the buffered views
+_database = None
+
+
+def _current_database():
+    return connection.settings_dict['NAME']
+
+
+def record(kind, object_id, views=1):
+    """Count views of a page, flushing the buffer when it is due (a failed flush is logged, not raised)."""
+    global _pending, _database
+    database = _current_database()
+    with _lock:
+        if database != _database:
+            _pending, _database = Counter(), database
+        _pending[kind, object_id] += views
+        due = len(_pending) >= MAX_PENDING or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+    if due:
+        try:
+            flush()
+        except DatabaseError:
+            # E.g. SQLite's "database is locked": the page is served, the views wait for the next flush
+            logger.exception('Page views not flushed, %d pages pending', len(_pending))
+
+
+def pending(kind, object_id):
+    """Return the views of a page counted by this process and not flushed yet."""
+    with _lock:
+        return _pending[kind, object_id]
+
+
+def discard():
+    """Drop the buffered views (e.g. those of a test)."""
+    global _pending
+    with _lock:
+        _pending = Counter()
+
+
+def flush():
+    """Write the buffered views to PageView, and return the number of pages written (errors are raised)."""
+    global _pending, _last_flush
+    with _lock:
+        counts, _pending = _pending, Counter()
+        _last_flush = time.monotonic()
+        if _database is not None and _database != _current_database():
+            # Counted for another database
+            counts = Counter()
+    if not counts:
+        return 0
+    try:
+        _upsert(counts)
+    except Exception:
+        # Kept for the next flush
+        with _lock:
+            _pending.update(counts)
+        raise
+    return len(counts)
+
+
+def _upsert(counts):
+    rows = [(kind, object_id, views) for (kind, object_id), views in counts.items()]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        qn = connection.ops.quote_name
+        table = qn(PageView._meta.db_table)
+        sql = (
+            f'INSERT INTO {table} ({qn("kind")}, {qn("object_id")}, {qn("views")}) VALUES (%s, %s, %s) '
+            f'ON CONFLICT ({qn("kind")}, {qn("object_id")}) DO UPDATE SET {qn("views")} = {table}.{qn("views")} + excluded.{qn("views")}'
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+        return
+    with transaction.atomic():
+        for kind, object_id, views in rows:
+            if not PageView.objects.filter(kind=kind, object_id=object_id).update(views=F('views') + views):
+                PageView.objects.create(kind=kind, object_id=object_id, views=views)
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        # The database may be gone already: the views of this interval are lost
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+class PageViewMixin:
+    """
+    Detail view mixin counting the GET requests of the page, cached responses and
+    304 included (put it first in the bases), and adding the flushed number of
+    views of the page as num_views to the context.
+
+    num_views is the count when the page was rendered: a response cached by
+    CachedResponseMixin, or validated by its ETag, keeps displaying it until the
+    page changes or the cached response expires (CATALOG_VIEW_CACHE_TIMEOUT).
+    """
+    page_view_kind = None
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if request.method == 'GET' and response.status_code in (200, 304):
+            record(self.page_view_kind, self.kwargs['pk'])
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['num_views'] = PageView.objects.views(self.page_view_kind, self.object.pk)
+        return context
@@ -0,0 +1,85 @@
+"""Streaming export of the catalog, as CSV or JSON Lines.
+
+Rows are read with QuerySet.iterator(chunk_size) (a server-side cursor on
+PostgreSQL) and written one line at a time, so memory stays flat whatever the
+size of the tables. The genres of the books are read with one query per chunk
+of books. Book rows use the field names of the import_catalog command.
+"""
+
+import csv
+import itertools
+import json
+
+from catalog.models import Author, Book, BookInstance
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def book_rows(chunk_size):
+    books = Book.objects.order_by('pk').values_list(
+        'pk', 'isbn', 'title', 'summary', 'author_id', 'author__first_name', 'author__last_name', 'language__name',
+        'num_instances', 'num_instances_available',
+    )
+    GenreLink = Book.genre.through
+    rows = books.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        genres = {}
+        links = GenreLink.objects.filter(book_id__in=[row[0] for row in chunk]).order_by('genre__name')
+        for book_id, name in links.values_list('book_id', 'genre__name'):
+            genres.setdefault(book_id, []).append(name)
+        for row in chunk:
+            yield row + (genres.get(row[0], []),)
+
+
+def author_rows(chunk_size):
+    authors = Author.objects.order_by('pk').values_list('pk', 'first_name', 'last_name', 'date_of_birth', 'date_of_death')
+    return authors.iterator(chunk_size=chunk_size)
+
+
+def copy_rows(chunk_size):
+    copies = BookInstance.objects.order_by('pk').values_list(
+        'pk', 'book_id', 'book__isbn', 'imprint', 'status', 'due_back', 'language__name', 'borrower_id',
+    )
+    return copies.iterator(chunk_size=chunk_size)
+
+
+# Exported datasets: (field names, row generator)
+DATASETS = {
+    'books': (
+        ('id', 'isbn', 'title', 'summary', 'author_id', 'author_first_name', 'author_last_name', 'language',
+         'num_instances', 'num_instances_available', 'genres'),
+        book_rows,
+    ),
+    'authors': (('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death'), author_rows),
+    'copies': (('id', 'book_id', 'isbn', 'imprint', 'status', 'due_back', 'language', 'borrower_id'), copy_rows),
+}
+
+
+class Echo:
+    """File-like object returning what is written, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def export_lines(dataset, output_format, chunk_size=CHUNK_SIZE):
+    """Yield the lines of dataset in output_format ('csv' or 'jsonl')."""
+    fields, rows = DATASETS[dataset]
+    if output_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows(chunk_size):
+            # Lists (of genres) are joined as import_catalog splits them
+            yield writer.writerow(
+                ';'.join(value) if isinstance(value, list) else '' if value is None else value for value in row
+            )
+    else:
+        for row in rows(chunk_size):
+            yield json.dumps(dict(zip(fields, row)), default=str) + '\n'
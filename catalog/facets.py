@@ -0,0 +1,178 @@
+"""Faceted filtering of the book list, by genre, language, author and availability.
+
+The query string selects values of each dimension ('genre', 'language' and
+'author' ids, repeatable, and 'available=1'): a book matches if it has one of
+the values selected in every dimension. facet_counts() returns, for each
+dimension, the number of books per value among the books matching the filters
+of the other dimensions, so that the alternatives to a selected value keep
+their counts.
+
+Each dimension is counted with one grouped query on the ids (the genre counts
+read the index of the book-genre table alone when no other filter applies, and
+the author and language counts of the books available their partial indexes),
+and the names of the values counted are read from their small tables: seven
+queries (eight with selected authors beyond those counted), whatever the number
+of books and values. Only the authors with the most books are counted, and the
+selected values are listed even when no book matches, so that they can be
+unselected.
+
+The counts are cached per filter combination, the page number left out. The
+copy counters change at every loan: rather than following the versions of the
+books, the counts are kept up to CATALOG_FACETS_CACHE_TIMEOUT seconds. Those of
+the lists most requested, all the books and the books available, are refreshed
+ahead of the requests by the scheduled catalog.tasks.refresh_facets task, which
+requires the cache shared by the worker and web processes (see CACHES): their
+counts read every book (about 0.15 and 0.3 s for 300,000 books on SQLite).
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Value
+from django.db.models.functions import Concat
+
+from catalog.caching import get_versions
+from catalog.models import Author, Book, Genre, Language
+
+# Seconds the facet counts of a filter combination are kept
+FACETS_CACHE_TIMEOUT = getattr(settings, 'CATALOG_FACETS_CACHE_TIMEOUT', 300)
+
+# Authors counted, with the most books first (selected authors are always counted)
+AUTHOR_FACET_SIZE = getattr(settings, 'CATALOG_AUTHOR_FACET_SIZE', 20)
+
+DIMENSIONS = (
+    ('genre', 'Genre'),
+    ('language', 'Language'),
+    ('author', 'Author'),
+)
+
+
+def parse_filters(query):
+    """Return the filters of a query string (a QueryDict): {dimension: sorted ids, 'available': bool}."""
+    filters = {}
+    for name, label in DIMENSIONS:
+        ids = set()
+        for value in query.getlist(name):
+            try:
+                ids.add(int(value))
+            except ValueError:
+                pass
+        filters[name] = sorted(ids)
+    filters['available'] = query.get('available') == '1'
+    return filters
+
+
+def filter_books(books, filters, skip=None):
+    """Return the books of the queryset books matching filters, but those of the dimension skip."""
+    if filters['genre'] and skip != 'genre':
+        # A subquery, not a join: a book with several of the genres is listed once
+        books = books.filter(pk__in=Book.genre.through.objects.filter(genre_id__in=filters['genre']).values('book_id'))
+    if filters['language'] and skip != 'language':
+        books = books.filter(language_id__in=filters['language'])
+    if filters['author'] and skip != 'author':
+        books = books.filter(author_id__in=filters['author'])
+    if filters['available'] and skip != 'available':
+        books = books.available()
+    return books
+
+
+def _filtered(filters, skip):
+    """Return the books matching the filters but those of skip, or None if no other filter applies."""
+    if not any(filters[name] for name in filters if name != skip):
+        return None
+    return filter_books(Book.objects.order_by(), filters, skip)
+
+
+def _named(names, counts, selected):
+    """Return (id, name, count) of the values counted and selected, by name; names is a values_list() of (id, name)."""
+    names = names.filter(pk__in=set(counts) | set(selected))
+    return sorted(((pk, name, counts.get(pk, 0)) for pk, name in names), key=lambda value: value[1])
+
+
+def compute_facets(filters):
+    """Return the facet counts of filters: {dimension: [(id, name, count)], 'available': count}."""
+    facets = {}
+
+    rows = Book.genre.through.objects.all()
+    books = _filtered(filters, 'genre')
+    if books is not None:
+        rows = rows.filter(book_id__in=books.values('pk'))
+    # COUNT(*): counted on the genre_id index alone
+    counts = dict(rows.values('genre_id').annotate(count=Count('*')).values_list('genre_id', 'count'))
+    facets['genre'] = _named(Genre.objects.values_list('pk', 'name'), counts, filters['genre'])
+
+    books = _filtered(filters, 'language')
+    books = (Book.objects.order_by() if books is None else books).exclude(language=None)
+    counts = dict(books.values('language_id').annotate(count=Count('pk')).values_list('language_id', 'count'))
+    facets['language'] = _named(Language.objects.values_list('pk', 'name'), counts, filters['language'])
+
+    books = _filtered(filters, 'author')
+    books = (Book.objects.order_by() if books is None else books).exclude(author=None)
+    counts = books.values('author_id').annotate(count=Count('pk')).values_list('author_id', 'count')
+    counts = dict(counts.order_by('-count', 'author_id')[:AUTHOR_FACET_SIZE])
+    missing = [pk for pk in filters['author'] if pk not in counts]
+    if missing:
+        missing = books.filter(author_id__in=missing).values('author_id').annotate(count=Count('pk'))
+        counts.update(missing.values_list('author_id', 'count'))
+    authors = Author.objects.annotate(name=Concat('first_name', Value(' '), 'last_name')).values_list('pk', 'name')
+    facets['author'] = sorted(_named(authors, counts, filters['author']), key=lambda value: (-value[2], value[1]))
+
+    # Counted on their partial index (see BookQuerySet.available())
+    books = _filtered(filters, 'available')
+    books = Book.objects.order_by() if books is None else books
+    facets['available'] = books.available().count()
+    return facets
+
+
+def facets_cache_key(filters):
+    # The names of the values displayed follow the versions of their models (see catalog.caching)
+    parts = [json.dumps(filters, sort_keys=True)] + [str(version) for version in get_versions((Genre, Language, Author))]
+    return 'catalog:facets:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def refresh_facets(filters):
+    """Compute the facet counts of filters and cache them."""
+    facets = compute_facets(filters)
+    cache.set(facets_cache_key(filters), facets, FACETS_CACHE_TIMEOUT)
+    return facets
+
+
+def facet_counts(filters):
+    """Return the facet counts of filters (see compute_facets()), from the cache when they are available."""
+    key = facets_cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    return facets
+
+
+def toggle_query(query, name, value):
+    """Return the query string of query (a QueryDict) with value selected in name if it wasn't, unselected otherwise."""
+    query = query.copy()
+    values = query.getlist(name)
+    if str(value) in values:
+        values.remove(str(value))
+    else:
+        values.append(str(value))
+    query.setlist(name, values)
+    # Back to the first page
+    query.pop('page', None)
+    return f'?{query.urlencode()}'
+
+
+def facet_links(query, filters, facets):
+    """Return the dimensions of facets for a template: [{'name', 'label', 'values': [{'name', 'count', 'selected', 'query'}]}]."""
+    return [
+        {
+            'name': name,
+            'label': label,
+            'values': [
+                {'name': value_name, 'count': count, 'selected': pk in filters[name], 'query': toggle_query(query, name, pk)}
+                for pk, value_name, count in facets[name]
+            ],
+        }
+        for name, label in DIMENSIONS
+    ]
@@ -4,6 +4,19 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 
+# Latest due date of a renewal (or checkout), from today
+RENEWAL_LIMIT = datetime.timedelta(weeks=4)
+
+def validate_renewal_date(data):
+    """Apply the renewal rule to a due date: from today to 4 weeks ahead."""
+    # Check if the entered date is not in the past
+    if data < datetime.date.today():
+        raise ValidationError(_('Invalid date - passed date'))
+
+    # Check if the entered date is in the allowed range (+4 weeks from today)
+    if data > datetime.date.today() + RENEWAL_LIMIT:
+        raise ValidationError(_('Invalid date - more than 4 weeks ahead'))
+
 # We can choose between these 2 form declaration options ; second option is used in view 'renew_book_librarian' (views.py)
 # the second option works for single model cases only and is simpler when there are many fields (not the case here, one field)
 class RenewBookForm(forms.Form):
@@ -12,14 +25,7 @@ class RenewBookForm(forms.Form):
 
     def clean_renewal_date(self):
         data = self.cleaned_data['renewal_date']
-
-        # Check if the entered date is not in the past
-        if data < datetime.date.today():
-            raise ValidationError(_('Invalid date - passed date'))
-
-        # Check if the entered date is in the allowed range (+4 weeks from today)
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(_('Invalid date - more than 4 weeks ahead'))
+        validate_renewal_date(data)
 
         # Remember to always return the cleaned cleaned_data
         return data
@@ -30,14 +36,7 @@ class RenewBookModelForm(forms.ModelForm):
     """Form to renew book loan"""
     def clean_due_back(self):
         data = self.cleaned_data['due_back']
-
-        # Check if the entered date is not in the past
-        if data < datetime.date.today():
-            raise ValidationError(_('Invalid date - passed date'))
-
-        # Check if the entered date is in the allowed range (+4 weeks from today)
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(_('Invalid date - more than 4 weeks ahead'))
+        validate_renewal_date(data)
 
         # Remember to always return the cleaned cleaned_data
         return data
@@ -47,3 +46,48 @@ class RenewBookModelForm(forms.ModelForm):
         fields = ['due_back']
         labels = {'due_back': _('Renewal date')}
         help_texts = {'due_back': _('Enter a date between now and 4 weeks (default 3).')}
+
+class CheckoutForm(forms.ModelForm):
+    """Form to lend a copy (see catalog.circulation.checkout)"""
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        validate_renewal_date(data)
+        return data
+
+    class Meta:
+        model = BookInstance
+        fields = ['borrower', 'due_back']
+        labels = {'due_back': _('Due back')}
+        help_texts = {'due_back': _('Enter a date between now and 4 weeks (default 3).')}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['borrower'].required = True
+        self.fields['due_back'].required = True
+
+class BulkRenewForm(forms.Form):
+    """Form to renew the loans of the selected copies, or of all the copies due before a date"""
+    due_back = forms.DateField(label=_('Renewal date'), help_text=_('Enter a date between now and 4 weeks (default 3).'))
+    copies = forms.ModelMultipleChoiceField(queryset=BookInstance.objects.all(), required=False)
+    due_before = forms.DateField(
+        label=_('Due before'), required=False,
+        help_text=_('Renew all the loans due before this date, instead of the selected ones.'),
+    )
+
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        validate_renewal_date(data)
+        return data
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('copies') and not cleaned_data.get('due_before'):
+            raise ValidationError(_('Select loans, or a due date to renew the loans due before it.'))
+        return cleaned_data
+
+    def get_copies(self):
+        """Return the copies to renew."""
+        if self.cleaned_data.get('due_before'):
+            # The copies on loan only: a returned copy may keep the due date of its last loan
+            return BookInstance.objects.filter(status='o', due_back__lt=self.cleaned_data['due_before'])
+        return self.cleaned_data['copies']
@@ -0,0 +1,71 @@
+"""E-mail backend queuing the messages for the task worker (see catalog.tasks).
+
+With EMAIL_BACKEND = 'catalog.mail.QueuedEmailBackend', sending an e-mail (e.g. a
+password reset) only inserts a task; the worker sends the messages through
+CATALOG_TASKS_EMAIL_BACKEND, retrying when the mail server fails. A retried
+batch may send again the messages accepted before the failure.
+
+Senders that must know a message was delivered before recording it (e.g. the
+send_overdue_notices command) send through delivery_connection() instead.
+"""
+
+import base64
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+
+def serialize(message):
+    """Return the JSON-serializable fields of an EmailMessage (attachments must be (filename, content, mimetype))."""
+    attachments = []
+    for attachment in message.attachments:
+        if not isinstance(attachment, tuple):
+            raise ValueError('MIME attachments cannot be queued.')
+        filename, content, mimetype = attachment
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, base64.b64encode(content).decode(), mimetype])
+    return {
+        'subject': str(message.subject),
+        'body': str(message.body),
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': message.extra_headers,
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        'attachments': attachments,
+    }
+
+
+def deserialize(fields):
+    """Return the EmailMessage of serialized fields."""
+    fields = dict(fields)
+    attachments = fields.pop('attachments')
+    fields['alternatives'] = [tuple(alternative) for alternative in fields['alternatives']]
+    message = EmailMultiAlternatives(**fields)
+    for filename, content, mimetype in attachments:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+def delivery_connection(**kwargs):
+    """Return a connection of CATALOG_TASKS_EMAIL_BACKEND, the backend actually delivering the messages."""
+    return get_connection(getattr(settings, 'CATALOG_TASKS_EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'), **kwargs)
+
+
+def send_serialized(messages):
+    """Send serialized messages through CATALOG_TASKS_EMAIL_BACKEND, over one connection."""
+    return delivery_connection().send_messages([deserialize(fields) for fields in messages])
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """Queue the messages of each send_messages() call as one catalog.tasks.send_emails task."""
+    def send_messages(self, email_messages):
+        from catalog.tasks import send_emails
+        messages = [serialize(message) for message in email_messages]
+        if messages:
+            send_emails.delay(messages)
+        return len(messages)
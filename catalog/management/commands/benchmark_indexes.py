@@ -0,0 +1,95 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from catalog.models import Author, Book, BookInstance
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Show the query plans and timings of the main catalog queries with and without '
+        'the indexes of migration 0008. Run it on a database seeded with a realistic volume '
+        '(see seed_catalog), never on production: the indexes are dropped (then restored) '
+        'inside a transaction.'
+    )
+
+    # (model, index name) of the indexes compared
+    INDEXES = (
+        (BookInstance, 'bookinst_status_due_idx'),
+        (BookInstance, 'bookinst_borrower_due_idx'),
+        (Book, 'book_title_idx'),
+        (Author, 'author_name_idx'),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs of each query (default 5).')
+        parser.add_argument('--page', type=int, default=100, help='Page number read by the page number lists (default 100).')
+        parser.add_argument('--no-plans', action='store_true', help='Only show the timings.')
+
+    def get_queries(self, page):
+        """Return (name, queryset) of the queries run by the catalog views."""
+        due_order = (F('due_back').asc(nulls_last=True), 'pk')
+        borrower_id = (
+            BookInstance.objects.filter(status='o', borrower__isnull=False)
+            .values_list('borrower_id', flat=True).first()
+        )
+        offset = (page - 1) * 10
+        return [
+            ('all borrowed (status, due_back)', BookInstance.objects.filter(status='o').order_by(*due_order)[:10]),
+            ('my borrowed (borrower, status, due_back)', BookInstance.objects.filter(borrower_id=borrower_id, status='o').order_by(*due_order)[:10]),
+            (f'book list page {page} (title)', Book.objects.order_by('title')[offset:offset + 10]),
+            (f'author list page {page} (last_name, first_name)', Author.objects.order_by('last_name', 'first_name')[offset:offset + 10]),
+        ]
+
+    def measure(self, queries, repeat, show_plans):
+        """Return {name: median duration in ms}, writing the plan of each query."""
+        timings = {}
+        for name, queryset in queries:
+            if show_plans:
+                self.stdout.write(f'-- {name}')
+                self.stdout.write(queryset.explain())
+            durations = []
+            for run in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                durations.append((time.perf_counter() - start) * 1000)
+            timings[name] = statistics.median(durations)
+        return timings
+
+    def handle(self, *args, **options):
+        queries = self.get_queries(options['page'])
+        show_plans = not options['no_plans']
+        self.stdout.write(
+            f'{Book.objects.count()} books, {Author.objects.count()} authors, '
+            f'{BookInstance.objects.count()} copies ({connection.vendor})'
+        )
+
+        self.stdout.write(self.style.MIGRATE_HEADING('With indexes'))
+        after = self.measure(queries, options['repeat'], show_plans)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Without indexes'))
+        if not connection.in_atomic_block:
+            # Start with a new connection: SQLite would explain its cached statements with the dropped indexes
+            connection.close()
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # The SQLite schema editor can't be entered in a transaction: run its DROP INDEX statements
+                schema_editor = connection.schema_editor()
+                for model, index_name in self.INDEXES:
+                    index = next(index for index in model._meta.indexes if index.name == index_name)
+                    cursor.execute(str(index.remove_sql(model, schema_editor)))
+                before = self.measure(queries, options['repeat'], show_plans)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Median timings (ms)'))
+        for name, queryset in queries:
+            self.stdout.write(f'{name}: {before[name]:.2f} -> {after[name]:.2f}')
@@ -0,0 +1,191 @@
+import datetime
+import json
+import math
+import re
+import time
+import urllib.error
+import urllib.request
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import URLPattern, reverse
+from django.urls.converters import UUIDConverter
+
+from catalog import profiling
+from catalog.models import BookInstance
+from catalog.urls import urlpatterns
+
+# Latencies that can be compared with the baseline (within --threshold); query counts must not grow.
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+# Measures of the Server-Timing header sent by catalog.middleware.PerformanceMiddleware
+SERVER_TIMING = re.compile(r'(?P<name>\w+);dur=(?P<duration>[\d.]+)(?:;desc="(?P<queries>\d+) queries")?')
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of values."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every named route of catalog/urls.py: latency percentiles, query count, '
+        'SQL time and template render time. Results are written to JSON and can be compared '
+        'with a baseline file, failing when a route got slower than the threshold.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per route (default 20).')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per route (default 2).')
+        parser.add_argument('--username', help='Log in as this user (e.g. a librarian) before requesting the routes.')
+        parser.add_argument('--route', action='append', dest='routes', help='Only benchmark this route name (repeatable).')
+        parser.add_argument('--base-url', help=(
+            'Request a running server (e.g. http://127.0.0.1:8000 for a local gunicorn) instead of the '
+            'test client. Latencies are measured by the client; queries, SQL and template times are read '
+            'from the Server-Timing header of sampled requests (set DJANGO_PERF_SAMPLE_RATE=1 and '
+            'DJANGO_PERF_SERVER_TIMING=True on the server). With --username, a session cookie is sent.'
+        ))
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare the results with this JSON file (written by --output).')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Allowed latency increase over the baseline (default 0.2, i.e. 20%%).')
+        parser.add_argument('--metric', choices=LATENCY_METRICS, default='p95_ms', help='Latency compared with the baseline (default p95_ms).')
+
+    def route_urls(self, names=None):
+        """Return (name, url) of the named catalog routes, filled in with sample objects."""
+        routes = []
+        for pattern in urlpatterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name or (names and pattern.name not in names):
+                continue
+            kwargs = {}
+            for kwarg, converter in pattern.pattern.converters.items():
+                # Use the model of the view, or the only model with a UUID primary key
+                model = getattr(getattr(pattern.callback, 'view_class', None), 'model', None)
+                if model is None and isinstance(converter, UUIDConverter):
+                    model = BookInstance
+                obj = model and model.objects.order_by('pk').first()
+                if obj is None:
+                    break
+                kwargs[kwarg] = obj.pk
+            else:
+                routes.append((pattern.name, reverse(pattern.name, kwargs=kwargs)))
+                continue
+            self.stderr.write(f'Skipping {pattern.name}: no object to request')
+        return routes
+
+    def benchmark_client(self, client, url, iterations, warmup):
+        samples = []
+        for run in range(warmup + iterations):
+            with profiling.profile() as measures:
+                response = client.get(url)
+            if run >= warmup:
+                samples.append(measures)
+        return response.status_code, samples
+
+    def benchmark_server(self, base_url, url, iterations, warmup, cookie):
+        samples = []
+        status = None
+        for run in range(warmup + iterations):
+            request = urllib.request.Request(base_url.rstrip('/') + url, headers={'Cookie': cookie} if cookie else {})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                response = e
+            measures = profiling.Profile()
+            measures.total_time = time.perf_counter() - start
+            status = response.getcode()
+            for timing in SERVER_TIMING.finditer(response.headers.get('Server-Timing', '')):
+                if timing['name'] == 'db':
+                    measures.sql_time = float(timing['duration']) / 1000
+                    measures.queries = int(timing['queries'] or 0)
+                elif timing['name'] == 'tpl':
+                    measures.template_time = float(timing['duration']) / 1000
+            if run >= warmup:
+                samples.append(measures)
+        return status, samples
+
+    def summarize(self, url, status, samples):
+        latencies = [sample.total_time * 1000 for sample in samples]
+        last = samples[-1]
+        return {
+            'url': url,
+            'status': status,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'queries': last.queries,
+            'sql_ms': sum(sample.sql_time for sample in samples) * 1000 / len(samples),
+            'template_ms': sum(sample.template_time for sample in samples) * 1000 / len(samples),
+        }
+
+    def compare(self, results, baseline, metric, threshold):
+        """Return the list of regressions of results over baseline."""
+        regressions = []
+        for name, route in results['routes'].items():
+            reference = baseline.get('routes', {}).get(name)
+            if reference is None:
+                continue
+            if route[metric] > reference[metric] * (1 + threshold):
+                regressions.append(f'{name}: {metric} {reference[metric]:.2f} -> {route[metric]:.2f}')
+            # Query counts are unknown (0) for the requests of a server that doesn't send Server-Timing
+            if route['queries'] and reference['queries'] and route['queries'] > reference['queries']:
+                regressions.append(f'{name}: queries {reference["queries"]} -> {route["queries"]}')
+        return regressions
+
+    def handle(self, *args, **options):
+        iterations, warmup = options['iterations'], options['warmup']
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1.')
+        base_url = options['base_url']
+        user = None
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown user {options["username"]!r}.')
+
+        profiling.install()
+        client = Client(HTTP_HOST='127.0.0.1')
+        cookie = None
+        if user:
+            client.force_login(user)
+            cookie = '; '.join(f'{key}={morsel.value}' for key, morsel in client.cookies.items())
+
+        results = {
+            'meta': {
+                'mode': 'server' if base_url else 'client',
+                'database': connection.vendor,
+                'iterations': iterations,
+                'username': options['username'],
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            },
+            'routes': {},
+        }
+        for name, url in self.route_urls(options['routes']):
+            if base_url:
+                status, samples = self.benchmark_server(base_url, url, iterations, warmup, cookie)
+            else:
+                status, samples = self.benchmark_client(client, url, iterations, warmup)
+            route = results['routes'][name] = self.summarize(url, status, samples)
+            self.stdout.write(
+                f'{name:<22} {status} p50 {route["p50_ms"]:8.2f}  p95 {route["p95_ms"]:8.2f}  p99 {route["p99_ms"]:8.2f} ms  '
+                f'{route["queries"]:3} queries  sql {route["sql_ms"]:7.2f} ms  template {route["template_ms"]:7.2f} ms'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = self.compare(results, baseline, options['metric'], options['threshold'])
+            if regressions:
+                raise CommandError('Regressions over the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regression over the baseline.'))
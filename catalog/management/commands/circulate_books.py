@@ -0,0 +1,57 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from catalog.circulation import BATCH_ACTIONS, MAX_BATCH_SIZE, batch_circulate
+from catalog.forms import validate_renewal_date
+from catalog.utils import chunks
+
+
+class Command(BaseCommand):
+    help = (
+        'Check out or return copies in batches, from their ids (as read by a barcode scanner): '
+        f'each batch of up to {MAX_BATCH_SIZE} copies is read with one query and updated in one transaction. '
+        'Prints the result of each copy: ok, conflict (with the current status), held (kept for waiting holds), not_found or invalid.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=BATCH_ACTIONS)
+        parser.add_argument('ids', nargs='*', help='Copy ids (default: one per line of the standard input).')
+        parser.add_argument('--borrower', help='Username of the borrower (checkout).')
+        parser.add_argument('--due-back', help='Due date of the checkouts, YYYY-MM-DD, at most 4 weeks ahead (default: in 3 weeks).')
+
+    def handle(self, *args, **options):
+        borrower = due_back = None
+        if options['action'] == 'checkout':
+            if not options['borrower']:
+                raise CommandError('A checkout needs --borrower.')
+            try:
+                borrower = User.objects.get(username=options['borrower'])
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown user {options["borrower"]!r}.')
+        if options['due_back']:
+            due_back = parse_date(options['due_back'])
+            if due_back is None:
+                raise CommandError(f'Invalid date {options["due_back"]!r}.')
+            try:
+                validate_renewal_date(due_back)
+            except ValidationError as e:
+                raise CommandError(' '.join(e.messages))
+
+        ids = options['ids'] or (line.strip() for line in sys.stdin if line.strip())
+        start = time.perf_counter()
+        counts = {}
+        for batch in chunks(ids, MAX_BATCH_SIZE):
+            for copy_id, result, status in batch_circulate(options['action'], batch, borrower, due_back):
+                counts[result] = counts.get(result, 0) + 1
+                self.stdout.write(f'{copy_id} {result}' + (f' {status}' if result == 'conflict' else ''))
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+        summary = ', '.join(f'{count} {result}' for result, count in sorted(counts.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} copies in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f}/s): {summary or "none"}.'
+        ))
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.export import CHUNK_SIZE, DATASETS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = (
+        'Export catalog datasets (books, authors, copies) as CSV or JSON Lines files, streamed: '
+        'memory stays flat whatever the size of the tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('datasets', nargs='*', help=f'Datasets to export, among {", ".join(DATASETS)} (default: all).')
+        parser.add_argument('--format', choices=list(FORMATS), default='csv', help='Output format (default csv).')
+        parser.add_argument('--output-dir', default='.', help=(
+            'Directory of the files, named <dataset>.<format> (default: the current directory); '
+            '"-" writes to the standard output.'
+        ))
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f'Rows read per database round trip (default {CHUNK_SIZE}).')
+
+    def handle(self, *args, **options):
+        datasets = options['datasets'] or list(DATASETS)
+        unknown = set(datasets) - DATASETS.keys()
+        if unknown:
+            raise CommandError(f'Unknown datasets: {", ".join(sorted(unknown))}.')
+        output_format, output_dir = options['format'], options['output_dir']
+        if output_dir != '-' and not os.path.isdir(output_dir):
+            raise CommandError(f'{output_dir} is not a directory.')
+        for dataset in datasets:
+            start = time.perf_counter()
+            lines = export_lines(dataset, output_format, options['chunk_size'])
+            if output_dir == '-':
+                for line in lines:
+                    self.stdout.write(line, ending='')
+                continue
+            path = os.path.join(output_dir, f'{dataset}.{output_format}')
+            # Written to a temporary file first, not to leave a truncated export behind
+            with open(f'{path}.tmp', 'w', newline='', encoding='utf-8') as output:
+                rows = -1 if output_format == 'csv' else 0
+                for line in lines:
+                    output.write(line)
+                    rows += 1
+            os.replace(f'{path}.tmp', path)
+            if options['verbosity'] > 0:
+                self.stdout.write(f'{path}: {rows} rows in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,257 @@
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from catalog.models import Author, Book, BookInstance, Genre, Language, search_document
+from catalog.caching import bump_version
+from catalog.stats import invalidate_stats
+from catalog.utils import chunks
+
+# Values per IN lookup (SQLite limits the number of query parameters)
+LOOKUP_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Import books, with their authors, genres, languages and copies, from a CSV or JSON Lines file. '
+        'The file is streamed and imported in batches, each in its own transaction. Books are deduplicated on '
+        'ISBN: the copies of a known ISBN are added to the existing book. After a failure, fix the input and '
+        'run the command again with --resume to skip the records already imported.\n\n'
+        'Fields: isbn, title, summary, author_first_name, author_last_name, language and genres (a list, or '
+        'names separated by ";" in CSV). Copies are a list of {imprint, status, due_back, language, id} objects '
+        'in JSON Lines; in CSV, a row with an imprint column describes one copy (imprint, status, due_back, '
+        'copy_language).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON Lines file to import ("-" reads the standard input).')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Records imported per transaction (default 1000).')
+        parser.add_argument('--checkpoint', help='Progress file, kept until the import succeeds (default: <path>.checkpoint).')
+        parser.add_argument('--resume', action='store_true', help='Skip the records imported by a failed run, as recorded in the checkpoint file.')
+
+    def read_records(self, stream, input_format):
+        """Yield (record number, record) of stream, one at a time (JSON Lines records are numbered by line)."""
+        if input_format == 'csv':
+            for number, row in enumerate(csv.DictReader(stream), 1):
+                row['genres'] = (row.get('genres') or '').split(';')
+                row['copies'] = [{
+                    'imprint': row['imprint'],
+                    'status': row.get('status'),
+                    'due_back': row.get('due_back'),
+                    'language': row.get('copy_language'),
+                }] if row.get('imprint') else []
+                yield number, row
+        else:
+            for number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    raise CommandError(f'Record {number}: invalid JSON ({e}).')
+
+    def clean(self, number, record):
+        """Return the normalized record, or raise CommandError."""
+        def text(value):
+            return str(value).strip() if value is not None else ''
+
+        book = {
+            'isbn': text(record.get('isbn')),
+            'title': text(record.get('title')),
+            'summary': text(record.get('summary')),
+            'author': (text(record.get('author_first_name')), text(record.get('author_last_name'))),
+            'language': text(record.get('language')),
+            'genres': sorted({text(name) for name in record.get('genres') or []} - {''}),
+            'copies': [],
+        }
+        if not book['isbn'] or not book['title']:
+            raise CommandError(f'Record {number}: title and isbn are required.')
+        if book['author'] == ('', ''):
+            book['author'] = None
+        for copy in record.get('copies') or []:
+            status = text(copy.get('status')) or BookInstance._meta.get_field('status').default
+            if status not in self.statuses:
+                raise CommandError(f'Record {number}: unknown copy status {status!r}.')
+            due_back = None
+            if text(copy.get('due_back')):
+                try:
+                    due_back = parse_date(text(copy['due_back']))
+                except ValueError:
+                    pass
+                if due_back is None:
+                    raise CommandError(f'Record {number}: invalid due_back date {copy["due_back"]!r}.')
+            copy_id = None
+            if text(copy.get('id')):
+                try:
+                    copy_id = uuid.UUID(text(copy['id']))
+                except ValueError:
+                    raise CommandError(f'Record {number}: invalid copy id {copy["id"]!r}.')
+            book['copies'].append({
+                'id': copy_id,
+                'imprint': text(copy.get('imprint')),
+                'status': status,
+                'due_back': due_back,
+                'language': text(copy.get('language')) or book['language'],
+            })
+        return book
+
+    def resolve(self, model, keys):
+        """Return {key: pk} of the names (or author name pairs) keys, from the cache, the database, or created."""
+        cache = self.cache[model]
+        missing = set(keys) - cache.keys() - {'', None}
+        if not missing:
+            return cache
+
+        def lookup(keys):
+            for chunk in chunks(keys, LOOKUP_SIZE):
+                if model is Author:
+                    rows = model.objects.filter(last_name__in={last_name for first_name, last_name in chunk})
+                    rows = rows.values_list('first_name', 'last_name', 'pk')
+                    for first_name, last_name, pk in rows.order_by('pk'):
+                        cache.setdefault((first_name, last_name), pk)
+                else:
+                    for name, pk in model.objects.filter(name__in=chunk).values_list('name', 'pk').order_by('pk'):
+                        cache.setdefault(name, pk)
+
+        lookup(missing)
+        missing -= cache.keys()
+        if missing:
+            if model is Author:
+                model.objects.bulk_create(model(first_name=first_name, last_name=last_name) for first_name, last_name in missing)
+            else:
+                model.objects.bulk_create(model(name=name) for name in missing)
+            # bulk_create() doesn't set the primary keys on every database
+            lookup(missing)
+            self.created[model] += len(missing)
+        return cache
+
+    def import_batch(self, records):
+        """Import the clean records of a batch, in one transaction."""
+        with transaction.atomic():
+            languages = self.resolve(Language, {record['language'] for record in records} | {
+                copy['language'] for record in records for copy in record['copies']
+            })
+            genres = self.resolve(Genre, {name for record in records for name in record['genres']})
+            authors = self.resolve(Author, {record['author'] for record in records})
+
+            book_ids = {}
+            for chunk in chunks({record['isbn'] for record in records}, LOOKUP_SIZE):
+                for isbn, pk in Book.objects.filter(isbn__in=chunk).values_list('isbn', 'pk').order_by('pk'):
+                    book_ids.setdefault(isbn, pk)
+            new_books = {}
+            for record in records:
+                if record['isbn'] in book_ids or record['isbn'] in new_books:
+                    self.duplicates += 1
+                    continue
+                author = Author(first_name=record['author'][0], last_name=record['author'][1]) if record['author'] else None
+                new_books[record['isbn']] = (Book(
+                    title=record['title'],
+                    summary=record['summary'],
+                    isbn=record['isbn'],
+                    author_id=authors.get(record['author']),
+                    language_id=languages.get(record['language']),
+                    # bulk_create() doesn't call save(), which sets the search document
+                    search_document=search_document(
+                        record['title'], record['isbn'], record['summary'], author,
+                        [Genre(name=name) for name in record['genres']],
+                    ),
+                ), record['genres'])
+            Book.objects.bulk_create(book for book, names in new_books.values())
+            for chunk in chunks(new_books, LOOKUP_SIZE):
+                book_ids.update(Book.objects.filter(isbn__in=chunk).values_list('isbn', 'pk'))
+
+            GenreLink = Book.genre.through
+            GenreLink.objects.bulk_create(
+                GenreLink(book_id=book_ids[isbn], genre_id=genres[name])
+                for isbn, (book, names) in new_books.items() for name in names
+            )
+            # The copy counters of the books are updated by BookInstance.objects.bulk_create()
+            copies = BookInstance.objects.bulk_create(
+                BookInstance(
+                    book_id=book_ids[record['isbn']],
+                    imprint=copy['imprint'],
+                    status=copy['status'],
+                    due_back=copy['due_back'],
+                    language_id=languages.get(copy['language']),
+                    **({'id': copy['id']} if copy['id'] else {}),
+                )
+                for record in records for copy in record['copies']
+            )
+        self.created[Book] += len(new_books)
+        self.created[BookInstance] += len(copies)
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint_file:
+                return json.load(checkpoint_file)['records']
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError) as e:
+            raise CommandError(f'Invalid checkpoint file {path}: {e}')
+
+    def write_checkpoint(self, path, records):
+        # Replaced atomically: a crash leaves the previous checkpoint
+        with open(f'{path}.tmp', 'w') as checkpoint_file:
+            json.dump({'records': records}, checkpoint_file)
+        os.replace(f'{path}.tmp', path)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            input_format = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension)
+            if input_format is None:
+                raise CommandError('Unknown input format: use --format.')
+        checkpoint = options['checkpoint'] or (f'{path}.checkpoint' if path != '-' else None)
+        skip = 0
+        if checkpoint and os.path.exists(checkpoint) and not options['resume']:
+            raise CommandError(f'A previous import left {checkpoint}: run again with --resume, or delete it.')
+        if options['resume']:
+            if not checkpoint:
+                raise CommandError('--resume needs --checkpoint when reading the standard input.')
+            skip = self.read_checkpoint(checkpoint)
+            self.stdout.write(f'Resuming after record {skip}.')
+
+        self.statuses = dict(BookInstance.LOAN_STATUS)
+        self.cache = {Language: {}, Genre: {}, Author: {}}
+        self.created = {Language: 0, Genre: 0, Author: 0, Book: 0, BookInstance: 0}
+        self.duplicates = 0
+        start = time.perf_counter()
+        records = 0
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            numbered = ((number, record) for number, record in self.read_records(stream, input_format) if number > skip)
+            for batch in chunks(numbered, options['batch_size']):
+                self.import_batch([self.clean(number, record) for number, record in batch])
+                records += len(batch)
+                if checkpoint:
+                    self.write_checkpoint(checkpoint, batch[-1][0])
+                if options['verbosity'] > 0:
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f'{records} records: {self.created[Book]} books, {self.created[BookInstance]} copies '
+                        f'({records / elapsed:.0f} records/s)'
+                    )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            invalidate_stats()
+            # bulk_create() doesn't send the signals bumping the versions of the cached pages
+            bump_version(Author, Book, Genre, Language)
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {records} records in {time.perf_counter() - start:.1f}s: {self.created[Book]} books '
+            f'({self.duplicates} known ISBNs), {self.created[BookInstance]} copies, {self.created[Author]} authors, '
+            f'{self.created[Genre]} genres, {self.created[Language]} languages.'
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book
+from catalog.caching import bump_version
+from catalog.stats import invalidate_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored copy counters of every book from its book instances.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of books updated per UPDATE statement (default 1000).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        book_ids = Book.objects.order_by('pk').values_list('pk', flat=True)
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(book_ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                updated += Book.objects.filter(pk__in=batch).refresh_copy_counts()
+            last_id = batch[-1]
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{updated} books updated')
+        invalidate_stats()
+        # update() doesn't send the signals bumping the versions of the cached pages
+        bump_version(Book)
+        self.stdout.write(self.style.SUCCESS(f'Copy counters rebuilt for {updated} books.'))
@@ -0,0 +1,105 @@
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from catalog import tasks
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the background tasks queued in the database (see catalog.tasks), with a pool of threads or '
+        'processes, and enqueue the scheduled ones (CATALOG_TASKS_SCHEDULE). The locks of the running tasks are '
+        'refreshed every CATALOG_TASKS_HEARTBEAT seconds. Stops on SIGTERM or SIGINT once the running tasks are finished.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'CATALOG_TASKS_CONCURRENCY', 4),
+            help='Tasks run at once (default CATALOG_TASKS_CONCURRENCY, 4).',
+        )
+        parser.add_argument(
+            '--pool', choices=['thread', 'process'], default='thread',
+            help='Run the tasks in threads (default), or in processes for CPU-bound tasks.',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls of an empty queue (default 1).')
+        parser.add_argument('--burst', action='store_true', help='Exit once no task is due, instead of polling.')
+        parser.add_argument('--no-schedule', action='store_true', help="Don't enqueue the scheduled tasks.")
+
+    def handle(self, *args, **options):
+        autodiscover_modules('tasks')
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        concurrency = options['concurrency']
+        if options['pool'] == 'process':
+            # Spawned, not forked: a child must not share the database connections of the parent.
+            # Its tasks modules are imported by their names (see tasks.get_task()).
+            executor = concurrent.futures.ProcessPoolExecutor(
+                concurrency, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+            )
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='task')
+
+        self.stopping = False
+
+        def stop(signum, frame):
+            self.stopping = True
+        handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+
+        self.stdout.write(f'Worker {worker}: {concurrency} {options["pool"]}(s).')
+        running = {}
+        last_periods = {}
+        counts = {}
+        start = last_beat = time.perf_counter()
+        try:
+            while not self.stopping:
+                close_old_connections()
+                if not options['no_schedule']:
+                    tasks.schedule(timezone.now(), last_periods)
+                free = concurrency - len(running)
+                claimed = tasks.claim(worker, free) if free else []
+                for task_id, token in claimed:
+                    running[executor.submit(tasks.run_task, task_id, token)] = (task_id, token)
+                if time.perf_counter() - last_beat >= tasks.HEARTBEAT:
+                    tasks.heartbeat(list(running.values()))
+                    last_beat = time.perf_counter()
+                if not running:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                # Wait for a task to finish, polling the queue meanwhile when the pool has room,
+                # and beating in time anyway
+                timeout = tasks.HEARTBEAT if len(running) >= concurrency else min(options['poll_interval'], tasks.HEARTBEAT)
+                done, pending = concurrent.futures.wait(
+                    running, timeout=timeout,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    task_id, token = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # The database failed while recording the result: the lock timeout retries the task
+                        self.stderr.write(f'Task {task_id}: {e}')
+                        result = 'error'
+                    counts[result] = counts.get(result, 0) + 1
+        finally:
+            executor.shutdown(wait=True)
+            connections.close_all()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+        summary = ', '.join(f'{count} {result}' for result, count in sorted(counts.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Ran {total} tasks in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f}/s): {summary or "none"}.'
+        ))
@@ -0,0 +1,197 @@
+import datetime
+import math
+import random
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from catalog.models import Author, Book, BookInstance, Genre, Language, search_document
+from catalog.caching import bump_version
+from catalog.stats import invalidate_stats
+
+FIRST_NAMES = [
+    'Alice', 'Antoine', 'Ben', 'Charlotte', 'Chinua', 'Clara', 'David', 'Doris', 'Elena', 'Emile',
+    'Franz', 'George', 'Gabriel', 'Hannah', 'Haruki', 'Isabel', 'Jane', 'John', 'Jorge', 'Karen',
+    'Leo', 'Louise', 'Marcel', 'Margaret', 'Maya', 'Naguib', 'Olga', 'Paul', 'Rosa', 'Salman',
+    'Simone', 'Terry', 'Toni', 'Umberto', 'Victor', 'Virginia', 'Wole', 'Yukio', 'Zadie', 'Zora',
+]
+LAST_NAMES = [
+    'Achebe', 'Austen', 'Borges', 'Bronte', 'Calvino', 'Camus', 'Christie', 'Dickens', 'Duras', 'Eco',
+    'Eliot', 'Ferrante', 'Flaubert', 'Garcia', 'Hugo', 'Ishiguro', 'Kafka', 'Lessing', 'Mahfouz', 'Mann',
+    'Morrison', 'Murakami', 'Nabokov', 'Orwell', 'Pratchett', 'Proust', 'Rushdie', 'Sand', 'Smith', 'Soyinka',
+    'Tolstoy', 'Twain', 'Undset', 'Verne', 'Walker', 'Woolf', 'Yourcenar', 'Zola', 'Mishima', 'Allende',
+]
+GENRES = [
+    'Fiction', 'Science Fiction', 'Fantasy', 'Mystery', 'Thriller', 'Romance', 'Historical Fiction', 'Horror',
+    'Poetry', 'Drama', 'Biography', 'History', 'Philosophy', 'Science', 'Travel', 'Children', 'Young Adult',
+    'Comics', 'Cooking', 'Art', 'Religion', 'Essays', 'Humor', 'Politics', 'Economics', 'Psychology',
+    'Mathematics', 'Nature', 'Music', 'Sports',
+]
+LANGUAGES = [
+    'English', 'French', 'Spanish', 'German', 'Italian', 'Portuguese', 'Russian', 'Japanese', 'Chinese',
+    'Arabic', 'Dutch', 'Swedish', 'Polish', 'Greek', 'Turkish', 'Hindi', 'Korean', 'Czech', 'Danish', 'Norwegian',
+]
+WORDS = [
+    'night', 'river', 'shadow', 'garden', 'city', 'winter', 'silence', 'empire', 'stranger', 'memory',
+    'island', 'fire', 'journey', 'mirror', 'storm', 'house', 'secret', 'road', 'sea', 'dream',
+    'war', 'light', 'stone', 'glass', 'forest', 'letter', 'clock', 'crown', 'wolf', 'summer',
+]
+IMPRINTS = ['Penguin', 'Gallimard', 'Vintage', 'Faber', 'Folio', 'Knopf', 'Picador', 'Seuil', 'Anagrama', 'Suhrkamp']
+
+# Share of the copies in each loan status
+STATUS_WEIGHTS = (('a', 50), ('o', 30), ('m', 15), ('r', 5))
+
+
+def names(base, count):
+    """Return count distinct names, numbering the base names once they are all used."""
+    return [base[i % len(base)] + (f' {i // len(base) + 1}' if i >= len(base) else '') for i in range(count)]
+
+
+def rng_uuid(rng):
+    """Return a version 4 UUID drawn from rng, so that copy ids are reproducible too."""
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a large synthetic catalog (authors, books, genres, languages, copies and borrowers) '
+        'for performance work. The same seed and options generate the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=1000, help='Number of authors (default 1000).')
+        parser.add_argument('--books', type=int, default=10000, help='Number of books (default 10000).')
+        parser.add_argument('--copies-per-book', type=float, default=3, help='Average number of copies per book (default 3).')
+        parser.add_argument('--users', type=int, default=500, help='Number of borrowers (default 500).')
+        parser.add_argument('--genres', type=int, default=len(GENRES), help=f'Number of genres (default {len(GENRES)}).')
+        parser.add_argument('--languages', type=int, default=len(LANGUAGES), help=f'Number of languages (default {len(LANGUAGES)}).')
+        parser.add_argument('--seed', type=int, default=42, help='Seed of the random generator (default 42).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows generated and inserted per transaction (default 5000).')
+
+    def next_id(self, model):
+        return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    def bulk_insert(self, model, objs):
+        """Insert objs in batches, each in its own transaction (bulk_create() splits them to the database limits)."""
+        for start in range(0, len(objs), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(objs[start:start + self.batch_size])
+
+    def log(self, message):
+        if self.verbosity > 0:
+            self.stdout.write(f'{message} ({time.perf_counter() - self.start:.1f}s)')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.start = time.perf_counter()
+        rng = random.Random(options['seed'])
+        today = datetime.date.today()
+
+        # Primary keys are set explicitly: bulk_create() doesn't return them on every database
+        genre_id = self.next_id(Genre)
+        genres = [Genre(id=genre_id + i, name=name) for i, name in enumerate(names(GENRES, options['genres']))]
+        self.bulk_insert(Genre, genres)
+        language_id = self.next_id(Language)
+        languages = [Language(id=language_id + i, name=name) for i, name in enumerate(names(LANGUAGES, options['languages']))]
+        self.bulk_insert(Language, languages)
+        self.log(f'{len(genres)} genres, {len(languages)} languages')
+
+        # Borrowers share one password hash (hashing is slow on purpose)
+        password = make_password(None)
+        user_id = self.next_id(User)
+        users = [
+            User(id=user_id + i, username=f'patron{user_id + i}', password=password,
+                 first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES))
+            for i in range(options['users'])
+        ]
+        self.bulk_insert(User, users)
+        self.log(f'{len(users)} users')
+
+        author_id = self.next_id(Author)
+        authors = []
+        for i in range(options['authors']):
+            born = datetime.date(rng.randint(1800, 1990), rng.randint(1, 12), rng.randint(1, 28))
+            died = born + datetime.timedelta(days=rng.randint(40, 95) * 365) if rng.random() < 0.4 else None
+            authors.append(Author(
+                id=author_id + i,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                date_of_birth=born if rng.random() < 0.8 else None,
+                date_of_death=died if died and died < today else None,
+            ))
+        self.bulk_insert(Author, authors)
+        self.log(f'{len(authors)} authors')
+
+        # Books are generated in batches with their genre links and copies, to keep memory flat.
+        # Few authors write many books and few books have many copies (skewed distributions);
+        # most books are in the first languages.
+        sigma = 1.0
+        mu = math.log(options['copies_per_book']) - sigma ** 2 / 2 if options['copies_per_book'] > 0 else None
+        statuses = [status for status, weight in STATUS_WEIGHTS]
+        weights = [weight for status, weight in STATUS_WEIGHTS]
+        GenreLink = Book.genre.through
+        book_id = self.next_id(Book)
+        num_books = num_copies = 0
+        for batch_start in range(0, options['books'], self.batch_size):
+            books, links, copies = [], [], []
+            for i in range(batch_start, min(batch_start + self.batch_size, options['books'])):
+                author = authors[int(len(authors) * rng.random() ** 3)] if authors else None
+                language = languages[int(len(languages) * rng.random() ** 4)] if languages else None
+                title = ' '.join(rng.choice(WORDS) for word in range(rng.randint(1, 4))).capitalize()
+                book = Book(
+                    id=book_id + i,
+                    title=f'The {title}' if rng.random() < 0.3 else title,
+                    author=author,
+                    summary=' '.join(rng.choice(WORDS) for word in range(rng.randint(10, 60))).capitalize() + '.',
+                    isbn=str(9780000000000 + rng.randrange(10 ** 10)),
+                    language=language,
+                )
+                book_genres = rng.sample(genres, min(len(genres), rng.randint(1, 3)))
+                # bulk_create() doesn't call save(), which sets the search document
+                book.search_document = search_document(book.title, book.isbn, book.summary, author, book_genres)
+                books.append(book)
+                for genre in book_genres:
+                    links.append(GenreLink(book_id=book.id, genre_id=genre.id))
+                book_copies = int(rng.lognormvariate(mu, sigma)) if mu is not None else 0
+                for status in rng.choices(statuses, weights, k=book_copies):
+                    borrower, due_back = None, None
+                    if status == 'o':
+                        borrower = rng.choice(users) if users else None
+                        due_back = today + datetime.timedelta(days=rng.randint(-30, 28))
+                    elif status == 'm' and rng.random() < 0.5:
+                        due_back = today + datetime.timedelta(days=rng.randint(1, 60))
+                    copies.append(BookInstance(
+                        id=rng_uuid(rng),
+                        book=book,
+                        language=language if rng.random() < 0.8 or not languages else rng.choice(languages),
+                        imprint=f'{rng.choice(IMPRINTS)}, {rng.randint(1950, today.year)}',
+                        due_back=due_back,
+                        status=status,
+                        borrower=borrower,
+                    ))
+            self.bulk_insert(Book, books)
+            self.bulk_insert(GenreLink, links)
+            # The copy counters of the books are updated by BookInstance.objects.bulk_create()
+            self.bulk_insert(BookInstance, copies)
+            num_books += len(books)
+            num_copies += len(copies)
+            self.log(f'{num_books} books, {num_copies} copies')
+
+        # Explicit primary keys don't move PostgreSQL sequences forward
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Genre, Language, User, Author, Book]):
+                cursor.execute(sql)
+        invalidate_stats()
+        # bulk_create() doesn't send the signals bumping the versions of the cached pages
+        bump_version(Author, Book, Genre, Language)
+        self.stdout.write(self.style.SUCCESS(
+            f'Catalog seeded with {len(authors)} authors, {num_books} books, {num_copies} copies '
+            f'and {len(users)} users in {time.perf_counter() - self.start:.1f}s.'
+        ))
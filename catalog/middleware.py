@@ -0,0 +1,94 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+
+from catalog import profiling
+
+logger = logging.getLogger('catalog.performance')
+
+
+class PerformanceMiddleware:
+    """
+    Measure sampled requests: query count and time, template render time, session load/save time and total time.
+
+    The measures of a sampled request are sent in a Server-Timing header and logged (INFO) on the
+    'catalog.performance' logger, with the name of the resolved URL. Requests over the query or latency
+    budget are logged as warnings; the latency of every request is checked, sampled or not.
+    Put it first in MIDDLEWARE, so that the session save and the other middleware are measured too.
+
+    Settings:
+    - CATALOG_PERF_SAMPLE_RATE: share of the requests measured, from 0 to 1
+    - CATALOG_PERF_QUERY_BUDGET: maximum number of queries of a request
+    - CATALOG_PERF_LATENCY_BUDGET_MS: maximum duration of a request, in milliseconds
+    - CATALOG_PERF_SERVER_TIMING: whether to send the Server-Timing header (default: DEBUG)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'CATALOG_PERF_SAMPLE_RATE', 0.1)
+        self.query_budget = getattr(settings, 'CATALOG_PERF_QUERY_BUDGET', 20)
+        self.latency_budget = getattr(settings, 'CATALOG_PERF_LATENCY_BUDGET_MS', 500)
+        self.server_timing = getattr(settings, 'CATALOG_PERF_SERVER_TIMING', settings.DEBUG)
+        profiling.install()
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            total_ms = (time.perf_counter() - start) * 1000
+            if total_ms > self.latency_budget:
+                logger.warning(
+                    'over budget: url=%s path=%s status=%s total_ms=%.1f',
+                    self.url_name(request), request.path, response.status_code, total_ms,
+                )
+            return response
+
+        with profiling.profile() as measures:
+            response = self.get_response(request)
+        timings = measures.as_dict()
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join([
+                f'app;dur={timings["total_ms"]:.1f}',
+                f'db;dur={timings["sql_ms"]:.1f};desc="{measures.queries} queries"',
+                f'tpl;dur={timings["template_ms"]:.1f}',
+                f'session;dur={timings["session_ms"]:.1f}',
+            ])
+
+        over_budget = measures.queries > self.query_budget or timings['total_ms'] > self.latency_budget
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            '%s: url=%s path=%s status=%s queries=%d sql_ms=%.1f template_ms=%.1f session_ms=%.1f total_ms=%.1f',
+            'over budget' if over_budget else 'request',
+            self.url_name(request), request.path, response.status_code, measures.queries,
+            timings['sql_ms'], timings['template_ms'], timings['session_ms'], timings['total_ms'],
+        )
+        return response
+
+    def url_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return (match.view_name if match else None) or '-'
+
+
+class SessionlessAnonymousMiddleware:
+    """
+    Set request.user to AnonymousUser, without loading the session, on the requests without a session cookie.
+
+    Reading the user through the session marks the session accessed, and SessionMiddleware then adds
+    Vary: Cookie to the response: the public pages of anonymous visitors (see
+    catalog.caching.patch_public_cache_control()) would be kept by a front proxy per cookie, analytics
+    and CSRF cookies included. Without a session cookie the session is empty and the user anonymous anyway.
+    Put it right after AuthenticationMiddleware in MIDDLEWARE. The front proxy must pass the requests
+    with a session cookie, whose pages are private.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            request.user = AnonymousUser()
+        return self.get_response(request)
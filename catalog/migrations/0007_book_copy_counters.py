@@ -0,0 +1,58 @@
+# Generated by Django 2.2.4 on 2026-10-18 06:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+    def count(**filters):
+        return Coalesce(Subquery(copies.filter(**filters).annotate(count=Count('pk')).values('count')), 0)
+
+    Book.objects.update(
+        num_instances=count(),
+        num_instances_available=count(status='a'),
+        num_instances_reserved=count(status='r'),
+        num_instances_loan=count(status='o'),
+        num_instances_maintenance=count(status='m'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_auto_20190724_1207'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='num_instances',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='copies'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_instances_available',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='available copies'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_instances_loan',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='copies on loan'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_instances_maintenance',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='copies in maintenance'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_instances_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='reserved copies'),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
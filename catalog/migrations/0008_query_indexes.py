@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+from catalog.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Indexes built concurrently (see catalog.operations.AddIndexConcurrently)
+    atomic = False
+
+    dependencies = [
+        ('catalog', '0007_book_copy_counters'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='bookinstance',
+            index=models.Index(fields=['status', 'due_back', 'id'], name='bookinst_status_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='bookinstance',
+            index=models.Index(fields=['borrower', 'status', 'due_back', 'id'], name='bookinst_borrower_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='book',
+            index=models.Index(fields=['title'], name='book_title_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='author',
+            index=models.Index(fields=['last_name', 'first_name'], name='author_name_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+from catalog.search import install_search_index, uninstall_search_index
+
+
+def fill_search_documents(apps, schema_editor):
+    """Set the search document of the existing books (same text as models.search_document())."""
+    Book = apps.get_model('catalog', 'Book')
+    books = Book.objects.using(schema_editor.connection.alias).select_related('author').prefetch_related('genre').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(books.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            break
+        for book in batch:
+            parts = [book.title, book.isbn, book.summary]
+            if book.author is not None:
+                parts += [book.author.first_name, book.author.last_name]
+            parts += [genre.name for genre in book.genre.all()]
+            book.search_document = '\n'.join(part for part in parts if part)
+        Book.objects.using(schema_editor.connection.alias).bulk_update(batch, ['search_document'])
+        last_pk = batch[-1].pk
+
+
+def create_search_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # The search index is built concurrently (see catalog.search.install_search_index())
+    atomic = False
+
+    dependencies = [
+        ('catalog', '0008_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_document',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+from catalog.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Indexes built concurrently (see catalog.operations.AddIndexConcurrently)
+    atomic = False
+
+    dependencies = [
+        ('catalog', '0009_book_search'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='book',
+            index=models.Index(fields=['isbn'], name='book_isbn_idx'),
+        ),
+    ]
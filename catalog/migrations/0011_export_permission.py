@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-18 06:42
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_book_isbn_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='book',
+            options={'ordering': ['title'], 'permissions': (('can_edit_book', 'Can edit book data'), ('can_export_catalog', 'Can export the catalog'))},
+        ),
+    ]
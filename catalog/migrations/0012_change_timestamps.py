@@ -0,0 +1,47 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+from catalog.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Indexes built concurrently (see catalog.operations.AddIndexConcurrently)
+    atomic = False
+
+    dependencies = [
+        ('catalog', '0011_export_permission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='updated'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='updated'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='last_changed',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='last changed'),
+        ),
+        migrations.AddField(
+            model_name='bookinstance',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='updated'),
+            preserve_default=False,
+        ),
+        AddIndexConcurrently(
+            model_name='book',
+            index=models.Index(fields=['last_changed'], name='book_last_changed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='author',
+            index=models.Index(fields=['updated_at'], name='author_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.4 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_change_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageView',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('book', 'Book'), ('author', 'Author'), ('index', 'Home page')], max_length=10, verbose_name='page')),
+                ('object_id', models.PositiveIntegerField(verbose_name='object id')),
+                ('views', models.BigIntegerField(default=0, verbose_name='views')),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from catalog.operations import CreatePartialIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # The books with a copy available, by title, for the "available now" lists (see
+    # BookQuerySet.available()): their pages and count read this smaller index instead of
+    # book_title_idx. The counter is a column too, so that counting these books needs no
+    # table read (SQLite checks the WHERE term again). Built concurrently on the live table
+    # (see catalog.operations).
+    atomic = False
+
+    dependencies = [
+        ('catalog', '0017_holds'),
+    ]
+
+    operations = [
+        CreatePartialIndexConcurrently(
+            'book_available_title_idx', 'catalog_book', ['title', 'num_instances_available'], 'num_instances_available > 0',
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.commands.createcachetable import Command as CreateCacheTable
+from django.db import migrations
+
+CACHE_TABLE = getattr(settings, 'CATALOG_CACHE_TABLE', 'catalog_cache')
+
+
+def create_cache_table(apps, schema_editor):
+    command = CreateCacheTable()
+    command.verbosity = 0
+    command.create_table(schema_editor.connection.alias, CACHE_TABLE, dry_run=False)
+
+
+class Migration(migrations.Migration):
+    # The table of the database cache shared by the web and worker processes (see CACHES),
+    # created by name whatever cache backend is configured when migrating, so that the
+    # deployments may fall back to it; existing tables are skipped.
+
+    dependencies = [
+        ('catalog', '0018_book_available_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 2.2.4 on 2026-10-18 08:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The labels, help texts, choices and orderings set on the models since 0006 but never
+    # migrated: they only change the state of the models, not the tables (altering the fields
+    # on SQLite would copy the whole tables)
+
+    dependencies = [
+        ('catalog', '0020_book_available_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterModelOptions(
+                name='genre',
+                options={'ordering': ['name']},
+            ),
+            migrations.AlterModelOptions(
+                name='language',
+                options={'ordering': ['name']},
+            ),
+            migrations.AlterField(
+                model_name='author',
+                name='date_of_birth',
+                field=models.DateField(blank=True, null=True, verbose_name='birth date'),
+            ),
+            migrations.AlterField(
+                model_name='author',
+                name='date_of_death',
+                field=models.DateField(blank=True, null=True, verbose_name='died'),
+            ),
+            migrations.AlterField(
+                model_name='author',
+                name='first_name',
+                field=models.CharField(max_length=100, verbose_name='first name'),
+            ),
+            migrations.AlterField(
+                model_name='author',
+                name='last_name',
+                field=models.CharField(max_length=100, verbose_name='last name'),
+            ),
+            migrations.AlterField(
+                model_name='book',
+                name='isbn',
+                field=models.CharField(help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn" target="_blank">ISBN number</a>', max_length=13, verbose_name='ISBN'),
+            ),
+            migrations.AlterField(
+                model_name='book',
+                name='summary',
+                field=models.TextField(help_text='Enter a brief description of the book', max_length=1000, verbose_name='summary'),
+            ),
+            migrations.AlterField(
+                model_name='book',
+                name='title',
+                field=models.CharField(max_length=200, verbose_name='title'),
+            ),
+            migrations.AlterField(
+                model_name='bookinstance',
+                name='due_back',
+                field=models.DateField(blank=True, null=True, verbose_name='due back'),
+            ),
+            migrations.AlterField(
+                model_name='bookinstance',
+                name='imprint',
+                field=models.CharField(max_length=200, verbose_name='imprint'),
+            ),
+            migrations.AlterField(
+                model_name='bookinstance',
+                name='status',
+                field=models.CharField(blank=True, choices=[('m', 'Maintenance'), ('o', 'On loan'), ('a', 'Available'), ('r', 'Reserved')], default='m', help_text='Book availability', max_length=1, verbose_name='status'),
+            ),
+            migrations.AlterField(
+                model_name='genre',
+                name='name',
+                field=models.CharField(help_text='Enter a book genre (e.g. Science Fiction)', max_length=200, verbose_name='genre'),
+            ),
+            migrations.AlterField(
+                model_name='language',
+                name='name',
+                field=models.CharField(help_text='Enter a language (e.g. English)', max_length=40, verbose_name='language'),
+            ),
+        ]),
+    ]
@@ -1,7 +1,11 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import BooleanField, Case, Count, Exists, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from django.urls import reverse # Used to generate URLs by reversing the URL patterns
+from django.utils import timezone
 import uuid # Required for unique book instances
-from datetime import date
+from datetime import date, timedelta
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 
@@ -29,6 +33,60 @@ class Language(models.Model):
     class Meta:
         ordering = ['name']
 
+# Sent after bulk operations on book instances (queryset update, delete and bulk_create),
+# which don't send post_save / post_delete. 'book_ids' is the set of books whose copies changed.
+copies_changed = Signal(providing_args=['book_ids'])
+
+# Book copy counters, by book instance status
+STATUS_COUNTERS = (
+    ('num_instances_available', 'a'),
+    ('num_instances_reserved', 'r'),
+    ('num_instances_loan', 'o'),
+    ('num_instances_maintenance', 'm'),
+)
+COPY_COUNTERS = ('num_instances',) + tuple(name for name, status in STATUS_COUNTERS)
+
+def search_document(title, isbn, summary, author=None, genres=()):
+    """Return the text of a book indexed by the catalog search (see catalog.search)."""
+    parts = [title, isbn, summary]
+    if author is not None:
+        parts += [author.first_name, author.last_name]
+    parts += [genre.name for genre in genres]
+    return '\n'.join(part for part in parts if part)
+
+class BookQuerySet(models.QuerySet):
+    def refresh_search_documents(self, batch_size=1000):
+        """Rebuild the search documents of the books of this queryset, in batches of batch_size books."""
+        books = self.select_related('author').prefetch_related('genre').order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(books.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for book in batch:
+                book.search_document = book.get_search_document()
+            Book.objects.bulk_update(batch, ['search_document'])
+            last_pk = batch[-1].pk
+
+    def refresh_copy_counts(self):
+        """Recompute the stored copy counters of the books of this queryset, in one UPDATE statement."""
+        copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+        def count_copies(**filters):
+            return Coalesce(Subquery(copies.filter(**filters).annotate(count=Count('pk')).values('count')), 0)
+
+        counters = {name: count_copies(status=status) for name, status in STATUS_COUNTERS}
+        # Copy changes are book changes for the pages listing them (see last_changed)
+        return self.update(num_instances=count_copies(), last_changed=timezone.now(), **counters)
+
+    def touch(self):
+        """Mark the books of this queryset as changed (e.g. when their genres or author changed)."""
+        return self.update(last_changed=timezone.now())
+
+    def available(self):
+        """Return the books with a copy available, from their stored counter (see book_available_title_idx)."""
+        return self.filter(num_instances_available__gt=0)
+
 class Book(models.Model):
     """Model representing a book (but not a specific copy of a book)."""
     title = models.CharField(_('title'), max_length=200)
@@ -45,9 +103,40 @@ class Book(models.Model):
     genre = models.ManyToManyField(Genre, help_text=_('Select one or several genre(s) for this book'))
     language = models.ForeignKey(Language, on_delete=models.SET_NULL, null=True, help_text=_('Select the language of the original version of this book'))
 
+    # Title, ISBN, summary, author and genre names, as indexed by the catalog search (see catalog.search).
+    # It is rebuilt by save(), and by the receivers of catalog.signals when genres or the author change.
+    search_document = models.TextField(default='', editable=False)
+
+    # Copy counters, maintained when book instances are saved or deleted (see BookInstance and BookInstanceQuerySet).
+    # They can be rebuilt from scratch with 'manage.py rebuild_copy_counts'.
+    num_instances = models.PositiveIntegerField(_('copies'), default=0, editable=False)
+    num_instances_available = models.PositiveIntegerField(_('available copies'), default=0, editable=False)
+    num_instances_reserved = models.PositiveIntegerField(_('reserved copies'), default=0, editable=False)
+    num_instances_loan = models.PositiveIntegerField(_('copies on loan'), default=0, editable=False)
+    num_instances_maintenance = models.PositiveIntegerField(_('copies in maintenance'), default=0, editable=False)
+
+    updated_at = models.DateTimeField(_('updated'), auto_now=True)
+    # Last change of the book, of its copies, genres or author: the version of the pages displaying it
+    last_changed = models.DateTimeField(_('last changed'), default=timezone.now, editable=False)
+
+    objects = BookQuerySet.as_manager()
+
     class Meta:
-        permissions = (("can_edit_book", "Can edit book data"),)
+        permissions = (
+            ("can_edit_book", "Can edit book data"),
+            ("can_export_catalog", "Can export the catalog"),
+        )
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title'], name='book_title_idx'),
+            # Books are deduplicated on ISBN by the import_catalog command
+            models.Index(fields=['isbn'], name='book_isbn_idx'),
+            # Max(last_changed) versions the book list (see catalog.caching.ConditionalGetMixin)
+            models.Index(fields=['last_changed'], name='book_last_changed_idx'),
+        ]
+        # The books available, by title, are also indexed by book_available_title_idx, a partial
+        # index (WHERE num_instances_available > 0) created by migration 0018, and by author and
+        # language for their facet counts by the partial indexes of migration 0020
 
     def __str__(self):
         """String for representing the Model object."""
@@ -59,10 +148,81 @@ class Book(models.Model):
 
     display_genre.short_description = _('Genre')
 
+    def get_search_document(self):
+        """Return the current search document of the book (the genres of a saved book only)."""
+        genres = self.genre.all() if self.pk else ()
+        return search_document(self.title, self.isbn, self.summary, self.author, genres)
+
+    def save(self, *args, **kwargs):
+        self.search_document = self.get_search_document()
+        self.last_changed = timezone.now()
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            # The copy counters of the instance may be older than those stored by the copies: leave them out
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COPY_COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         """Returns the url to access a detail record for this book."""
         return reverse('book-detail', args=[str(self.id)])
 
+class BookInstanceQuerySet(models.QuerySet):
+    """Bulk operations on book instances, keeping the copy counters of their books up to date."""
+    def _copies_changed(self, book_ids, serve_holds=True):
+        book_ids = {book_id for book_id in book_ids if book_id is not None}
+        if book_ids:
+            if serve_holds:
+                # Whatever made them available (a return, a new copy, an admin edit), the copies
+                # of a book go to the patrons waiting for it before going back on the shelf
+                Hold.objects.serve(book_ids)
+            Book.objects.filter(pk__in=book_ids).refresh_copy_counts()
+            copies_changed.send(sender=self.model, book_ids=book_ids)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._copies_changed(obj.book_id for obj in objs)
+        return objs
+
+    def update(self, **kwargs):
+        # auto_now is only applied by save()
+        kwargs.setdefault('updated_at', timezone.now())
+        if 'book' in kwargs or 'book_id' in kwargs:
+            # Copies may move to other books: get the new books of the updated rows afterwards
+            pks, book_ids = set(), set()
+            for pk, book_id in self.values_list('pk', 'book_id'):
+                pks.add(pk)
+                book_ids.add(book_id)
+            rows = super().update(**kwargs)
+            book_ids.update(BookInstance.objects.filter(pk__in=pks).values_list('book_id', flat=True))
+        else:
+            book_ids = set(self.order_by().values_list('book_id', flat=True).distinct())
+            rows = super().update(**kwargs)
+        # No hold to serve unless copies may have become available (or moved to other books)
+        status = kwargs.get('status')
+        available = status == 'a' or hasattr(status, 'resolve_expression') or 'book' in kwargs or 'book_id' in kwargs
+        self._copies_changed(book_ids, serve_holds=available)
+        return rows
+
+    def delete(self):
+        book_ids = set(self.order_by().values_list('book_id', flat=True).distinct())
+        deleted = super().delete()
+        self._copies_changed(book_ids)
+        return deleted
+
+    def with_overdue(self):
+        """Annotate the copies with overdue, the BookInstance.is_overdue flag computed by the database."""
+        return self.annotate(overdue=Case(
+            When(due_back__lt=date.today(), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        ))
+
+    def overdue_loans(self, days=1):
+        """Return the copies on loan due back at least days days ago (an index range on status and due_back)."""
+        return self.filter(status='o', due_back__lte=date.today() - timedelta(days=days))
+
 class BookInstance(models.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed from the library)."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, help_text=_('Unique ID for this particular book across whole library'))
@@ -88,10 +248,18 @@ class BookInstance(models.Model):
     )
 
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    updated_at = models.DateTimeField(_('updated'), auto_now=True)
+
+    objects = BookInstanceQuerySet.as_manager()
 
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        # Copies are listed by status (and borrower), in (due_back, id) order: see catalog.pagination
+        indexes = [
+            models.Index(fields=['status', 'due_back', 'id'], name='bookinst_status_due_idx'),
+            models.Index(fields=['borrower', 'status', 'due_back', 'id'], name='bookinst_borrower_due_idx'),
+        ]
 
     def __str__(self):
         """String for representing the Model object."""
@@ -111,8 +279,33 @@ class BookInstance(models.Model):
 
     display_title.short_description = 'Title'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded book, to update its copy counters if the copy moves to another book
+        instance._loaded_book_id = dict(zip(field_names, values)).get('book_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.status == 'a' and self.book_id is not None and self.pk in Hold.objects.serve({self.book_id}):
+            # Reserved for the first patron waiting for the book (see HoldQuerySet.serve())
+            self.refresh_from_db(fields=['status', 'borrower', 'due_back'])
+        book_ids = {self.book_id, getattr(self, '_loaded_book_id', None)} - {None}
+        if book_ids:
+            Book.objects.filter(pk__in=book_ids).refresh_copy_counts()
+        self._loaded_book_id = self.book_id
+
+    def delete(self, *args, **kwargs):
+        book_id = self.book_id
+        deleted = super().delete(*args, **kwargs)
+        if book_id is not None:
+            Book.objects.filter(pk=book_id).refresh_copy_counts()
+        return deleted
+
     @property
     def is_overdue(self):
+        # Lists annotate their copies with overdue instead: see BookInstanceQuerySet.with_overdue()
         if self.due_back and date.today() > self.due_back:
             return True
         return False
@@ -123,10 +316,15 @@ class Author(models.Model):
     last_name = models.CharField(_('last name'), max_length=100)
     date_of_birth = models.DateField(_('birth date'), null=True, blank=True)
     date_of_death = models.DateField(_('died'), null=True, blank=True)
+    updated_at = models.DateTimeField(_('updated'), auto_now=True)
 
     class Meta:
         ordering = ['last_name', 'first_name']
         permissions = (("can_edit_author", "Can edit author data"),)
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='author_name_idx'),
+            models.Index(fields=['updated_at'], name='author_updated_idx'),
+        ]
 
     def get_absolute_url(self):
         """Returns the url to access a particular author instance."""
@@ -135,3 +333,207 @@ class Author(models.Model):
     def __str__(self):
         """String for representing the Model object."""
         return f'{self.last_name}, {self.first_name}'
+
+class PageViewQuerySet(models.QuerySet):
+    def views(self, kind, object_id):
+        """Return the flushed number of views of a page (see catalog.counters)."""
+        return self.filter(kind=kind, object_id=object_id).values_list('views', flat=True).first() or 0
+
+class PageView(models.Model):
+    """
+    Number of views of a page, counted in memory and flushed in bulk (see catalog.counters).
+
+    object_id is the book or author viewed, or for the home page the visiting user.
+    """
+    BOOK = 'book'
+    AUTHOR = 'author'
+    INDEX = 'index'
+    KINDS = (
+        (BOOK, _('Book')),
+        (AUTHOR, _('Author')),
+        (INDEX, _('Home page')),
+    )
+
+    kind = models.CharField(_('page'), max_length=10, choices=KINDS)
+    object_id = models.PositiveIntegerField(_('object id'))
+    views = models.BigIntegerField(_('views'), default=0)
+
+    objects = PageViewQuerySet.as_manager()
+
+    class Meta:
+        # The key of the bulk upserts of catalog.counters.flush()
+        unique_together = [('kind', 'object_id')]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}: {self.views}'
+
+class OverdueNotice(models.Model):
+    """
+    An overdue loan notified to its borrower (see the send_overdue_notices command).
+
+    A loan is notified once per due date: a rerun skips it, a renewal makes it due to be notified again.
+    """
+    bookinstance = models.ForeignKey(BookInstance, on_delete=models.CASCADE)
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE)
+    due_back = models.DateField(_('due back'))
+    sent_at = models.DateTimeField(_('sent'), auto_now_add=True)
+
+    class Meta:
+        # Also the key checked (and the conflict ignored) by send_overdue_notices
+        unique_together = [('bookinstance', 'borrower', 'due_back')]
+
+    def __str__(self):
+        return f'{self.bookinstance_id} due {self.due_back}, notified to {self.borrower_id}'
+
+class HoldQuerySet(models.QuerySet):
+    def serve(self, book_ids):
+        """
+        Reserve the available copies of the books book_ids for their first waiting holds, and return the
+        set of the copies reserved. The caller refreshes the copy counters of the books.
+
+        One query finds the available copies of the books that have waiting holds (checked on the hold queue
+        index), so that the copy changes of the other books cost nothing more. The holds of a book are read
+        in queue order, locked with SKIP LOCKED where supported so that concurrent returns of a bestseller
+        take the next holds instead of waiting, and each copy is reserved with a conditional UPDATE.
+        Without SKIP LOCKED (SQLite) a concurrent call may serve the same hold first: the hold is only
+        made ready while it waits, and otherwise its copy is released and offered to the next holds.
+        """
+        waiting = Hold.objects.filter(book=OuterRef('book_id'), status=Hold.WAITING)
+        available = BookInstance.objects.filter(book_id__in=book_ids, status='a').annotate(held=Exists(waiting)).filter(held=True)
+        copies = {}
+        for copy_id, book_id in available.order_by().values_list('pk', 'book_id'):
+            copies.setdefault(book_id, []).append(copy_id)
+        reserved = set()
+        if not copies:
+            return reserved
+        with transaction.atomic(savepoint=False):
+            now = timezone.now()
+            for book_id, copy_ids in copies.items():
+                while copy_ids:
+                    holds = self.filter(book_id=book_id, status=Hold.WAITING).order_by('created_at', 'pk')
+                    if connection.features.has_select_for_update_skip_locked:
+                        holds = holds.select_for_update(skip_locked=True)
+                    released = []
+                    for (hold_id, patron_id), copy_id in zip(holds.values_list('pk', 'patron_id')[:len(copy_ids)], copy_ids):
+                        copy = BookInstance.objects.filter(pk=copy_id, status='a')
+                        # The base QuerySet.update(): the caller refreshes the counters
+                        if not models.QuerySet.update(copy, status='r', borrower_id=patron_id, due_back=None, updated_at=now):
+                            continue
+                        if self.filter(pk=hold_id, status=Hold.WAITING).update(status=Hold.READY, bookinstance_id=copy_id, ready_at=now):
+                            reserved.add(copy_id)
+                        else:
+                            copy = BookInstance.objects.filter(pk=copy_id, status='r', borrower_id=patron_id)
+                            models.QuerySet.update(copy, status='a', borrower_id=None, updated_at=now)
+                            released.append(copy_id)
+                    # The holds served meanwhile are no longer waiting: the next ones get the copies released
+                    copy_ids = released
+        return reserved
+
+    def with_positions(self):
+        """Annotate the holds with queue_position, their position() computed by the database (None unless waiting)."""
+        ahead = Hold.objects.filter(
+            Q(created_at__lt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), pk__lte=OuterRef('pk')),
+            book=OuterRef('book'), status=Hold.WAITING,
+        ).order_by().values('book').annotate(count=Count('pk')).values('count')
+        return self.annotate(queue_position=Case(
+            When(status=Hold.WAITING, then=Subquery(ahead)),
+            default=Value(None),
+            output_field=IntegerField(),
+        ))
+
+class Hold(models.Model):
+    """
+    A patron waiting for a copy of a book (see catalog.circulation).
+
+    The waiting holds of a book are served in (created_at, id) order: a copy made available
+    is reserved for the first one (see HoldQuerySet.serve()), which is then ready until its
+    patron checks the copy out (fulfilled) or the hold is cancelled.
+    """
+    WAITING = 'w'
+    READY = 'r'
+    FULFILLED = 'f'
+    CANCELLED = 'c'
+    STATUSES = (
+        (WAITING, _('Waiting')),
+        (READY, _('Ready')),
+        (FULFILLED, _('Fulfilled')),
+        (CANCELLED, _('Cancelled')),
+    )
+    ACTIVE = (WAITING, READY)
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    patron = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(_('status'), max_length=1, choices=STATUSES, default=WAITING)
+    bookinstance = models.ForeignKey(
+        BookInstance, on_delete=models.SET_NULL, null=True, blank=True, help_text=_('The copy reserved for the patron'),
+    )
+    created_at = models.DateTimeField(_('placed'), default=timezone.now)
+    ready_at = models.DateTimeField(_('ready'), null=True, blank=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            # The queue of a book: its first holds, and the position of a hold, are index ranges
+            models.Index(fields=['book', 'status', 'created_at', 'id'], name='hold_queue_idx'),
+            # The ready holds not picked up in time (see circulation.expire_holds())
+            models.Index(fields=['status', 'ready_at'], name='hold_status_ready_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'patron'], condition=Q(status__in=('w', 'r')), name='hold_active_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} held by {self.patron_id} ({self.get_status_display()})'
+
+    def position(self):
+        """
+        Return the position of a waiting hold in the queue of its book (1 for the next served), or None.
+        Lists annotate their holds with queue_position instead: see HoldQuerySet.with_positions().
+        """
+        if self.status != self.WAITING:
+            return None
+        ahead = Hold.objects.filter(book_id=self.book_id, status=self.WAITING, created_at__lte=self.created_at)
+        return ahead.exclude(created_at=self.created_at, id__gte=self.id).count() + 1
+
+class Task(models.Model):
+    """
+    A call of a background task function, run by the run_worker command (see catalog.tasks).
+
+    arguments holds the JSON-encoded positional and keyword arguments. A key makes a
+    task unique (scheduled jobs are keyed by their period, so that several workers
+    enqueue them once).
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    name = models.CharField(_('task'), max_length=200)
+    arguments = models.TextField(_('arguments'), default='{}')
+    key = models.CharField(_('key'), max_length=200, null=True, blank=True, unique=True)
+    status = models.CharField(_('status'), max_length=10, choices=STATUSES, default=QUEUED)
+    run_at = models.DateTimeField(_('run at'), default=timezone.now)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    max_attempts = models.PositiveIntegerField(_('max attempts'), default=5)
+    locked_by = models.CharField(_('locked by'), max_length=100, blank=True)
+    locked_at = models.DateTimeField(_('locked at'), null=True, blank=True)
+    last_error = models.TextField(_('last error'), blank=True)
+    created_at = models.DateTimeField(_('created'), auto_now_add=True)
+    finished_at = models.DateTimeField(_('finished'), null=True, blank=True)
+
+    class Meta:
+        # The workers claim the queued tasks due, in (run_at, id) order
+        indexes = [
+            models.Index(fields=['status', 'run_at', 'id'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,89 @@
+"""Custom migration operations."""
+
+from django.db import migrations, router
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    Add an index without locking the table against writes on PostgreSQL.
+
+    The index is built with CREATE INDEX CONCURRENTLY, which can't run inside a
+    transaction: the migration using this operation must set 'atomic = False'.
+    If the build fails, PostgreSQL leaves an INVALID index behind, which the
+    backwards migration drops. Other databases use a plain CREATE INDEX.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == 'postgresql':
+            statement = self.index.create_sql(model, schema_editor)
+            statement.template = statement.template.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+            schema_editor.execute(statement)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == 'postgresql':
+            statement = self.index.remove_sql(model, schema_editor)
+            statement.template = statement.template.replace('DROP INDEX', 'DROP INDEX CONCURRENTLY', 1)
+            schema_editor.execute(statement)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+    def describe(self):
+        return 'Create index %s concurrently on field(s) %s of model %s' % (
+            self.index.name,
+            ', '.join(self.index.fields),
+            self.model_name,
+        )
+
+
+class CreatePartialIndexConcurrently(migrations.RunSQL):
+    """
+    Create the index name on columns of table, of the rows matching the SQL condition,
+    without locking the table against writes on PostgreSQL (see AddIndexConcurrently).
+
+    Django 2.2 has no partial Index: the index is created with SQL, and is not part of
+    the model state. IF NOT EXISTS skips an index already there, so an INVALID index left
+    by a failed build must be dropped (by the backwards migration) before migrating again.
+    """
+
+    def __init__(self, name, table, columns, condition):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.condition = condition
+        super().__init__(self.create_sql(), self.drop_sql())
+
+    def create_sql(self, concurrently=False):
+        return 'CREATE INDEX %sIF NOT EXISTS %s ON %s (%s) WHERE %s' % (
+            'CONCURRENTLY ' if concurrently else '',
+            self.name,
+            self.table,
+            ', '.join(self.columns),
+            self.condition,
+        )
+
+    def drop_sql(self, concurrently=False):
+        return 'DROP INDEX %sIF EXISTS %s' % ('CONCURRENTLY ' if concurrently else '', self.name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if router.allow_migrate(schema_editor.connection.alias, app_label, **self.hints):
+            schema_editor.execute(self.create_sql(schema_editor.connection.vendor == 'postgresql'))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if router.allow_migrate(schema_editor.connection.alias, app_label, **self.hints):
+            schema_editor.execute(self.drop_sql(schema_editor.connection.vendor == 'postgresql'))
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {
+            'name': self.name, 'table': self.table, 'columns': self.columns, 'condition': self.condition,
+        }
+
+    def describe(self):
+        return 'Create partial index %s concurrently on %s' % (self.name, self.table)
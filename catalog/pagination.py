@@ -0,0 +1,158 @@
+"""Keyset (cursor) pagination.
+
+Pages are read after (or before) the last row of the previous page rather than
+at an OFFSET, and the total number of rows is never counted: every page costs
+the same, however deep it is. Rows are ordered by a key field (NULL values last)
+then by primary key, which makes the order total. The position of a page is
+passed around as an opaque token in the 'cursor' query string parameter.
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.translation import gettext as _
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    """A page of rows, with the cursors of the previous and next pages."""
+    def __init__(self, object_list, paginator, previous_cursor=None, next_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __repr__(self):
+        return f'<Cursor page of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class CursorPaginator:
+    """
+    Paginate a queryset on (key, pk), NULL key values coming last.
+
+    Pass nullable=False when the queryset has no NULL key: the rows are then
+    ordered on the plain key, which SQLite can read in index order (it emulates
+    NULLS LAST with an expression, sorted apart).
+    """
+    cursor_based = True
+
+    def __init__(self, object_list, per_page, key, nullable=True):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.key = key
+        self.nullable = nullable
+        self.key_field = object_list.model._meta.get_field(key)
+
+    def encode_cursor(self, obj, backwards=False):
+        """Return the token of the position just after (or before, if backwards) obj."""
+        value = getattr(obj, self.key_field.attname)
+        position = {
+            'k': self.key_field.value_to_string(obj) if value is not None else None,
+            'pk': str(obj.pk),
+            'b': backwards,
+        }
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Return (key value, pk, backwards) from a token, or raise InvalidCursor."""
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            value = position['k']
+            if value is not None:
+                value = self.key_field.to_python(value)
+            pk = self.object_list.model._meta.pk.to_python(position['pk'])
+            return value, pk, bool(position['b'])
+        except (ValueError, TypeError, KeyError, UnicodeError, ValidationError) as e:
+            raise InvalidCursor(str(e))
+
+    def after(self, value, pk):
+        """Filter for the rows following the position (value, pk) in the page order."""
+        if value is None:
+            return Q(**{f'{self.key}__isnull': True, 'pk__gt': pk})
+        return (
+            Q(**{f'{self.key}__gt': value})
+            | Q(**{self.key: value, 'pk__gt': pk})
+            | Q(**{f'{self.key}__isnull': True})
+        )
+
+    def before(self, value, pk):
+        """Filter for the rows preceding the position (value, pk) in the page order."""
+        if value is None:
+            return Q(**{f'{self.key}__isnull': False}) | Q(**{f'{self.key}__isnull': True, 'pk__lt': pk})
+        return Q(**{f'{self.key}__lt': value}) | Q(**{self.key: value, 'pk__lt': pk})
+
+    def page(self, cursor=None):
+        """Return the page at the position of cursor (the first page if cursor is empty)."""
+        if self.nullable:
+            forward = self.object_list.order_by(F(self.key).asc(nulls_last=True), 'pk')
+        else:
+            forward = self.object_list.order_by(self.key, 'pk')
+        if not cursor:
+            rows = list(forward[:self.per_page + 1])
+            has_previous, has_next = False, len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        else:
+            value, pk, backwards = self.decode_cursor(cursor)
+            if backwards:
+                if self.nullable:
+                    backward = self.object_list.order_by(F(self.key).desc(nulls_first=True), '-pk')
+                else:
+                    backward = self.object_list.order_by(f'-{self.key}', '-pk')
+                rows = list(backward.filter(self.before(value, pk))[:self.per_page + 1])
+                has_previous, has_next = len(rows) > self.per_page, True
+                rows = rows[:self.per_page][::-1]
+            else:
+                rows = list(forward.filter(self.after(value, pk))[:self.per_page + 1])
+                has_previous, has_next = True, len(rows) > self.per_page
+                rows = rows[:self.per_page]
+        return CursorPage(
+            rows,
+            self,
+            previous_cursor=self.encode_cursor(rows[0], backwards=True) if rows and has_previous else None,
+            next_cursor=self.encode_cursor(rows[-1]) if rows and has_next else None,
+        )
+
+
+class CursorPaginationMixin:
+    """
+    ListView mixin paginating on (cursor_key, pk) with a CursorPaginator.
+
+    The 'is_paginated' and 'page_obj' context variables are set as with page numbers;
+    the page to display is read from the 'cursor' query string parameter.
+    """
+    cursor_key = None
+    # False when the queryset filters out the NULL values of cursor_key
+    cursor_key_nullable = True
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size, self.cursor_key, self.cursor_key_nullable)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404(_('Invalid page.'))
+        return (paginator, page, page.object_list, page.has_other_pages())
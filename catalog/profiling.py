@@ -0,0 +1,117 @@
+"""Per-request performance measures: query count, SQL time, template render time and session time.
+
+Code run inside 'with profile() as p:' is measured into p. Template render time
+and session load/save time are measured by wrapping the Django template backend
+and the session store once 'install()' has been called. Template time includes
+the queries of querysets evaluated lazily by the template, session time the
+queries of database backed sessions.
+
+Profiles nest (the performance middleware samples requests run by the
+benchmark_views command inside its own profile): the enclosing profile counts
+the queries of the nested one through its own execute wrapper, and receives its
+template and session times when it ends, unless they were spent in a template
+or session method it already times.
+"""
+
+import functools
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+
+_local = threading.local()
+
+
+class Profile:
+    """Measures of a block of code (times in seconds)."""
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.session_time = 0.0
+        self.total_time = 0.0
+        self._depth = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper, counting and timing queries."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+    def as_dict(self):
+        """Return the measures in milliseconds."""
+        return {
+            'queries': self.queries,
+            'sql_ms': self.sql_time * 1000,
+            'template_ms': self.template_time * 1000,
+            'session_ms': self.session_time * 1000,
+            'total_ms': self.total_time * 1000,
+        }
+
+
+def active_profile():
+    """Return the profile of the code running in this thread, if any."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def profile():
+    """Measure the enclosed block; the Profile is returned by the context manager."""
+    measures = Profile()
+    previous = active_profile()
+    _local.profile = measures
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(measures))
+            yield measures
+    finally:
+        measures.total_time = time.perf_counter() - start
+        _local.profile = previous
+        if previous is not None:
+            # The timed methods only measure into the active profile: hand their times to the
+            # enclosing one, but those it measures itself (the nested profile opened in a template)
+            for measure in ('template_time', 'session_time'):
+                if not previous._depth.get(measure):
+                    setattr(previous, measure, getattr(previous, measure) + getattr(measures, measure))
+
+
+def _timed(method, measure):
+    """Wrap method to add its duration to the 'measure' attribute of the active profile."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        measures = active_profile()
+        if measures is None:
+            return method(self, *args, **kwargs)
+        # Nested calls (templates rendered by a template, SessionStore.save() called by create()) are already timed
+        depth = measures._depth.get(measure, 0)
+        measures._depth[measure] = depth + 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            measures._depth[measure] = depth
+            if not depth:
+                setattr(measures, measure, getattr(measures, measure) + time.perf_counter() - start)
+    wrapper.profiled = True
+    return wrapper
+
+
+def install():
+    """Time template rendering and session load/save from now on (it is free when no profile is active)."""
+    SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+    for cls, name, measure in [
+        (Template, 'render', 'template_time'),
+        (SessionStore, 'load', 'session_time'),
+        (SessionStore, 'save', 'session_time'),
+    ]:
+        if not getattr(getattr(cls, name), 'profiled', False):
+            setattr(cls, name, _timed(getattr(cls, name), measure))
@@ -0,0 +1,212 @@
+"""Full-text search of the catalog.
+
+Books are searched on their search document (title, ISBN, summary, author and
+genre names, see Book.search_document), through the text search of the database:
+
+- PostgreSQL: a GIN index on to_tsvector(SEARCH_CONFIG, search_document),
+  results ranked by ts_rank();
+- SQLite: the FTS5 table FTS_TABLE, an external content index of catalog_book
+  kept up to date by triggers, results ranked by bm25.
+
+Other databases fall back to unranked substring matches. Every word of the
+query must match, the last one as a prefix ('john tolk' matches 'John Tolkien').
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connections
+
+from catalog.models import Book
+
+# PostgreSQL text search configuration of the search index
+SEARCH_CONFIG = 'english'
+SEARCH_INDEX = 'book_search_idx'
+# Number of matches ranked by a search
+SEARCH_MAX_RESULTS = getattr(settings, 'CATALOG_SEARCH_MAX_RESULTS', 1000)
+# SQLite FTS5 table, and the triggers copying the search documents of catalog_book into it
+FTS_TABLE = 'catalog_book_fts'
+FTS_TRIGGERS = {
+    f'{FTS_TABLE}_insert': (
+        f'AFTER INSERT ON catalog_book BEGIN '
+        f'INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END'
+    ),
+    f'{FTS_TABLE}_delete': (
+        f'AFTER DELETE ON catalog_book BEGIN '
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END"
+    ),
+    # Only changes of the document: the copy counters of catalog_book are updated much more often
+    f'{FTS_TABLE}_update': (
+        f'AFTER UPDATE OF search_document ON catalog_book BEGIN '
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+        f'INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END'
+    ),
+}
+
+
+def install_search_index(connection):
+    """
+    Create the search index of the database of connection if it is missing.
+
+    On SQLite, the triggers are created again if they are missing (they are dropped
+    when a migration rebuilds catalog_book) and the index is then rebuilt.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Run outside of a transaction (non atomic migration)
+            cursor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {SEARCH_INDEX} ON catalog_book '
+                f"USING gin (to_tsvector('{SEARCH_CONFIG}', search_document))"
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'catalog_book'")
+            triggers = {name for name, in cursor.fetchall()}
+            if triggers.issuperset(FTS_TRIGGERS):
+                return
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+                f"search_document, content='catalog_book', content_rowid='id', tokenize='porter unicode61', "
+                # Prefix indexes of the short prefixes, which match the most words
+                f"prefix='2 3 4')"
+            )
+            for name, trigger in FTS_TRIGGERS.items():
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {trigger}')
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_search_index(connection):
+    """Drop the search index of the database of connection."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {SEARCH_INDEX}')
+        elif connection.vendor == 'sqlite':
+            for name in FTS_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def _match_sql(words, connection):
+    """
+    Return (id column, rank expression and its params, FROM ... WHERE clause and its params)
+    selecting the books matching words with the text search of connection.
+    """
+    if connection.vendor == 'postgresql':
+        # Same expression as the index, so that the index is used
+        vector = f"to_tsvector('{SEARCH_CONFIG}', search_document)"
+        terms = ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+        rank = f"ts_rank({vector}, to_tsquery('{SEARCH_CONFIG}', %s))"
+        return 'id', rank, [terms], f"FROM catalog_book WHERE {vector} @@ to_tsquery('{SEARCH_CONFIG}', %s)", [terms]
+    # Quoted words: the characters of the FTS5 query syntax are searched as text. bm25 rank: the lower the better
+    terms = ' '.join('"{}"'.format(word.replace('"', '""')) for word in words) + '*'
+    return 'rowid', '-rank', [], f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [terms]
+
+
+def _restricted(matches, params, column, queryset):
+    """Restrict matches to the books of queryset, if it is filtered."""
+    if queryset is None or not queryset.query.has_filters():
+        return matches, params
+    pks, pks_params = queryset.order_by().values('pk').query.sql_with_params()
+    return f'{matches} AND {column} IN ({pks})', params + list(pks_params)
+
+
+def _substring_matches(words, queryset):
+    """The books of queryset matching every word, for the databases without text search."""
+    for word in words:
+        queryset = queryset.filter(search_document__icontains=word)
+    return queryset
+
+
+def count_matches(query, using='default', queryset=None):
+    """Return the number of books (of queryset, if filtered) matching query, up to SEARCH_MAX_RESULTS."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return 0
+    connection = connections[using]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        books = Book.objects.using(using) if queryset is None else queryset
+        return _substring_matches(words, books).order_by()[:SEARCH_MAX_RESULTS].count()
+    column, rank, rank_params, matches, params = _match_sql(words, connection)
+    matches, params = _restricted(matches, params, column, queryset)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 {matches} LIMIT %s) matches', params + [SEARCH_MAX_RESULTS])
+        return cursor.fetchone()[0]
+
+
+def rank_matches(query, using='default', limit=None, offset=0, queryset=None):
+    """
+    Return [(book pk, rank)] of the books (of queryset, if filtered) matching query, best first
+    (the higher the rank, the better), from offset and up to limit, ranked and paged by the database.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return []
+    limit = SEARCH_MAX_RESULTS if limit is None else limit
+    connection = connections[using]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        books = Book.objects.using(using) if queryset is None else queryset
+        pks = _substring_matches(words, books).order_by('pk').values_list('pk', flat=True)[offset:offset + limit]
+        return [(pk, 0.0) for pk in pks]
+    column, rank, rank_params, matches, params = _match_sql(words, connection)
+    matches, params = _restricted(matches, params, column, queryset)
+    # Ranked and paged by the database: only the rows of the page are returned
+    sql = f'SELECT {column}, {rank} {matches} ORDER BY 2 DESC, 1 LIMIT %s OFFSET %s'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, rank_params + params + [limit, offset])
+        return cursor.fetchall()
+
+
+class SearchResults:
+    """
+    The books of a search, best first, with their 'rank'.
+
+    It is a sequence of books that Paginator can page: its length is counted by
+    the database, and each slice is ranked and fetched with one query for the
+    matches of the slice (ORDER BY rank, LIMIT and OFFSET) and one for their books.
+    """
+    def __init__(self, queryset, query):
+        self.queryset = queryset
+        self.query = query
+        self._count = None
+
+    def __repr__(self):
+        return f'<SearchResults: {len(self)} books>'
+
+    def __len__(self):
+        if self._count is None:
+            self._count = count_matches(self.query, self.queryset.db, self.queryset)
+        return self._count
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            results = self[index:index + 1 if index != -1 else None]
+            if not results:
+                raise IndexError('SearchResults index out of range')
+            return results[0]
+        start, stop, step = index.indices(len(self))
+        if stop <= start:
+            return []
+        ranked = rank_matches(self.query, self.queryset.db, stop - start, start, self.queryset)[::step]
+        books = self.queryset.in_bulk([pk for pk, rank in ranked])
+        results = []
+        for pk, rank in ranked:
+            # Skip the books deleted since the search
+            if pk in books:
+                books[pk].rank = rank
+                results.append(books[pk])
+        return results
+
+
+def search_books(query, queryset=None):
+    """
+    Return the books of queryset matching query as SearchResults.
+
+    Only the best SEARCH_MAX_RESULTS matches are paged: the count of the matches
+    stops there, and a query matching that many books is too broad for the
+    pages beyond to be useful anyway.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    return SearchResults(queryset, query)
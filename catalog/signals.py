@@ -0,0 +1,117 @@
+from django.db import connections
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+from catalog.caching import bump_version
+from catalog.models import Author, Book, BookInstance, Genre, Language, PageView, copies_changed
+from catalog.search import FTS_TABLE, install_search_index
+from catalog.stats import invalidate_stats
+
+# Models whose rows are counted by the catalog statistics.
+STATS_MODELS = (Book, BookInstance, Author, Genre, Language)
+
+
+def stats_model_changed(sender, **kwargs):
+    """Invalidate the cached catalog statistics when a counted model changes."""
+    invalidate_stats()
+
+
+for model in STATS_MODELS:
+    post_save.connect(stats_model_changed, sender=model, dispatch_uid=f'stats_{model.__name__}_saved')
+    post_delete.connect(stats_model_changed, sender=model, dispatch_uid=f'stats_{model.__name__}_deleted')
+
+copies_changed.connect(stats_model_changed, sender=BookInstance, dispatch_uid='stats_copies_changed')
+
+
+def cached_model_changed(sender, **kwargs):
+    """Change the version of a model displayed by cached pages (see catalog.caching)."""
+    bump_version(sender)
+
+
+def cached_book_genres_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_version(Book, Genre)
+
+
+def cached_copies_changed(sender, **kwargs):
+    # The copy counters of the books changed too
+    bump_version(BookInstance, Book)
+
+
+# The cached pages display the same models as the statistics
+for model in STATS_MODELS:
+    post_save.connect(cached_model_changed, sender=model, dispatch_uid=f'cache_{model.__name__}_saved')
+    post_delete.connect(cached_model_changed, sender=model, dispatch_uid=f'cache_{model.__name__}_deleted')
+
+m2m_changed.connect(cached_book_genres_changed, sender=Book.genre.through, dispatch_uid='cache_book_genres_changed')
+copies_changed.connect(cached_copies_changed, sender=BookInstance, dispatch_uid='cache_copies_changed')
+
+
+def books_changed(books):
+    """Rebuild the search documents of books, and mark them as changed (see Book.last_changed)."""
+    books.refresh_search_documents()
+    books.touch()
+
+
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Books whose genres changed."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            books_changed(Book.objects.filter(pk=instance.pk))
+    elif action == 'pre_clear':
+        instance._changed_book_ids = list(instance.book_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        books_changed(Book.objects.filter(pk__in=instance._changed_book_ids))
+    elif action in ('post_add', 'post_remove'):
+        books_changed(Book.objects.filter(pk__in=pk_set))
+
+
+def book_relation_saved(sender, instance, **kwargs):
+    """Books of a saved author or genre (its name may have changed)."""
+    books_changed(instance.book_set.all())
+
+
+def book_relation_deleting(sender, instance, **kwargs):
+    """Remember the books of an author or genre being deleted: they are unlinked without signals."""
+    instance._changed_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+def book_relation_deleted(sender, instance, **kwargs):
+    books_changed(Book.objects.filter(pk__in=instance._changed_book_ids))
+
+
+m2m_changed.connect(book_genres_changed, sender=Book.genre.through, dispatch_uid='search_book_genres_changed')
+for model in (Author, Genre):
+    post_save.connect(book_relation_saved, sender=model, dispatch_uid=f'search_{model.__name__}_saved')
+    pre_delete.connect(book_relation_deleting, sender=model, dispatch_uid=f'search_{model.__name__}_deleting')
+    post_delete.connect(book_relation_deleted, sender=model, dispatch_uid=f'search_{model.__name__}_deleted')
+
+
+def language_changed(sender, instance, **kwargs):
+    """Books in a saved or deleted language, or with copies in it (their pages display its name)."""
+    Book.objects.filter(Q(language=instance) | Q(bookinstance__language=instance)).touch()
+
+
+post_save.connect(language_changed, sender=Language, dispatch_uid='language_saved')
+pre_delete.connect(language_changed, sender=Language, dispatch_uid='language_deleting')
+
+
+# Kinds of the page views of the models (see catalog.counters)
+PAGE_VIEW_KINDS = {Book: PageView.BOOK, Author: PageView.AUTHOR}
+
+
+def page_views_deleted(sender, instance, **kwargs):
+    """Drop the page views of a deleted book or author (views still buffered are flushed as orphans)."""
+    PageView.objects.filter(kind=PAGE_VIEW_KINDS[sender], object_id=instance.pk).delete()
+
+
+for model in PAGE_VIEW_KINDS:
+    post_delete.connect(page_views_deleted, sender=model, dispatch_uid=f'page_views_{model.__name__}_deleted')
+
+
+def restore_search_index(sender, using, **kwargs):
+    """Restore the search index after migrations (SQLite drops its triggers when a migration rebuilds catalog_book)."""
+    connection = connections[using]
+    # Connected to post_migrate in CatalogConfig.ready(); the index is created by migration 0009
+    if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+        install_search_index(connection)
@@ -0,0 +1,71 @@
+"""Catalog statistics shared by the home page, other views and the admin.
+
+All the counters are computed with a single conditional-aggregation query and
+kept in the cache framework. The cached value is dropped by the signal
+receivers of catalog.signals whenever a catalog object is saved or deleted.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from catalog.models import STATUS_COUNTERS, Author, Book, BookInstance, Genre, Language
+
+STATS_CACHE_KEY = 'catalog:stats'
+
+# Seconds the counters may be kept in cache. Signal invalidation keeps them
+# exact in a single process; the timeout bounds staleness with a local memory
+# cache across several workers.
+STATS_CACHE_TIMEOUT = getattr(settings, 'CATALOG_STATS_CACHE_TIMEOUT', 300)
+
+# Models counted as a whole, in the scalar sub-selects of the query.
+MODEL_COUNTERS = (
+    ('num_books', Book),
+    ('num_authors', Author),
+    ('num_genres', Genre),
+    ('num_languages', Language),
+)
+
+
+def compute_stats():
+    """Return a dict of all the catalog counters, computed in one query."""
+    qn = connection.ops.quote_name
+    columns = [
+        f'(SELECT COUNT(*) FROM {qn(model._meta.db_table)})'
+        for name, model in MODEL_COUNTERS
+    ]
+    columns.append('COUNT(*)')
+    status_column = qn(BookInstance._meta.get_field('status').column)
+    columns.extend(
+        f'COALESCE(SUM(CASE WHEN {status_column} = %s THEN 1 ELSE 0 END), 0)'
+        for name, status in STATUS_COUNTERS
+    )
+    sql = f'SELECT {", ".join(columns)} FROM {qn(BookInstance._meta.db_table)}'
+    params = [status for name, status in STATUS_COUNTERS]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    names = [name for name, model in MODEL_COUNTERS] + ['num_instances'] + [name for name, status in STATUS_COUNTERS]
+    return dict(zip(names, (int(value) for value in row)))
+
+
+def refresh_stats():
+    """Compute the counters and cache them (also run by the scheduled catalog.tasks.refresh_stats task)."""
+    stats = compute_stats()
+    cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def get_stats():
+    """Return the catalog counters, from the cache when they are available."""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        stats = refresh_stats()
+    return stats
+
+
+def invalidate_stats():
+    """Drop the cached counters, so they are computed again on next access."""
+    cache.delete(STATS_CACHE_KEY)
@@ -0,0 +1,219 @@
+"""Background tasks, queued in the database and run by the run_worker command.
+
+A task is a function decorated with @task; calling its delay() method inserts a
+Task row, in the transaction of the caller: the task is queued if and only if
+the caller's changes are committed. Workers claim the tasks due with
+SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL, so that concurrent workers never
+wait for each other nor run a task twice. Other databases (SQLite) claim them
+with one UPDATE tagging the rows due with a claim token, then read the rows
+tagged: their writers are serialized anyway.
+
+A failed task is retried after an exponential backoff, up to its max_attempts.
+A worker refreshes the locks of its running tasks every CATALOG_TASKS_HEARTBEAT
+seconds (heartbeat()), so that a task left running by a crashed worker is
+claimed again once its lock is older than CATALOG_TASKS_LOCK_TIMEOUT seconds,
+however long the tasks of the live workers run. CATALOG_TASKS_SCHEDULE lists the tasks
+enqueued periodically by the workers, keyed by their period so that each run is
+enqueued once whatever the number of workers.
+"""
+
+import datetime
+import json
+import logging
+import traceback
+import uuid
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from catalog.models import Task
+
+logger = logging.getLogger('catalog.tasks')
+
+# Attempts of a task before it is marked failed, and delay before the first retry
+# (doubled at each retry, up to RETRY_MAX_DELAY), in seconds
+MAX_ATTEMPTS = getattr(settings, 'CATALOG_TASKS_MAX_ATTEMPTS', 5)
+RETRY_DELAY = getattr(settings, 'CATALOG_TASKS_RETRY_DELAY', 10)
+RETRY_MAX_DELAY = getattr(settings, 'CATALOG_TASKS_RETRY_MAX_DELAY', 3600)
+
+# Seconds after which a running task is deemed lost (its worker crashed) and run again
+LOCK_TIMEOUT = getattr(settings, 'CATALOG_TASKS_LOCK_TIMEOUT', 600)
+
+# Seconds between the refreshes of the locks of the running tasks by their worker (well under LOCK_TIMEOUT)
+HEARTBEAT = getattr(settings, 'CATALOG_TASKS_HEARTBEAT', 60)
+
+# Seconds the done tasks are kept, by purge_tasks()
+KEEP_DONE = getattr(settings, 'CATALOG_TASKS_KEEP_DONE', 7 * 24 * 3600)
+
+_registry = {}
+
+
+def task(func=None, *, max_attempts=None):
+    """Register func as a task, adding a delay() method enqueuing a call of it."""
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        _registry[name] = func
+        func.task_name = name
+        func.max_attempts = max_attempts or MAX_ATTEMPTS
+        func.delay = lambda *args, **kwargs: enqueue(name, args, kwargs)
+        return func
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    """Return the task function called name, importing its module if needed, or raise LookupError."""
+    if name not in _registry:
+        try:
+            import_string(name)
+        except ImportError:
+            pass
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f'Unknown task {name!r}.')
+
+
+def enqueue(name, args=(), kwargs=None, run_at=None, key=None):
+    """
+    Queue a call of the task name with the JSON-serializable args and kwargs, to run
+    from run_at (default: now). With a key, a task already queued under this key is
+    returned instead of a new one.
+    """
+    func = get_task(name)
+    arguments = json.dumps({'args': list(args), 'kwargs': kwargs or {}})
+    fields = {'name': name, 'arguments': arguments, 'max_attempts': func.max_attempts, 'run_at': run_at or timezone.now()}
+    if key is None:
+        return Task.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return Task.objects.create(key=key, **fields)
+    except IntegrityError:
+        return Task.objects.get(key=key)
+
+
+def retry_delay(attempts):
+    """Return the delay before running again a task failed attempts times."""
+    return datetime.timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+
+def claimable(now):
+    return Q(status=Task.QUEUED, run_at__lte=now) | Q(
+        status=Task.RUNNING, locked_at__lt=now - datetime.timedelta(seconds=LOCK_TIMEOUT),
+    )
+
+
+def claim(worker, limit):
+    """Lock up to limit tasks due for worker, oldest first, and return their (id, claim token)."""
+    now = timezone.now()
+    token = f'{worker}:{uuid.uuid4().hex[:12]}'
+    due = Task.objects.filter(claimable(now)).order_by('run_at', 'pk')
+    locked = {'status': Task.RUNNING, 'locked_by': token, 'locked_at': now, 'attempts': F('attempts') + 1}
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Task.objects.filter(pk__in=ids).update(**locked)
+        else:
+            # Writing first: SQLite fails at once a transaction upgrading its read lock
+            # while another connection writes, instead of waiting
+            Task.objects.filter(pk__in=due.values('pk')[:limit]).update(**locked)
+            ids = list(Task.objects.filter(locked_by=token).values_list('pk', flat=True))
+    return [(pk, token) for pk in ids]
+
+
+def heartbeat(claims):
+    """Refresh the locks of claimed tasks, [(id, claim token)], still held by their claims."""
+    if claims:
+        ids, tokens = zip(*claims)
+        Task.objects.filter(pk__in=ids, locked_by__in=set(tokens)).update(locked_at=timezone.now())
+
+
+def run_task(task_id, token):
+    """Run a claimed task, then mark it done, or queued again or failed, unless it was claimed again meanwhile."""
+    close_old_connections()
+    try:
+        task = Task.objects.get(pk=task_id)
+        mine = Task.objects.filter(pk=task_id, locked_by=token)
+        released = {'locked_by': '', 'locked_at': None}
+        try:
+            if task.attempts > task.max_attempts:
+                raise RuntimeError('Lost by its worker too many times.')
+            arguments = json.loads(task.arguments)
+            get_task(task.name)(*arguments['args'], **arguments['kwargs'])
+        except Exception:
+            error = traceback.format_exc()
+            now = timezone.now()
+            if task.attempts >= task.max_attempts:
+                logger.error('task %s (%s) failed after %d attempts:\n%s', task.pk, task.name, task.attempts, error)
+                mine.update(status=Task.FAILED, last_error=error, finished_at=now, **released)
+                return Task.FAILED
+            logger.warning('task %s (%s) failed, attempt %d:\n%s', task.pk, task.name, task.attempts, error)
+            mine.update(status=Task.QUEUED, last_error=error, run_at=now + retry_delay(task.attempts), **released)
+            return Task.QUEUED
+        mine.update(status=Task.DONE, finished_at=timezone.now(), **released)
+        return Task.DONE
+    finally:
+        close_old_connections()
+
+
+def schedule(now, last_periods):
+    """
+    Enqueue the tasks of CATALOG_TASKS_SCHEDULE ({task name: period in seconds}) whose
+    period started since last_periods ({task name: period number}, updated).
+    """
+    for name, seconds in getattr(settings, 'CATALOG_TASKS_SCHEDULE', {}).items():
+        period = int(now.timestamp() // seconds)
+        if last_periods.get(name) != period:
+            enqueue(name, run_at=now, key=f'schedule:{name}:{period}')
+            last_periods[name] = period
+
+
+# Tasks of the catalog
+
+@task
+def send_emails(messages):
+    """Send e-mail messages queued by catalog.mail.QueuedEmailBackend."""
+    from catalog.mail import send_serialized
+    send_serialized(messages)
+
+
+@task
+def send_overdue_notices():
+    call_command('send_overdue_notices', verbosity=0)
+
+
+@task
+def import_catalog(path, input_format=None):
+    call_command('import_catalog', path, format=input_format, resume=True, verbosity=0)
+
+
+@task
+def refresh_stats():
+    """Compute the catalog statistics ahead of the requests (see catalog.stats)."""
+    from catalog.stats import refresh_stats
+    refresh_stats()
+
+
+@task
+def refresh_facets():
+    """Compute the facet counts of the whole book list, and of the books available (see catalog.facets)."""
+    from django.http import QueryDict
+    from catalog.facets import parse_filters, refresh_facets
+    for query in ('', 'available=1'):
+        refresh_facets(parse_filters(QueryDict(query)))
+
+
+@task
+def expire_holds():
+    """Pass on the copies reserved for holds not picked up in time (see catalog.circulation)."""
+    from catalog.circulation import expire_holds
+    expire_holds()
+
+
+@task
+def purge_tasks():
+    """Delete the tasks done for more than CATALOG_TASKS_KEEP_DONE seconds."""
+    Task.objects.filter(status=Task.DONE, finished_at__lt=timezone.now() - datetime.timedelta(seconds=KEEP_DONE)).delete()
@@ -0,0 +1,18 @@
+from django import template
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def query_string(context, **kwargs):
+    """
+    Return the query string of the current request, with the given parameters replaced.
+
+    A parameter set to None is removed, e.g. {% query_string cursor=None %} links to the first page.
+    """
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return f'?{query.urlencode()}' if query else '?'
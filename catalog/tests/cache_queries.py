@@ -0,0 +1,10 @@
+"""Database queries run by the operations of the shared cache (see CACHES), for the query counts of the tests."""
+
+from django.conf import settings
+
+# None with Memcached. In the database cache, a get, get_many or delete runs one query, and a set
+# (or add) counts the rows then looks up and writes the key in a savepoint (in a test transaction).
+# incr() gets the value, then sets it if it is cached.
+DATABASE_CACHE = settings.CACHES['default']['BACKEND'] == 'django.core.cache.backends.db.DatabaseCache'
+GET = 1 if DATABASE_CACHE else 0
+SET = 5 if DATABASE_CACHE else 0
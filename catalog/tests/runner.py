@@ -0,0 +1,59 @@
+import atexit
+import unittest
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test.runner import DebugSQLTextTestResult, DiscoverRunner
+from django.test.utils import override_settings
+
+from catalog import counters
+
+
+class IsolatedResult(unittest.TextTestResult):
+    """
+    Drop the page views buffered by each test, so that no other test flushes them, and start
+    each test with empty caches: responses (see catalog.caching) and fragments would be served
+    from the cache of a previous test.
+    """
+    def startTest(self, test):
+        counters.discard()
+        # The database cache can't be cleared for tests without database (SimpleTestCase), which
+        # render no page either
+        if getattr(test, 'databases', None):
+            for cache in caches.all():
+                cache.clear()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        counters.discard()
+
+
+class DebugSQLIsolatedResult(IsolatedResult, DebugSQLTextTestResult):
+    pass
+
+
+class CatalogTestRunner(DiscoverRunner):
+    """
+    Test runner keeping the page view counters and cached pages of the tests out of the other tests (and
+    the counters out of the database), the e-mails delivered by the tasks in django.core.mail.outbox, and
+    the static files without the manifest of collectstatic.
+    """
+    def get_resultclass(self):
+        return DebugSQLIsolatedResult if self.debug_sql else IsolatedResult
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # The views of the tests are not flushed once the test database is destroyed
+        atexit.unregister(counters._flush_at_exit)
+        # As Django does for EMAIL_BACKEND
+        self._tasks_email_backend = getattr(settings, 'CATALOG_TASKS_EMAIL_BACKEND', None)
+        settings.CATALOG_TASKS_EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        # The manifest is written by collectstatic, which the tests don't run
+        self._static_storage = override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+        self._static_storage.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._static_storage.disable()
+        settings.CATALOG_TASKS_EMAIL_BACKEND = self._tasks_email_backend
+        super().teardown_test_environment(**kwargs)
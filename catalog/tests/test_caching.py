@@ -0,0 +1,187 @@
+from django.test import TestCase
+
+from django.contrib.auth.models import Permission, User
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils.http import http_date
+from django.views import generic
+from catalog.caching import ConditionalGetMixin, bump_version, get_versions
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.tests.cache_queries import GET, SET
+
+class CachedResponseTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(*Permission.objects.filter(codename__in=['can_edit_book', 'can_edit_author']))
+        cls.patron = User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=cls.author)
+
+    def test_versions(self):
+        versions = get_versions([Book, Author])
+        self.assertEqual(get_versions([Book, Author]), versions)
+        bump_version(Book)
+        new_versions = get_versions([Book, Author])
+        self.assertNotEqual(new_versions[0], versions[0])
+        self.assertEqual(new_versions[1], versions[1])
+
+    def test_cached_response(self):
+        response = self.client.get(reverse('books'))
+        self.assertContains(response, 'Book Title')
+        # The change marker of the conditional GET (see ConditionalGetMixin), the versions and the page
+        with self.assertNumQueries(2 + 2 * GET):
+            cached = self.client.get(reverse('books'))
+        self.assertEqual(cached.content, response.content)
+        # Other pages are cached under other keys
+        with self.assertNumQueries(6 + 2 * GET + SET):
+            self.client.get(reverse('authors') + '?page=1')
+
+    def test_edits_visible_at_once(self):
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'Book Title')
+        self.book.title = 'New Title'
+        self.book.save()
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'New Title')
+        # Related models displayed by the page
+        self.genre.book_set.add(self.book)
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'Fantasy')
+        self.author.last_name = 'Smithson'
+        self.author.save()
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'Smithson')
+        BookInstance.objects.bulk_create([BookInstance(book=self.book, imprint='Folio 1990', status='a')])
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'Folio 1990')
+        Language.objects.create(name='Esperanto')
+        self.assertContains(self.client.get(reverse('languages')), 'Esperanto')
+
+    def test_edit_views_invalidate(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        self.client.get(reverse('authors'))
+        response = self.client.post(reverse('author-update', args=[self.author.pk]), {'first_name': 'Jane', 'last_name': 'Doe'})
+        self.assertEqual(response.status_code, 302)
+        self.assertContains(self.client.get(reverse('authors')), 'Doe')
+
+    def test_key_per_user_and_permissions(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        self.assertContains(self.client.get(reverse('books')), 'Add Book')
+        self.client.login(username='patron', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('books'))
+        self.assertNotContains(response, 'Add Book')
+        self.assertContains(response, 'User: patron')
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('books')), 'User:')
+        # Permissions granted later are part of the key
+        self.patron.user_permissions.add(Permission.objects.get(codename='can_edit_book'))
+        self.client.login(username='patron', password='2HJ1vRV0Z&3iD')
+        self.assertContains(self.client.get(reverse('books')), 'Add Book')
+
+    def test_not_found_not_cached(self):
+        self.assertEqual(self.client.get(reverse('author-detail', args=[999])).status_code, 404)
+        Author.objects.create(id=999, first_name='Late', last_name='Author')
+        self.assertEqual(self.client.get(reverse('author-detail', args=[999])).status_code, 200)
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=cls.author)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Folio 1990', status='a')
+
+    def assertNotModified(self, url, response, modified=False):
+        """Assert url is (or not, if modified) unchanged since response, by ETag."""
+        expected = 200 if modified else 304
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, expected)
+
+    def test_not_modified(self):
+        # Change marker queries of each page
+        for url, num in (
+            (reverse('books'), 2), (reverse('book-detail', args=[self.book.pk]), 1), (reverse('authors'), 4),
+            (reverse('author-detail', args=[self.author.pk]), 1), (reverse('bookinstance-detail', args=[self.copy.pk]), 1),
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('ETag', response)
+            with self.assertNumQueries(num):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertNotModified(url, response)
+            # The ETag is the only validator: a date misses the changes within its second and the deletions
+            self.assertNotIn('Last-Modified', response)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date()).status_code, 200)
+
+    def test_copy_changes_roll_up(self):
+        urls = [reverse('books'), reverse('book-detail', args=[self.book.pk]), reverse('author-detail', args=[self.author.pk])]
+        responses = [self.client.get(url) for url in urls]
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        copy.status = 'o'
+        copy.save()
+        for url, response in zip(urls, responses):
+            self.assertNotModified(url, response, modified=True)
+
+    def test_related_changes_roll_up(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        response = self.client.get(url)
+        self.author.last_name = 'Smithson'
+        self.author.save()
+        self.assertNotModified(url, response, modified=True)
+        response = self.client.get(url)
+        Genre.objects.create(name='Fantasy').book_set.add(self.book)
+        self.assertNotModified(url, response, modified=True)
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        copy.language = Language.objects.create(name='Esperanto')
+        copy.save()
+        response = self.client.get(url)
+        copy.language.name = 'Volapük'
+        copy.language.save()
+        self.assertNotModified(url, response, modified=True)
+
+    def test_no_change_marker(self):
+        class PageView(ConditionalGetMixin, generic.View):
+            def get(self, request):
+                return HttpResponse('Page')
+        # No validator: answered in full
+        response = PageView.as_view()(RequestFactory().get('/', HTTP_IF_NONE_MATCH='"etag"'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_deletions_change_etag(self):
+        url = reverse('books')
+        other = Book.objects.create(title='Other', summary='Summary', isbn='1234567890123')
+        Book.objects.filter(pk=other.pk).update(last_changed=self.book.last_changed)
+        response = self.client.get(url)
+        other.delete()
+        self.assertNotModified(url, response, modified=True)
+
+    def test_etag_per_user(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+        self.client.login(username='patron', password='2HJ1vRV0Z&3iD')
+        self.assertNotModified(url, response, modified=True)
+
+    def test_etag_per_csrf_token(self):
+        # The forms of the page post the CSRF token of the user, rotated by a new login
+        url = reverse('bookinstance-detail', args=[self.copy.pk])
+        User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+        credentials = {'username': 'patron', 'password': '2HJ1vRV0Z&3iD'}
+        self.client.post(reverse('login'), credentials)
+        response = self.client.get(url)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertNotModified(url, response)
+        self.client.get(reverse('logout'))
+        self.client.post(reverse('login'), credentials)
+        self.assertNotModified(url, response, modified=True)
+
+    def test_cache_control(self):
+        # Anonymous pages can be kept by a front proxy, the pages of users are private
+        for url in (reverse('books'), reverse('genres')):
+            response = self.client.get(url)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('max-age=', response['Cache-Control'])
+            self.assertNotIn('sessionid', response.cookies)
+            # Kept once for every visitor without a session, whatever their other cookies
+            self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.client.force_login(User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD'))
+        response = self.client.get(reverse('books'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
@@ -0,0 +1,530 @@
+from django.test import TestCase, TransactionTestCase
+
+import datetime, threading, time, uuid
+from django.contrib.auth.models import Permission, User
+from django.db import OperationalError, connection, connections, models
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from catalog import circulation
+from catalog.caching import get_versions
+from catalog.models import Book, BookInstance, Hold
+from catalog.tests.cache_queries import GET, SET
+
+# Changes to copies drop the catalog statistics and bump the versions of the books and copies in cache
+CACHE_WRITES = GET + 2 * (GET + SET)
+
+class CirculationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Unlikely Imprint, 2016', status='a')
+        cls.patron = User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+        cls.other = User.objects.create_user(username='other', password='2HJ1vRV0Z&3iD')
+
+    def get_copy(self):
+        return BookInstance.objects.get(pk=self.copy.pk)
+
+    def test_checkout_and_return(self):
+        circulation.checkout(self.copy.pk, self.patron)
+        copy = self.get_copy()
+        self.assertEqual((copy.status, copy.borrower), ('o', self.patron))
+        self.assertEqual(copy.due_back, datetime.date.today() + circulation.LOAN_PERIOD)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_loan, 1)
+        circulation.return_copy(self.copy.pk)
+        copy = self.get_copy()
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('a', None, None))
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_available, 1)
+
+    def test_conflicts(self):
+        circulation.checkout(self.copy.pk, self.patron)
+        with self.assertRaises(circulation.LoanConflict) as context:
+            circulation.checkout(self.copy.pk, self.other)
+        self.assertEqual((context.exception.status, context.exception.borrower_id), ('o', self.patron.pk))
+        with self.assertRaises(circulation.LoanConflict):
+            circulation.reserve(self.copy.pk, self.other)
+        circulation.return_copy(self.copy.pk)
+        with self.assertRaises(circulation.LoanConflict):
+            circulation.return_copy(self.copy.pk)
+        # Nothing was overwritten
+        self.assertEqual(self.get_copy().status, 'a')
+        with self.assertRaises(BookInstance.DoesNotExist):
+            circulation.return_copy(uuid.uuid4())
+
+    def test_reserved_copy_checked_out_by_its_borrower(self):
+        circulation.reserve(self.copy.pk, self.patron)
+        self.assertEqual(self.get_copy().status, 'r')
+        with self.assertRaises(circulation.LoanConflict):
+            circulation.checkout(self.copy.pk, self.other)
+        circulation.checkout(self.copy.pk, self.patron, datetime.date.today())
+        self.assertEqual(self.get_copy().status, 'o')
+
+class CirculationViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.copy = BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.patron = User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+
+    def test_checkout(self):
+        self.client.force_login(self.librarian)
+        url = reverse('checkout-book-librarian', args=[self.copy.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_checkout_librarian.html')
+        due_back = datetime.date.today() + datetime.timedelta(weeks=1)
+        response = self.client.post(url, {'borrower': self.patron.pk, 'due_back': due_back})
+        self.assertRedirects(response, reverse('all-borrowed'))
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('o', self.patron, due_back))
+        # A second checkout, from a page loaded before the first one
+        response = self.client.post(url, {'borrower': self.librarian.pk, 'due_back': due_back})
+        self.assertEqual(response.status_code, 409)
+        self.assertTemplateUsed(response, 'catalog/loan_conflict.html')
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).borrower, self.patron)
+
+    def test_return(self):
+        url = reverse('return-book-librarian', args=[self.copy.pk])
+        self.client.force_login(self.patron)
+        # Redirected to the login page, as by renew-book-librarian
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+        self.client.force_login(self.librarian)
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        circulation.checkout(self.copy.pk, self.patron)
+        self.assertRedirects(self.client.post(url), reverse('bookinstance-detail', args=[self.copy.pk]))
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+
+    def test_reserve(self):
+        url = reverse('reserve-book', args=[self.copy.pk])
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+        self.client.force_login(self.patron)
+        self.assertContains(self.client.get(reverse('bookinstance-detail', args=[self.copy.pk])), 'value="Reserve"')
+        self.assertRedirects(self.client.post(url), reverse('bookinstance-detail', args=[self.copy.pk]))
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower), ('r', self.patron))
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.assertEqual(self.client.post(reverse('reserve-book', args=[uuid.uuid4()])).status_code, 404)
+
+class BatchCirculationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.copies = [
+            BookInstance.objects.create(book=cls.book, imprint=f'Unlikely Imprint, 2016 #{number}', status='a')
+            for number in range(5)
+        ]
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.patron = User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+
+    def test_batch(self):
+        ids = [str(copy.pk) for copy in self.copies]
+        circulation.checkout(self.copies[0].pk, self.librarian)
+        missing = str(uuid.uuid4())
+        results = circulation.batch_circulate('checkout', ids + [ids[1], missing, 'not-a-uuid'], self.patron)
+        self.assertEqual(results, [
+            (ids[0], 'conflict', 'o'), (ids[1], 'ok', 'o'), (ids[2], 'ok', 'o'), (ids[3], 'ok', 'o'),
+            (ids[4], 'ok', 'o'), (missing, 'not_found', None), ('not-a-uuid', 'invalid', None),
+        ])
+        self.assertEqual(BookInstance.objects.filter(borrower=self.patron, status='o').count(), 4)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_loan, 5)
+        results = circulation.batch_circulate('return', ids)
+        self.assertEqual([result for copy_id, result, status in results], ['ok'] * 5)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_available, 5)
+
+    def test_batch_queries(self):
+        get_versions((Book, BookInstance))
+        # Savepoint, copies read and locked, waiting holds of the available copies, update,
+        # copy counters, holds fulfilled, release, and CACHE_WRITES
+        with self.assertNumQueries(7 + CACHE_WRITES):
+            circulation.batch_circulate('checkout', [copy.pk for copy in self.copies], self.patron)
+
+    def test_batch_copy_changed_concurrently(self):
+        ids = [str(copy.pk) for copy in self.copies[:3]]
+        lent = []
+
+        def lend_first_copy(execute, sql, params, many, context):
+            # Another desk lends the first copy once this one read it available
+            if sql.startswith('UPDATE "catalog_bookinstance"') and not lent:
+                lent.append(True)
+                models.QuerySet.update(BookInstance.objects.filter(pk=ids[0]), status='o', borrower=self.librarian)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(lend_first_copy):
+            results = circulation.batch_circulate('checkout', ids, self.patron)
+        self.assertEqual(results, [(ids[0], 'conflict', 'o'), (ids[1], 'ok', 'o'), (ids[2], 'ok', 'o')])
+        self.assertEqual(BookInstance.objects.get(pk=ids[0]).borrower, self.librarian)
+        self.assertEqual(BookInstance.objects.filter(borrower=self.patron, status='o').count(), 2)
+
+    def test_batch_errors(self):
+        with self.assertRaises(ValueError):
+            circulation.batch_circulate('checkout', [self.copies[0].pk])
+        with self.assertRaises(ValueError):
+            circulation.batch_circulate('renew', [self.copies[0].pk])
+
+    def test_view(self):
+        url = reverse('circulate-books')
+        due_back = datetime.date.today() + datetime.timedelta(days=7)
+        payload = {'action': 'checkout', 'ids': [str(self.copies[0].pk), 'x'], 'borrower': 'patron', 'due_back': due_back.isoformat()}
+        self.client.force_login(self.patron)
+        self.assertEqual(self.client.post(url, payload, content_type='application/json').status_code, 403)
+        self.client.force_login(self.librarian)
+        response = self.client.post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'results': [
+                {'id': str(self.copies[0].pk), 'result': 'ok', 'status': 'o'},
+                {'id': 'x', 'result': 'invalid', 'status': None},
+            ],
+            'ok': 1,
+        })
+        self.assertEqual(BookInstance.objects.get(pk=self.copies[0].pk).due_back, due_back)
+        for invalid in (
+            {**payload, 'borrower': 'nobody'}, {**payload, 'action': 'renew'}, {**payload, 'ids': 'x'},
+            {**payload, 'due_back': 'tomorrow'}, {**payload, 'due_back': '2099-01-01'}, {**payload, 'due_back': '2000-01-01'},
+            {'ids': []},
+        ):
+            self.assertEqual(self.client.post(url, invalid, content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post(url, 'not json', content_type='application/json').status_code, 400)
+
+class RenewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.patron = User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+        today = datetime.date.today()
+        cls.loans = [
+            BookInstance.objects.create(
+                book=cls.book, imprint=f'Unlikely Imprint, 2016 #{number}', status='o',
+                borrower=cls.patron, due_back=today + datetime.timedelta(days=number),
+            )
+            for number in range(-2, 3)
+        ]
+        cls.available = BookInstance.objects.create(book=cls.book, imprint='Unlikely Imprint, 2016', status='a')
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def test_renew(self):
+        due_back = datetime.date.today() + datetime.timedelta(days=1)
+        get_versions((Book, BookInstance))
+        with self.assertNumQueries(6 + CACHE_WRITES):
+            # Savepoint, count, books of the renewed copies, update, their counters, release
+            renewed, rejected = circulation.renew(BookInstance.objects.all(), due_back)
+        # The loans due tomorrow or later, and the available copy, are left unchanged
+        self.assertEqual((renewed, rejected), (3, 3))
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 4)
+        self.assertEqual(BookInstance.objects.get(pk=self.available.pk).due_back, None)
+
+    def test_view(self):
+        url = reverse('renew-books-librarian')
+        due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        data = {'copies': [self.loans[0].pk, self.available.pk], 'due_back': due_back}
+        self.client.force_login(self.patron)
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 0)
+        self.client.force_login(self.librarian)
+        response = self.client.post(url, data, follow=True)
+        self.assertRedirects(response, reverse('all-borrowed'))
+        self.assertContains(response, '1 loan(s) renewed')
+        self.assertContains(response, '1 rejected')
+        self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).due_back, due_back)
+
+        # All the loans due before a date, not the copies off loan with an earlier due date
+        returned = BookInstance.objects.create(
+            book=self.book, imprint='Unlikely Imprint, 2016', status='m', due_back=datetime.date.today() - datetime.timedelta(days=5),
+        )
+        response = self.client.post(url, {'due_before': datetime.date.today(), 'due_back': due_back}, follow=True)
+        self.assertContains(response, '1 loan(s) renewed until')
+        self.assertContains(response, '0 rejected')
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 2)
+        self.assertEqual(BookInstance.objects.get(pk=returned.pk).due_back, returned.due_back)
+
+    def test_view_invalid(self):
+        url = reverse('renew-books-librarian')
+        self.client.force_login(self.librarian)
+        too_late = datetime.date.today() + datetime.timedelta(weeks=5)
+        response = self.client.post(url, {'copies': [self.loans[0].pk], 'due_back': too_late}, follow=True)
+        self.assertContains(response, 'Invalid date - more than 4 weeks ahead')
+        response = self.client.post(url, {'due_back': datetime.date.today()}, follow=True)
+        self.assertContains(response, 'Select loans')
+        self.assertEqual(BookInstance.objects.filter(due_back__gt=datetime.date.today() + datetime.timedelta(days=2)).count(), 0)
+
+    def test_admin_action(self):
+        self.librarian.is_staff = True
+        self.librarian.save()
+        self.librarian.user_permissions.add(Permission.objects.get(codename='change_bookinstance'))
+        self.client.force_login(self.librarian)
+        response = self.client.post(reverse('admin:catalog_bookinstance_changelist'), {
+            'action': 'renew_loans', '_selected_action': [copy.pk for copy in self.loans],
+        }, follow=True)
+        self.assertContains(response, '5 loan(s) renewed')
+        self.assertEqual(
+            BookInstance.objects.filter(due_back=datetime.date.today() + circulation.LOAN_PERIOD).count(), 5
+        )
+
+class HoldTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.reader = User.objects.create_user(username='reader', password='2HJ1vRV0Z&3iD')
+        cls.copy = BookInstance.objects.create(
+            book=cls.book, imprint='Unlikely Imprint, 2016', status='o', borrower=cls.reader, due_back=datetime.date.today(),
+        )
+        cls.patrons = [User.objects.create_user(username=f'patron{number}', password='2HJ1vRV0Z&3iD') for number in range(3)]
+
+    def get_copy(self):
+        return BookInstance.objects.get(pk=self.copy.pk)
+
+    def test_queue(self):
+        holds = [circulation.place_hold(self.book.pk, patron) for patron in self.patrons]
+        self.assertEqual([hold.position() for hold in holds], [1, 2, 3])
+        # Holding again returns the current hold
+        self.assertEqual(circulation.place_hold(self.book.pk, self.patrons[1]).pk, holds[1].pk)
+
+        circulation.return_copy(self.copy.pk)
+        copy = self.get_copy()
+        self.assertEqual((copy.status, copy.borrower), ('r', self.patrons[0]))
+        hold = Hold.objects.get(pk=holds[0].pk)
+        self.assertEqual((hold.status, hold.bookinstance_id, hold.position()), (Hold.READY, self.copy.pk, None))
+        self.assertEqual(Hold.objects.get(pk=holds[1].pk).position(), 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_reserved, 1)
+
+        with self.assertRaises(circulation.LoanConflict):
+            circulation.checkout(self.copy.pk, self.patrons[1])
+        circulation.checkout(self.copy.pk, self.patrons[0])
+        self.assertEqual(Hold.objects.get(pk=holds[0].pk).status, Hold.FULFILLED)
+        circulation.return_copy(self.copy.pk)
+        self.assertEqual(self.get_copy().borrower, self.patrons[1])
+
+    def test_return_queries(self):
+        for patron in self.patrons:
+            circulation.place_hold(self.book.pk, patron)
+        get_versions((Book, BookInstance))
+        # Savepoint, copy updated and read, available copies of the book held, first hold read,
+        # copy reserved, hold ready, counters, release, and CACHE_WRITES
+        with self.assertNumQueries(9 + CACHE_WRITES):
+            circulation.return_copy(self.copy.pk)
+
+    def test_hold_served_concurrently(self):
+        holds = [circulation.place_hold(self.book.pk, patron) for patron in self.patrons[:2]]
+        other = BookInstance.objects.create(book=self.book, imprint='Folio, 1990', status='m')
+        served = []
+
+        def serve_first_hold(execute, sql, params, many, context):
+            # Another process serves the first hold (with another copy) once this one read the queue
+            if sql.startswith('UPDATE "catalog_hold"') and not served:
+                served.append(True)
+                models.QuerySet.update(BookInstance.objects.filter(pk=other.pk), status='r', borrower=self.patrons[0])
+                models.QuerySet.update(Hold.objects.filter(pk=holds[0].pk), status=Hold.READY, bookinstance=other)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(serve_first_hold):
+            circulation.return_copy(self.copy.pk)
+        # The copy went to the next hold instead
+        copy = self.get_copy()
+        self.assertEqual((copy.status, copy.borrower), ('r', self.patrons[1]))
+        self.assertEqual(Hold.objects.get(pk=holds[0].pk).bookinstance_id, other.pk)
+        self.assertEqual(Hold.objects.get(pk=holds[1].pk).bookinstance_id, self.copy.pk)
+
+    def test_copies_made_available_served(self):
+        holds = [circulation.place_hold(self.book.pk, patron) for patron in self.patrons]
+        # A new copy
+        new = BookInstance.objects.create(book=self.book, imprint='Folio 2020', status='a')
+        self.assertEqual((new.status, new.borrower), ('r', self.patrons[0]))
+        self.assertEqual(Hold.objects.get(pk=holds[0].pk).bookinstance_id, new.pk)
+        # Back from maintenance, as edited in the admin
+        copy = self.get_copy()
+        copy.status, copy.borrower, copy.due_back = 'm', None, None
+        copy.save()
+        copy.status = 'a'
+        copy.save()
+        self.assertEqual((self.get_copy().status, self.get_copy().borrower), ('r', self.patrons[1]))
+        # A reservation released by a bulk update
+        BookInstance.objects.filter(pk=new.pk).update(status='a', borrower=None)
+        self.assertEqual(BookInstance.objects.get(pk=new.pk).borrower, self.patrons[2])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_reserved, 2)
+
+    def test_available_copy_kept_for_holds(self):
+        hold = circulation.place_hold(self.book.pk, self.patrons[0])
+        # Made available without serving the holds (e.g. a hold skipped by a concurrent return)
+        models.QuerySet.update(BookInstance.objects.filter(pk=self.copy.pk), status='a', borrower=None)
+        with self.assertRaisesMessage(circulation.HoldsWaiting, 'kept for the patrons waiting'):
+            circulation.checkout(self.copy.pk, self.patrons[1])
+        with self.assertRaises(circulation.HoldsWaiting):
+            circulation.reserve(self.copy.pk, self.patrons[1])
+        self.assertEqual(circulation.batch_circulate('checkout', [self.copy.pk], self.patrons[1]), [(str(self.copy.pk), 'held', 'a')])
+        self.assertEqual(self.get_copy().status, 'a')
+        circulation.cancel_hold(hold.pk, self.patrons[0])
+        circulation.checkout(self.copy.pk, self.patrons[1])
+        self.assertEqual(self.get_copy().borrower, self.patrons[1])
+
+    def test_positions(self):
+        holds = [circulation.place_hold(self.book.pk, patron) for patron in self.patrons]
+        other = Book.objects.create(title='Other', summary='Summary', isbn='1234567890123')
+        circulation.place_hold(other.pk, self.patrons[2])
+        positions = dict(Hold.objects.with_positions().values_list('pk', 'queue_position'))
+        self.assertEqual([positions[hold.pk] for hold in holds], [hold.position() for hold in holds])
+        self.assertEqual([positions[hold.pk] for hold in holds], [1, 2, 3])
+        circulation.return_copy(self.copy.pk)
+        positions = dict(Hold.objects.with_positions().values_list('pk', 'queue_position'))
+        self.assertEqual([positions[hold.pk] for hold in holds], [None, 1, 2])
+
+    def test_borrowed_page_positions(self):
+        # The positions of the holds are read with the holds, whatever their number
+        self.client.force_login(self.patrons[1])
+        circulation.place_hold(self.book.pk, self.patrons[0])
+        circulation.place_hold(self.book.pk, self.patrons[1])
+        with CaptureQueriesContext(connection) as one_hold:
+            self.assertContains(self.client.get(reverse('my-borrowed')), '(number 2 in the queue)')
+        for number in range(3):
+            book = Book.objects.create(title=f'Other {number}', summary='Summary', isbn='1234567890123')
+            circulation.place_hold(book.pk, self.patrons[1])
+        with CaptureQueriesContext(connection) as holds:
+            self.assertContains(self.client.get(reverse('my-borrowed')), '(number 1 in the queue)', count=3)
+        self.assertEqual(len(holds), len(one_hold))
+
+    def test_copy_available(self):
+        circulation.return_copy(self.copy.pk)
+        hold = circulation.place_hold(self.book.pk, self.patrons[0])
+        self.assertEqual((hold.status, hold.bookinstance_id), (Hold.READY, self.copy.pk))
+        self.assertEqual(self.get_copy().status, 'r')
+        self.assertEqual(circulation.place_hold(self.book.pk, self.patrons[1]).position(), 1)
+
+    def test_cancel(self):
+        holds = [circulation.place_hold(self.book.pk, patron) for patron in self.patrons[:2]]
+        circulation.return_copy(self.copy.pk)
+        self.assertFalse(circulation.cancel_hold(holds[0].pk, self.patrons[1]))
+        self.assertTrue(circulation.cancel_hold(holds[0].pk, self.patrons[0]))
+        self.assertFalse(circulation.cancel_hold(holds[0].pk, self.patrons[0]))
+        # The copy goes to the next hold, then back on the shelf
+        self.assertEqual(self.get_copy().borrower, self.patrons[1])
+        self.assertTrue(circulation.cancel_hold(holds[1].pk, self.patrons[1]))
+        copy = self.get_copy()
+        self.assertEqual((copy.status, copy.borrower), ('a', None))
+        # A new hold once cancelled
+        self.assertNotEqual(circulation.place_hold(self.book.pk, self.patrons[0]).pk, holds[0].pk)
+
+    def test_expire_holds(self):
+        holds = [circulation.place_hold(self.book.pk, patron) for patron in self.patrons[:2]]
+        circulation.return_copy(self.copy.pk)
+        self.assertEqual(circulation.expire_holds(), 0)
+        Hold.objects.filter(pk=holds[0].pk).update(ready_at=timezone.now() - circulation.HOLD_PICKUP_PERIOD)
+        self.assertEqual(circulation.expire_holds(), 1)
+        self.assertEqual(Hold.objects.get(pk=holds[0].pk).status, Hold.CANCELLED)
+        self.assertEqual(self.get_copy().borrower, self.patrons[1])
+
+    def test_batch_return(self):
+        hold = circulation.place_hold(self.book.pk, self.patrons[0])
+        circulation.batch_circulate('return', [self.copy.pk])
+        self.assertEqual(Hold.objects.get(pk=hold.pk).status, Hold.READY)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).num_instances_reserved, 1)
+        circulation.batch_circulate('checkout', [self.copy.pk], self.patrons[0])
+        self.assertEqual(Hold.objects.get(pk=hold.pk).status, Hold.FULFILLED)
+
+    def test_views(self):
+        url = reverse('place-hold', args=[self.book.pk])
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.assertFalse(Hold.objects.exists())
+        self.client.force_login(self.patrons[0])
+        self.assertContains(self.client.get(reverse('bookinstance-detail', args=[self.copy.pk])), 'value="Place a hold"')
+        response = self.client.post(url, follow=True)
+        self.assertRedirects(response, reverse('my-borrowed'))
+        self.assertContains(response, 'You are number 1 in the queue')
+        self.assertContains(response, '(number 1 in the queue)')
+        self.assertEqual(self.client.post(reverse('place-hold', args=[self.book.pk + 1])).status_code, 404)
+        hold = Hold.objects.get()
+        self.client.force_login(self.patrons[1])
+        self.assertEqual(self.client.post(reverse('cancel-hold', args=[hold.pk])).status_code, 404)
+        self.client.force_login(self.patrons[0])
+        self.assertContains(self.client.post(reverse('cancel-hold', args=[hold.pk]), follow=True), 'Your hold is cancelled.')
+        self.assertEqual(Hold.objects.get().status, Hold.CANCELLED)
+
+class CirculationConcurrencyTest(TransactionTestCase):
+    """Loan operations run concurrently by threads, each with its own database connection."""
+    THREADS = 8
+
+    def setUp(self):
+        book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        self.copy = BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+        self.users = [User.objects.create_user(username=f'user{number}') for number in range(self.THREADS)]
+
+    def retry_locked(self, operation, *args):
+        """
+        Run operation, again while SQLite reports a locked table: its in-memory test
+        database fails concurrent writes at once instead of waiting (not a lost update).
+        """
+        while True:
+            try:
+                return operation(*args)
+            except OperationalError as e:
+                if connection.vendor != 'sqlite' or 'locked' not in str(e):
+                    raise
+                time.sleep(0.001)
+
+    def run_threads(self, target):
+        errors = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def run(user):
+            try:
+                barrier.wait()
+                target(user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=[user]) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_one_checkout_wins(self):
+        winners, conflicts = [], []
+
+        def checkout(user):
+            try:
+                self.retry_locked(circulation.checkout, self.copy.pk, user)
+                winners.append(user)
+            except circulation.LoanConflict:
+                conflicts.append(user)
+
+        self.run_threads(checkout)
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(len(conflicts), self.THREADS - 1)
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower), ('o', winners[0]))
+
+    def test_no_lost_updates(self):
+        # Threads check out and return the copy in a loop: it is never lent twice at once
+        lock = threading.Lock()
+        state = {'borrowers': 0, 'max_borrowers': 0, 'loans': 0}
+
+        def borrow(user):
+            for attempt in range(20):
+                try:
+                    self.retry_locked(circulation.checkout, self.copy.pk, user)
+                except circulation.LoanConflict:
+                    continue
+                with lock:
+                    state['borrowers'] += 1
+                    state['max_borrowers'] = max(state['max_borrowers'], state['borrowers'])
+                    state['loans'] += 1
+                time.sleep(0.001)
+                with lock:
+                    state['borrowers'] -= 1
+                self.retry_locked(circulation.return_copy, self.copy.pk)
+
+        self.run_threads(borrow)
+        self.assertEqual(state['max_borrowers'], 1)
+        self.assertGreater(state['loans'], 0)
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower), ('a', None))
+        self.assertEqual(Book.objects.get(pk=copy.book_id).num_instances_available, 1)
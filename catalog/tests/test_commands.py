@@ -0,0 +1,361 @@
+from django.test import TestCase, override_settings
+
+import datetime, json, os, shutil, tempfile
+from io import StringIO
+from unittest import mock
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.contrib.auth.models import User
+from catalog.models import Author, Book, BookInstance, Genre, Language, OverdueNotice, Task
+
+class RebuildCopyCountsCommandTest(TestCase):
+    def setUp(self):
+        test_language = Language.objects.create(name='English')
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        for book_id in range(3):
+            test_book = Book.objects.create(title=f'Book Title {book_id}', summary='My book summary', isbn='ABCDEFG', author=test_author, language=test_language)
+            for status in ['a', 'o', 'o', 'm', 'r'][:book_id + 2]:
+                BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status=status)
+
+    def test_rebuild_copy_counts(self):
+        Book.objects.update(num_instances=0, num_instances_available=0, num_instances_loan=0, num_instances_maintenance=0)
+        out = StringIO()
+        call_command('rebuild_copy_counts', batch_size=2, stdout=out)
+        self.assertIn('3 books', out.getvalue())
+        counters = list(Book.objects.order_by('title').values_list('num_instances', 'num_instances_available', 'num_instances_loan', 'num_instances_maintenance'))
+        self.assertEqual(counters, [(2, 1, 1, 0), (3, 1, 2, 0), (4, 1, 2, 1)])
+
+class BenchmarkIndexesCommandTest(TestCase):
+    def setUp(self):
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        for status in ['a', 'o', 'm']:
+            BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status=status)
+
+    def test_indexes_exist(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, BookInstance._meta.db_table)
+        self.assertEqual(constraints['bookinst_status_due_idx']['columns'], ['status', 'due_back', 'id'])
+        self.assertEqual(constraints['bookinst_borrower_due_idx']['columns'], ['borrower_id', 'status', 'due_back', 'id'])
+
+    def test_benchmark_restores_indexes(self):
+        out = StringIO()
+        call_command('benchmark_indexes', repeat=1, stdout=out)
+        self.assertIn('Without indexes', out.getvalue())
+        self.assertIn('all borrowed (status, due_back)', out.getvalue())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Book._meta.db_table)
+        self.assertIn('book_title_idx', constraints)
+
+class SeedCatalogCommandTest(TestCase):
+    def seed(self, **options):
+        options = {'authors': 20, 'books': 50, 'users': 10, 'genres': 5, 'languages': 3, 'batch_size': 15, **options}
+        call_command('seed_catalog', stdout=StringIO(), **options)
+
+    def test_seed_catalog_counts(self):
+        self.seed()
+        self.assertEqual(Author.objects.count(), 20)
+        self.assertEqual(Book.objects.count(), 50)
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Genre.objects.count(), 5)
+        self.assertEqual(Language.objects.count(), 3)
+        self.assertGreater(BookInstance.objects.count(), 0)
+        # Every book has 1 to 3 genres
+        for book in Book.objects.prefetch_related('genre'):
+            self.assertIn(len(book.genre.all()), [1, 2, 3])
+
+    def test_seed_catalog_copy_counters(self):
+        self.seed()
+        for book in Book.objects.annotate(copies=Count('bookinstance')):
+            self.assertEqual(book.num_instances, book.copies)
+        self.assertEqual(
+            sum(Book.objects.values_list('num_instances_loan', flat=True)),
+            BookInstance.objects.filter(status='o').count(),
+        )
+
+    def test_loans_have_borrower_and_due_date(self):
+        self.seed()
+        self.assertFalse(BookInstance.objects.filter(status='o', borrower__isnull=True).exists())
+        self.assertFalse(BookInstance.objects.filter(status='o', due_back__isnull=True).exists())
+
+    def test_seed_catalog_is_deterministic(self):
+        self.seed(seed=7)
+        titles = list(Book.objects.order_by('id').values_list('title', 'isbn'))
+        copies = sorted(BookInstance.objects.values_list('id', flat=True))
+        BookInstance.objects.all().delete()
+        Book.objects.all().delete()
+        self.seed(seed=7)
+        self.assertEqual(list(Book.objects.order_by('id').values_list('title', 'isbn')), titles)
+        self.assertEqual(sorted(BookInstance.objects.values_list('id', flat=True)), copies)
+
+    def test_seed_catalog_adds_to_existing_data(self):
+        self.seed()
+        self.seed(seed=1)
+        self.assertEqual(Book.objects.count(), 100)
+        self.assertEqual(User.objects.count(), 20)
+
+class BenchmarkViewsCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_language = Language.objects.create(name='English')
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=test_author, language=test_language)
+        BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='a')
+        User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+
+    def setUp(self):
+        self.output = os.path.join(tempfile.mkdtemp(), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.output))
+
+    def benchmark(self, **options):
+        out = StringIO()
+        call_command('benchmark_views', iterations=2, warmup=0, output=self.output, stdout=out, stderr=StringIO(), **options)
+        with open(self.output) as results:
+            return json.load(results), out.getvalue()
+
+    def test_benchmark_all_routes(self):
+        results, out = self.benchmark()
+        self.assertIn('book-detail', out)
+        route = results['routes']['book-detail']
+        self.assertEqual(route['url'], '/catalog/book/1')
+        self.assertEqual(route['status'], 200)
+        self.assertGreater(route['queries'], 0)
+        self.assertGreater(route['template_ms'], 0)
+        self.assertLessEqual(route['p50_ms'], route['p99_ms'])
+        self.assertEqual(results['routes']['all-borrowed']['status'], 302)
+        self.assertEqual(results['meta']['mode'], 'client')
+
+    def test_benchmark_logged_in(self):
+        results, out = self.benchmark(username='testuser1', routes=['my-borrowed'])
+        self.assertEqual(list(results['routes']), ['my-borrowed'])
+        self.assertEqual(results['routes']['my-borrowed']['status'], 200)
+
+    def test_no_regression_over_itself(self):
+        results, out = self.benchmark(routes=['books'])
+        baseline = os.path.join(os.path.dirname(self.output), 'baseline.json')
+        shutil.copy(self.output, baseline)
+        results, out = self.benchmark(routes=['books'], baseline=baseline, threshold=100)
+        self.assertIn('No regression', out)
+
+    def test_regression_over_baseline(self):
+        results, out = self.benchmark(routes=['books'])
+        results['routes']['books']['p95_ms'] = 0.001
+        results['routes']['books']['queries'] = 1
+        baseline = os.path.join(os.path.dirname(self.output), 'baseline.json')
+        with open(baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'books: p95_ms 0.00 ->'):
+            self.benchmark(routes=['books'], baseline=baseline)
+
+class ImportCatalogCommandTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.existing_author = Author.objects.create(first_name='John', last_name='Tolkien')
+        self.existing_genre = Genre.objects.create(name='Fantasy')
+        self.existing_book = Book.objects.create(title='The Hobbit', summary='Summary', isbn='9780261102217')
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as input_file:
+            input_file.write('\n'.join(lines) + '\n')
+        return path
+
+    def import_catalog(self, path, **options):
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_csv(self):
+        path = self.write('books.csv', [
+            'isbn,title,summary,author_first_name,author_last_name,language,genres,imprint,status,due_back,copy_language',
+            '9780008202132,The Lay of Aotrou,A lay,John,Tolkien,English,Poems;Fantasy,Harper 2016,a,,',
+            '9780008202132,The Lay of Aotrou,A lay,John,Tolkien,English,Poems;Fantasy,Harper 2017,o,2030-01-02,French',
+            '9780261102217,The Hobbit,Summary,John,Tolkien,English,Fantasy,Allen 1937,m,,',
+            '9780140449136,Crime and Punishment,A crime,Fyodor,Dostoevsky,Russian,,,,,',
+        ])
+        out = self.import_catalog(path, batch_size=2)
+        self.assertIn('Imported 4 records', out)
+        self.assertEqual(Book.objects.count(), 3)
+        lay = Book.objects.get(isbn='9780008202132')
+        self.assertEqual(lay.author, self.existing_author)
+        self.assertEqual(lay.language.name, 'English')
+        self.assertEqual(sorted(genre.name for genre in lay.genre.all()), ['Fantasy', 'Poems'])
+        self.assertEqual(Genre.objects.filter(name='Fantasy').count(), 1)
+        self.assertIn('Tolkien', lay.search_document)
+        # Copies are added to the books, existing or imported
+        self.assertEqual((lay.num_instances, lay.num_instances_available, lay.num_instances_loan), (2, 1, 1))
+        loan = lay.bookinstance_set.get(status='o')
+        self.assertEqual(str(loan.due_back), '2030-01-02')
+        self.assertEqual(loan.language.name, 'French')
+        self.existing_book.refresh_from_db()
+        self.assertEqual(self.existing_book.num_instances, 1)
+        self.assertEqual(Book.objects.get(isbn='9780140449136').num_instances, 0)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_import_jsonl(self):
+        path = self.write('books.jsonl', [
+            json.dumps({'isbn': '1', 'title': 'One', 'author_last_name': 'Smith', 'genres': ['Essays'],
+                        'copies': [{'imprint': 'A', 'status': 'a', 'id': '2a2c6b1e-1b1e-4c1e-9d1e-1b1e1b1e1b1e'}, {'imprint': 'B'}]}),
+            '',
+            json.dumps({'isbn': '2', 'title': 'Two', 'author_last_name': 'Smith'}),
+        ])
+        self.import_catalog(path)
+        one = Book.objects.get(isbn='1')
+        self.assertEqual(one.author, Book.objects.get(isbn='2').author)
+        self.assertEqual(one.num_instances, 2)
+        self.assertTrue(BookInstance.objects.filter(pk='2a2c6b1e-1b1e-4c1e-9d1e-1b1e1b1e1b1e', book=one).exists())
+        self.assertTrue(BookInstance.objects.filter(imprint='B', status='m').exists())
+
+    def test_resume_after_failure(self):
+        records = [json.dumps({'isbn': str(isbn), 'title': f'Book {isbn}', 'copies': [{'imprint': 'A'}]}) for isbn in range(5)]
+        records[3] = json.dumps({'isbn': '3', 'title': 'Book 3', 'copies': [{'imprint': 'A', 'status': 'x'}]})
+        path = self.write('books.jsonl', records)
+        with self.assertRaisesMessage(CommandError, "Record 4: unknown copy status 'x'"):
+            self.import_catalog(path, batch_size=2)
+        # The first batch is imported, the second one is rolled back
+        self.assertEqual(Book.objects.filter(title__startswith='Book').count(), 2)
+        with self.assertRaisesMessage(CommandError, 'run again with --resume'):
+            self.import_catalog(path, batch_size=2)
+        records[3] = json.dumps({'isbn': '3', 'title': 'Book 3', 'copies': [{'imprint': 'A'}]})
+        self.write('books.jsonl', records)
+        out = self.import_catalog(path, batch_size=2, resume=True)
+        self.assertIn('Resuming after record 2', out)
+        self.assertEqual(Book.objects.filter(title__startswith='Book').count(), 5)
+        self.assertEqual(BookInstance.objects.count(), 5)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_invalid_records(self):
+        path = self.write('books.jsonl', [json.dumps({'title': 'No ISBN'})])
+        with self.assertRaisesMessage(CommandError, 'Record 1: title and isbn are required.'):
+            self.import_catalog(path)
+        with self.assertRaisesMessage(CommandError, 'Unknown input format'):
+            self.import_catalog(self.write('books.txt', []))
+
+class ExportCatalogCommandTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        for book_id in range(5):
+            test_book = Book.objects.create(title=f'Book Title {book_id}', summary='My book summary', isbn=f'ABCDEFG{book_id}', author=test_author)
+            test_book.genre.add(Genre.objects.create(name=f'Genre {book_id}'))
+            BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='o')
+
+    def test_export_all_datasets(self):
+        out = StringIO()
+        call_command('export_catalog', output_dir=self.directory, chunk_size=2, stdout=out)
+        self.assertIn('books.csv: 5 rows', out.getvalue())
+        self.assertCountEqual(os.listdir(self.directory), ['books.csv', 'authors.csv', 'copies.csv'])
+        with open(os.path.join(self.directory, 'books.csv')) as books:
+            lines = books.read().splitlines()
+        # Genres of every chunk of 2 books
+        self.assertEqual([line.rsplit(',', 1)[1] for line in lines[1:]], [f'Genre {book_id}' for book_id in range(5)])
+
+    def test_export_genres_per_chunk(self):
+        # One query for the books (fetched from the cursor in chunks), one for the genres of each chunk of 2 books
+        with self.assertNumQueries(4):
+            call_command('export_catalog', 'books', output_dir=self.directory, chunk_size=2, stdout=StringIO())
+
+    def test_export_reimported(self):
+        call_command('export_catalog', 'books', format='jsonl', output_dir=self.directory, stdout=StringIO())
+        path = os.path.join(self.directory, 'books.jsonl')
+        Book.objects.all().delete()
+        call_command('import_catalog', path, stdout=StringIO())
+        book = Book.objects.get(isbn='ABCDEFG3')
+        self.assertEqual(book.author.last_name, 'Smith')
+        self.assertEqual([genre.name for genre in book.genre.all()], ['Genre 3'])
+
+    def test_unknown_dataset(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown datasets: users.'):
+            call_command('export_catalog', 'users', output_dir=self.directory)
+
+class CirculateBooksCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.copies = [BookInstance.objects.create(book=book, imprint=f'Imprint {number}', status='a') for number in range(3)]
+        User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+
+    def test_checkout_and_return(self):
+        ids = [str(copy.pk) for copy in self.copies]
+        out = StringIO()
+        due_back = (datetime.date.today() + datetime.timedelta(days=7)).isoformat()
+        call_command('circulate_books', 'checkout', *ids, 'bad-id', borrower='patron', due_back=due_back, stdout=out)
+        self.assertIn(f'{ids[0]} ok', out.getvalue())
+        self.assertIn('bad-id invalid', out.getvalue())
+        self.assertIn('4 copies', out.getvalue())
+        self.assertEqual(BookInstance.objects.filter(status='o', borrower__username='patron').count(), 3)
+        out = StringIO()
+        call_command('circulate_books', 'checkout', ids[0], borrower='patron', stdout=out)
+        self.assertIn(f'{ids[0]} conflict o', out.getvalue())
+        call_command('circulate_books', 'return', *ids, stdout=StringIO())
+        self.assertEqual(BookInstance.objects.filter(status='a').count(), 3)
+
+    def test_errors(self):
+        with self.assertRaisesMessage(CommandError, 'A checkout needs --borrower.'):
+            call_command('circulate_books', 'checkout', str(self.copies[0].pk))
+        with self.assertRaisesMessage(CommandError, "Unknown user 'nobody'."):
+            call_command('circulate_books', 'checkout', str(self.copies[0].pk), borrower='nobody')
+        with self.assertRaisesMessage(CommandError, 'Invalid date - more than 4 weeks ahead'):
+            call_command('circulate_books', 'checkout', str(self.copies[0].pk), borrower='patron', due_back='2099-01-01')
+        self.assertEqual(BookInstance.objects.filter(status='o').count(), 0)
+
+class SendOverdueNoticesCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        cls.users = [User.objects.create_user(username=f'patron{number}', email=f'patron{number}@example.com') for number in range(3)]
+        no_email = User.objects.create_user(username='noemail')
+        last_week = datetime.date.today() - datetime.timedelta(weeks=1)
+        # patron0 has 2 overdue loans, patron1 one, patron2 a loan not due yet
+        for user, due_back in [
+            (cls.users[0], last_week), (cls.users[0], last_week), (cls.users[1], last_week),
+            (cls.users[2], datetime.date.today()), (no_email, last_week),
+        ]:
+            BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='o', borrower=user, due_back=due_back)
+
+    def send(self, **options):
+        out = StringIO()
+        call_command('send_overdue_notices', stdout=out, **options)
+        return out.getvalue()
+
+    def test_one_digest_per_borrower(self):
+        self.assertIn('Sent 2 notices (3 overdue loans)', self.send(batch_size=1))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['patron0@example.com', 'patron1@example.com'])
+        digest = next(message for message in mail.outbox if message.to == ['patron0@example.com'])
+        self.assertEqual(digest.subject, '2 overdue books')
+        self.assertEqual(digest.body.count('Book Title, due back on'), 2)
+        self.assertEqual(OverdueNotice.objects.count(), 3)
+
+    def test_rerun_sends_nothing(self):
+        self.send()
+        mail.outbox = []
+        self.assertIn('Sent 0 notices', self.send())
+        self.assertEqual(mail.outbox, [])
+        # A renewed loan overdue again is notified again
+        copy = BookInstance.objects.filter(borrower=self.users[1]).get()
+        BookInstance.objects.filter(pk=copy.pk).update(due_back=datetime.date.today() - datetime.timedelta(days=1))
+        self.assertIn('Sent 1 notices (1 overdue loans)', self.send())
+        self.assertEqual(mail.outbox[0].to, ['patron1@example.com'])
+
+    @override_settings(EMAIL_BACKEND='catalog.mail.QueuedEmailBackend')
+    def test_not_queued(self):
+        # Delivered, not queued for the worker, before being recorded
+        self.send()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(Task.objects.exists())
+
+    def test_failed_send_not_recorded(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.send()
+        self.assertFalse(OverdueNotice.objects.exists())
+        self.assertIn('Sent 2 notices', self.send())
+
+    def test_queries(self):
+        # The overdue loans, then one insert of the notices per batch (in a savepoint)
+        with self.assertNumQueries(7):
+            self.send(batch_size=1)
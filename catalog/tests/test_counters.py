@@ -0,0 +1,107 @@
+from django.test import TestCase
+
+from collections import Counter
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError
+from django.urls import reverse
+from catalog import counters
+from catalog.models import Author, Book, PageView
+
+def isolate_buffer(test):
+    """Start test with an empty buffer, leaving aside the views buffered by other tests."""
+    patcher = mock.patch.object(counters, '_pending', Counter())
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+class CountersTest(TestCase):
+    def setUp(self):
+        isolate_buffer(self)
+
+    def test_buffered_until_flush(self):
+        counters.record(PageView.BOOK, 1)
+        counters.record(PageView.BOOK, 1)
+        counters.record(PageView.AUTHOR, 1)
+        self.assertEqual(counters.pending(PageView.BOOK, 1), 2)
+        self.assertEqual(PageView.objects.views(PageView.BOOK, 1), 0)
+        self.assertEqual(counters.flush(), 2)
+        self.assertEqual(counters.pending(PageView.BOOK, 1), 0)
+        self.assertEqual(PageView.objects.views(PageView.BOOK, 1), 2)
+        self.assertEqual(PageView.objects.views(PageView.AUTHOR, 1), 1)
+        # Flushed views add up
+        counters.record(PageView.BOOK, 1, views=3)
+        counters.flush()
+        self.assertEqual(PageView.objects.views(PageView.BOOK, 1), 5)
+        self.assertEqual(PageView.objects.count(), 2)
+        self.assertEqual(counters.flush(), 0)
+
+    def test_flushed_when_full(self):
+        with mock.patch('catalog.counters.MAX_PENDING', 2):
+            counters.record(PageView.BOOK, 1)
+            self.assertEqual(PageView.objects.count(), 0)
+            counters.record(PageView.BOOK, 2)
+        self.assertEqual(PageView.objects.count(), 2)
+
+    def test_flushed_when_due(self):
+        with mock.patch('catalog.counters.FLUSH_INTERVAL', 0):
+            counters.record(PageView.BOOK, 1)
+        self.assertEqual(PageView.objects.views(PageView.BOOK, 1), 1)
+
+    def test_kept_when_flush_fails(self):
+        counters.record(PageView.BOOK, 1)
+        with mock.patch('catalog.counters._upsert', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                counters.flush()
+        self.assertEqual(counters.pending(PageView.BOOK, 1), 1)
+
+    def test_request_path_survives_failed_flush(self):
+        with mock.patch('catalog.counters.FLUSH_INTERVAL', 0), \
+                mock.patch('catalog.counters._upsert', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('catalog.counters', 'ERROR'):
+                counters.record(PageView.BOOK, 1)
+        self.assertEqual(counters.pending(PageView.BOOK, 1), 1)
+
+    def test_views_of_another_database_dropped(self):
+        counters.record(PageView.BOOK, 1)
+        with mock.patch('catalog.counters._current_database', return_value='other.sqlite3'):
+            self.assertEqual(counters.flush(), 0)
+        self.assertFalse(PageView.objects.exists())
+
+class PageViewCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=cls.author)
+
+    def setUp(self):
+        isolate_buffer(self)
+
+    def test_detail_views_counted(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        response = self.client.get(url)
+        # Cached responses and 304 are counted too
+        self.client.get(url)
+        self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.client.get(reverse('author-detail', args=[self.author.pk]))
+        self.client.get(reverse('book-detail', args=[999]))
+        self.assertEqual(counters.pending(PageView.BOOK, self.book.pk), 3)
+        self.assertEqual(counters.pending(PageView.AUTHOR, self.author.pk), 1)
+        self.assertEqual(counters.pending(PageView.BOOK, 999), 0)
+        counters.flush()
+        cache.clear()
+        self.assertContains(self.client.get(url), 'Viewed 3 times')
+
+    def test_index_visits(self):
+        user = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+        self.client.force_login(user)
+        self.client.get(reverse('index'))
+        counters.flush()
+        # Flushed and pending visits
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 2)
+
+    def test_views_of_deleted_book_dropped(self):
+        counters.record(PageView.BOOK, self.book.pk)
+        counters.flush()
+        Book.objects.get(pk=self.book.pk).delete()
+        self.assertFalse(PageView.objects.filter(kind=PageView.BOOK).exists())
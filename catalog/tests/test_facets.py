@@ -0,0 +1,99 @@
+from django.test import TestCase
+
+from unittest import mock
+from django.http import QueryDict
+from django.urls import reverse
+from catalog import facets, tasks
+from catalog.caching import get_versions
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.tests.cache_queries import GET, SET
+
+class FacetsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poems = Genre.objects.create(name='Poems')
+        cls.english = Language.objects.create(name='English')
+        cls.french = Language.objects.create(name='French')
+        cls.tolkien = Author.objects.create(first_name='John', last_name='Tolkien')
+        cls.hugo = Author.objects.create(first_name='Victor', last_name='Hugo')
+        cls.hobbit = Book.objects.create(title='The Hobbit', summary='Summary', isbn='1', author=cls.tolkien, language=cls.english)
+        cls.hobbit.genre.set([cls.fantasy])
+        cls.lays = Book.objects.create(title='The Lays', summary='Summary', isbn='2', author=cls.tolkien, language=cls.english)
+        cls.lays.genre.set([cls.fantasy, cls.poems])
+        cls.contemplations = Book.objects.create(
+            title='Les Contemplations', summary='Summary', isbn='3', author=cls.hugo, language=cls.french,
+        )
+        cls.contemplations.genre.set([cls.poems])
+        BookInstance.objects.create(book=cls.hobbit, imprint='Unlikely Imprint, 2016', status='a')
+
+    def filters(self, query=''):
+        return facets.parse_filters(QueryDict(query))
+
+    def test_parse_filters(self):
+        self.assertEqual(self.filters('genre=2&genre=1&genre=x&author=3&available=1'), {
+            'genre': [1, 2], 'language': [], 'author': [3], 'available': True,
+        })
+
+    def test_filter_books(self):
+        books = Book.objects.order_by('title')
+        filters = self.filters(f'genre={self.fantasy.pk}&genre={self.poems.pk}')
+        # Listed once, with both genres
+        self.assertEqual(list(facets.filter_books(books, filters)), [self.contemplations, self.hobbit, self.lays])
+        filters = self.filters(f'genre={self.poems.pk}&language={self.english.pk}')
+        self.assertEqual(list(facets.filter_books(books, filters)), [self.lays])
+        self.assertEqual(list(facets.filter_books(books, self.filters('available=1'))), [self.hobbit])
+
+    def test_counts(self):
+        counts = facets.compute_facets(self.filters())
+        self.assertEqual(counts['genre'], [(self.fantasy.pk, 'Fantasy', 2), (self.poems.pk, 'Poems', 2)])
+        self.assertEqual(counts['language'], [(self.english.pk, 'English', 2), (self.french.pk, 'French', 1)])
+        self.assertEqual(counts['author'], [(self.tolkien.pk, 'John Tolkien', 2), (self.hugo.pk, 'Victor Hugo', 1)])
+        self.assertEqual(counts['available'], 1)
+
+    def test_counts_of_other_dimensions(self):
+        counts = facets.compute_facets(self.filters(f'genre={self.poems.pk}&language={self.french.pk}'))
+        # The genres of the French books, and the languages of the poems
+        self.assertEqual(counts['genre'], [(self.poems.pk, 'Poems', 1)])
+        self.assertEqual(counts['language'], [(self.english.pk, 'English', 1), (self.french.pk, 'French', 1)])
+        self.assertEqual(counts['author'], [(self.hugo.pk, 'Victor Hugo', 1)])
+        self.assertEqual(counts['available'], 0)
+        # A selected value is listed without books
+        counts = facets.compute_facets(self.filters(f'genre={self.fantasy.pk}&language={self.french.pk}'))
+        self.assertEqual(counts['genre'], [(self.fantasy.pk, 'Fantasy', 0), (self.poems.pk, 'Poems', 1)])
+
+    @mock.patch('catalog.facets.AUTHOR_FACET_SIZE', 1)
+    def test_author_facet_size(self):
+        self.assertEqual(facets.compute_facets(self.filters())['author'], [(self.tolkien.pk, 'John Tolkien', 2)])
+        # Selected authors are counted too
+        counts = facets.compute_facets(self.filters(f'author={self.hugo.pk}'))
+        self.assertEqual([pk for pk, name, count in counts['author']], [self.tolkien.pk, self.hugo.pk])
+
+    def test_queries_and_cache(self):
+        filters = self.filters(f'genre={self.poems.pk}&author={self.tolkien.pk}&available=1')
+        get_versions((Genre, Language, Author))
+        # Versions of the names, counts and names of each dimension, and the availability count
+        with self.assertNumQueries(7 + 2 * GET + SET):
+            facets.facet_counts(filters)
+        with self.assertNumQueries(2 * GET):
+            facets.facet_counts(self.filters(f'author={self.tolkien.pk}&genre={self.poems.pk}&available=1'))
+
+    def test_refresh_task(self):
+        tasks.refresh_facets()
+        with self.assertNumQueries(4 * GET):
+            facets.facet_counts(self.filters())
+            facets.facet_counts(self.filters('available=1'))
+
+    def test_toggle_query(self):
+        query = QueryDict(f'genre={self.fantasy.pk}&page=2')
+        self.assertEqual(facets.toggle_query(query, 'genre', self.poems.pk), f'?genre={self.fantasy.pk}&genre={self.poems.pk}')
+        self.assertEqual(facets.toggle_query(query, 'genre', self.fantasy.pk), '?')
+
+    def test_view(self):
+        response = self.client.get(reverse('books') + f'?genre={self.poems.pk}')
+        self.assertEqual(list(response.context['book_list']), [self.contemplations, self.lays])
+        self.assertContains(response, f'href="/catalog/books/?genre={self.poems.pk}&amp;language={self.french.pk}">French</a> (1)')
+        self.assertContains(response, f'href="/catalog/books/?" class="font-weight-bold" aria-current="true">Poems</a> (2)')
+        self.assertContains(response, 'Available now</a> (0)')
+        response = self.client.get(reverse('books') + f'?genre={self.poems.pk}&language=0')
+        self.assertContains(response, 'No book matches these filters.')
@@ -0,0 +1,85 @@
+from django.test import TestCase, override_settings
+
+from django.contrib.auth.models import User
+from django.apps import apps
+from django.urls import reverse
+from catalog import profiling
+from catalog.caching import get_versions
+from catalog.models import Author, Book, Language
+from catalog.tests.cache_queries import GET, SET
+
+# Book detail page: its queries (see ViewQueryCountTest), the versions and the page in cache, the page stored
+BOOK_DETAIL_QUERIES = 5 + 2 * GET + SET
+
+@override_settings(
+    CATALOG_PERF_SAMPLE_RATE=1, CATALOG_PERF_QUERY_BUDGET=20, CATALOG_PERF_LATENCY_BUDGET_MS=10000, CATALOG_PERF_SERVER_TIMING=True,
+)
+class PerformanceMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_language = Language.objects.create(name='English')
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=test_author, language=test_language)
+
+    def setUp(self):
+        get_versions(apps.get_app_config('catalog').get_models())
+
+    def server_timing(self, response):
+        return dict(
+            (entry.split(';')[0], entry.split(';')[1:])
+            for entry in response['Server-Timing'].split(', ')
+        )
+
+    def test_server_timing_header(self):
+        with self.assertLogs('catalog.performance', 'INFO'):
+            response = self.client.get(reverse('book-detail', args=[self.test_book.pk]))
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'app', 'db', 'tpl', 'session'})
+        self.assertIn(f'desc="{BOOK_DETAIL_QUERIES} queries"', timing['db'])
+        self.assertTrue(timing['tpl'][0].startswith('dur='))
+
+    def test_log_line_names_the_url(self):
+        with self.assertLogs('catalog.performance', 'INFO') as logs:
+            self.client.get(reverse('book-detail', args=[self.test_book.pk]))
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertIn('url=book-detail', logs.output[0])
+        self.assertIn(f'queries={BOOK_DETAIL_QUERIES}', logs.output[0])
+
+    @override_settings(CATALOG_PERF_QUERY_BUDGET=1)
+    def test_query_budget(self):
+        with self.assertLogs('catalog.performance', 'WARNING') as logs:
+            self.client.get(reverse('book-detail', args=[self.test_book.pk]))
+        self.assertIn('over budget: url=book-detail', logs.output[0])
+
+    @override_settings(CATALOG_PERF_LATENCY_BUDGET_MS=0, CATALOG_PERF_SAMPLE_RATE=0)
+    def test_latency_budget_of_unsampled_requests(self):
+        with self.assertLogs('catalog.performance', 'WARNING') as logs:
+            response = self.client.get(reverse('books'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertIn('over budget: url=books', logs.output[0])
+
+    @override_settings(CATALOG_PERF_SAMPLE_RATE=0)
+    def test_unsampled_request(self):
+        response = self.client.get(reverse('books'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_session_time(self):
+        # The session of a logged in user is loaded
+        self.client.force_login(User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK'))
+        with self.assertLogs('catalog.performance', 'INFO') as logs:
+            response = self.client.get(reverse('index'))
+        self.assertNotIn('session_ms=0.0 ', logs.output[0])
+
+    def test_nested_profile(self):
+        # The template time of a sampled request is also measured by an enclosing profile (of a benchmark)
+        with profiling.profile() as measures, self.assertLogs('catalog.performance', 'INFO'):
+            self.client.get(reverse('book-detail', args=[self.test_book.pk]))
+        self.assertGreater(measures.template_time, 0)
+        self.assertEqual(measures.queries, BOOK_DETAIL_QUERIES)
+
+    @override_settings(CATALOG_PERF_SERVER_TIMING=False)
+    def test_no_server_timing_header(self):
+        with self.assertLogs('catalog.performance', 'INFO'):
+            response = self.client.get(reverse('books'))
+        self.assertFalse(response.has_header('Server-Timing'))
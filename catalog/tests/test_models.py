@@ -210,6 +210,12 @@ class BookInstanceTest(TestCase):
     def test_is_overdue_property(self):
         self.assertTrue(self.book_instance1.is_overdue)
 
+    def test_with_overdue(self):
+        # The annotation agrees with the property
+        for copy in BookInstance.objects.with_overdue():
+            self.assertEqual(copy.overdue, copy.is_overdue)
+        self.assertEqual(BookInstance.objects.with_overdue().filter(overdue=True).count(), 2)
+
 class AuthorModelTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -255,3 +261,108 @@ class AuthorModelTest(TestCase):
         author = Author.objects.get(id=1)
         # This will also fail if the urlconf is not defined.
         self.assertEqual(author.get_absolute_url(), '/catalog/author/1')
+
+class BookCopyCountersTest(TestCase):
+    def setUp(self):
+        test_language = Language.objects.create(name='French')
+        test_author = Author.objects.create(first_name='Antoine', last_name='de Saint Exupéry')
+        self.book1 = Book.objects.create(title='Le petit prince', author=test_author, summary='a beautiful book', isbn='123-567890123', language=test_language)
+        self.book2 = Book.objects.create(title='Vol de nuit', author=test_author, summary='another book', isbn='123-567890124', language=test_language)
+
+    def create_copy(self, book, status):
+        return BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status=status)
+
+    def assertCounters(self, book, total, available=0, reserved=0, loan=0, maintenance=0):
+        book.refresh_from_db()
+        self.assertEqual(book.num_instances, total)
+        self.assertEqual(book.num_instances_available, available)
+        self.assertEqual(book.num_instances_reserved, reserved)
+        self.assertEqual(book.num_instances_loan, loan)
+        self.assertEqual(book.num_instances_maintenance, maintenance)
+
+    def test_counters_are_not_editable(self):
+        self.assertFalse(Book._meta.get_field('num_instances').editable)
+        self.assertFalse(Book._meta.get_field('num_instances_available').editable)
+
+    def test_edit_book_after_adding_copies(self):
+        self.create_copy(self.book1, 'a')
+        # The instance still has the counters it was created with
+        self.book1.title = 'The Little Prince'
+        self.book1.save()
+        self.assertCounters(self.book1, 1, available=1)
+        self.assertEqual(self.book1.title, 'The Little Prince')
+
+    def test_new_book_has_no_copies(self):
+        self.assertCounters(self.book1, 0)
+
+    def test_create_copies(self):
+        self.create_copy(self.book1, 'a')
+        self.create_copy(self.book1, 'a')
+        self.create_copy(self.book1, 'o')
+        self.create_copy(self.book1, 'm')
+        self.assertCounters(self.book1, 4, available=2, loan=1, maintenance=1)
+        self.assertCounters(self.book2, 0)
+
+    def test_status_change(self):
+        copy = self.create_copy(self.book1, 'a')
+        copy.status = 'r'
+        copy.save()
+        self.assertCounters(self.book1, 1, reserved=1)
+
+    def test_move_copy_to_another_book(self):
+        self.create_copy(self.book1, 'a')
+        copy = BookInstance.objects.get(book=self.book1)
+        copy.book = self.book2
+        copy.save()
+        self.assertCounters(self.book1, 0)
+        self.assertCounters(self.book2, 1, available=1)
+
+    def test_delete_copy(self):
+        copy = self.create_copy(self.book1, 'o')
+        self.create_copy(self.book1, 'a')
+        copy.delete()
+        self.assertCounters(self.book1, 1, available=1)
+
+    def test_bulk_create(self):
+        BookInstance.objects.bulk_create([
+            BookInstance(book=self.book1, imprint='Imprint', status='a'),
+            BookInstance(book=self.book2, imprint='Imprint', status='m'),
+            BookInstance(book=self.book2, imprint='Imprint', status='o'),
+        ])
+        self.assertCounters(self.book1, 1, available=1)
+        self.assertCounters(self.book2, 2, loan=1, maintenance=1)
+
+    def test_queryset_update(self):
+        self.create_copy(self.book1, 'a')
+        self.create_copy(self.book1, 'a')
+        self.create_copy(self.book2, 'a')
+        BookInstance.objects.filter(book=self.book1).update(status='o')
+        self.assertCounters(self.book1, 2, loan=2)
+        self.assertCounters(self.book2, 1, available=1)
+
+    def test_queryset_update_book(self):
+        self.create_copy(self.book1, 'a')
+        self.create_copy(self.book1, 'm')
+        BookInstance.objects.filter(status='m').update(book=self.book2)
+        self.assertCounters(self.book1, 1, available=1)
+        self.assertCounters(self.book2, 1, maintenance=1)
+
+    def test_bulk_update(self):
+        copies = [self.create_copy(self.book1, 'a'), self.create_copy(self.book1, 'a')]
+        for copy in copies:
+            copy.status = 'r'
+        BookInstance.objects.bulk_update(copies, ['status'])
+        self.assertCounters(self.book1, 2, reserved=2)
+
+    def test_queryset_delete(self):
+        self.create_copy(self.book1, 'a')
+        self.create_copy(self.book1, 'm')
+        BookInstance.objects.filter(status='m').delete()
+        self.assertCounters(self.book1, 1, available=1)
+
+    def test_refresh_copy_counts(self):
+        self.create_copy(self.book1, 'a')
+        Book.objects.update(num_instances=42, num_instances_available=0)
+        Book.objects.all().refresh_copy_counts()
+        self.assertCounters(self.book1, 1, available=1)
+        self.assertCounters(self.book2, 0)
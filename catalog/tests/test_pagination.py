@@ -0,0 +1,87 @@
+from django.test import TestCase
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from urllib.parse import urlencode
+import datetime
+from catalog.models import Book, BookInstance
+from catalog.pagination import CursorPaginator, InvalidCursor
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        # 12 copies: 3 without due date, the others sharing 3 due dates
+        for book_copy in range(12):
+            due_back = None if book_copy < 3 else datetime.date.today() + datetime.timedelta(days=book_copy % 3)
+            BookInstance.objects.create(book=test_book, imprint=f'Imprint #{book_copy}', due_back=due_back, status='o')
+        cls.expected = list(BookInstance.objects.all())
+        cls.expected.sort(key=lambda copy: (copy.due_back is None, copy.due_back or datetime.date.min, copy.pk))
+
+    def paginator(self, per_page=5):
+        return CursorPaginator(BookInstance.objects.all(), per_page, 'due_back')
+
+    def test_first_page(self):
+        page = self.paginator().page()
+        self.assertEqual(page.object_list, self.expected[:5])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_browse_forward_then_backward(self):
+        paginator = self.paginator()
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual([copy for page in pages for copy in page], self.expected)
+        self.assertFalse(pages[-1].has_next())
+
+        # Follow the previous cursors back to the first page
+        page = pages[-1]
+        for expected_page in reversed(pages[:-1]):
+            page = paginator.page(page.previous_cursor)
+            self.assertEqual(page.object_list, expected_page.object_list)
+        self.assertFalse(page.has_previous())
+
+    def test_null_keys_come_last(self):
+        paginator = self.paginator(per_page=3)
+        page = paginator.page()
+        for page_number in range(3):
+            page = paginator.page(page.next_cursor)
+        self.assertEqual([copy.due_back for copy in page], [None] * 3)
+        self.assertFalse(page.has_next())
+
+    def test_not_nullable_key(self):
+        paginator = CursorPaginator(BookInstance.objects.filter(due_back__isnull=False), 4, 'due_back', nullable=False)
+        with CaptureQueriesContext(connection) as queries:
+            pages = [paginator.page()]
+        # Ordered on the plain key (with the IS NULL only of the filter)
+        self.assertEqual(queries[0]['sql'].count('IS NULL') + queries[0]['sql'].count('IS NOT NULL'), 1)
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([copy for page in pages for copy in page], self.expected[:9])
+        self.assertEqual(paginator.page(pages[-1].previous_cursor).object_list, pages[-2].object_list)
+
+    def test_single_page(self):
+        page = self.paginator(per_page=20).page()
+        self.assertEqual(len(page), 12)
+        self.assertFalse(page.has_other_pages())
+
+    def test_no_count_query(self):
+        page = self.paginator().page()
+        with self.assertNumQueries(1):
+            self.paginator().page(page.next_cursor)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            self.paginator().page('not a cursor')
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(reverse('bookinstances'), {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_view_pagination_links(self):
+        response = self.client.get(reverse('bookinstances'))
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, '?' + urlencode({'cursor': next_cursor}))
@@ -0,0 +1,107 @@
+from django.test import TestCase
+
+from django.apps import apps
+from django.urls import reverse
+import datetime
+from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission
+from catalog.caching import get_versions
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.tests.cache_queries import GET, SET
+
+def create_catalog(number_of_books, copies_per_book, borrower):
+    """Create books by 2 authors, with 3 genres each and copies (some on loan to borrower)."""
+    genres = [Genre.objects.create(name=f'Genre {genre_id}') for genre_id in range(3)]
+    languages = [Language.objects.create(name=name) for name in ['English', 'French']]
+    authors = [
+        Author.objects.create(first_name='John', last_name='Smith'),
+        Author.objects.create(first_name='Paul', last_name='Mc Cartney'),
+    ]
+    for book_id in range(number_of_books):
+        book = Book.objects.create(
+            title=f'Book Title {book_id}',
+            summary=f'My book summary {book_id}',
+            isbn='ABCDEFG',
+            author=authors[book_id % 2],
+            language=languages[book_id % 2],
+        )
+        book.genre.set(genres)
+        BookInstance.objects.bulk_create([
+            BookInstance(
+                book=book,
+                imprint=f'Unlikely Imprint, 2016 #{copy_id}',
+                language=languages[copy_id % 2],
+                due_back=datetime.date.today() + datetime.timedelta(days=copy_id),
+                status='o' if copy_id % 2 else 'a',
+                borrower=borrower if copy_id % 2 else None,
+            )
+            for copy_id in range(copies_per_book)
+        ])
+
+class ViewQueryCountTest(TestCase):
+    """Pin the number of queries run by each catalog view: it must not depend on the page size."""
+
+    # Queries run for a logged in librarian before the view itself:
+    # session, user, user permissions and group permissions.
+    AUTH_QUERIES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        create_catalog(number_of_books=12, copies_per_book=4, borrower=cls.librarian)
+
+    def setUp(self):
+        # The versions of the models in cache, as on a running site
+        get_versions(apps.get_app_config('catalog').get_models())
+
+    def assertViewQueries(self, num, url):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_book_list(self):
+        # change marker (2), versions, page, count, books with their author: copies are loaded when
+        # expanded, and the facet counts (7, with their versions, cached for the next pages), page stored
+        self.assertViewQueries(11 + 4 * GET + 2 * SET, reverse('books'))
+        self.assertViewQueries(4 + 4 * GET + SET, reverse('books')+'?page=2')
+        # change marker (2), versions, page
+        self.assertViewQueries(2 + 2 * GET, reverse('books'))
+
+    def test_book_copies(self):
+        # change marker, book, copies with their language (a fragment of the local cache)
+        self.assertViewQueries(3, reverse('book-copies', args=[Book.objects.first().pk]))
+        self.assertViewQueries(2, reverse('book-copies', args=[Book.objects.first().pk]))
+
+    def test_book_detail(self):
+        # change marker, versions, page, book with author and language, views, genres, copies, page stored
+        self.assertViewQueries(5 + 2 * GET + SET, reverse('book-detail', args=[Book.objects.first().pk]))
+        # change marker, versions, page
+        self.assertViewQueries(1 + 2 * GET, reverse('book-detail', args=[Book.objects.first().pk]))
+
+    def test_bookinstance_list(self):
+        # copies with their book, author and language, genres (no count with cursor pagination)
+        self.assertViewQueries(2, reverse('bookinstances'))
+
+    def test_bookinstance_detail(self):
+        # change marker, copy with its book, author and language, genres
+        self.assertViewQueries(3, reverse('bookinstance-detail', args=[BookInstance.objects.first().pk]))
+
+    def test_author_list(self):
+        # change markers of authors and books (4), versions, page, count, authors with their number of books,
+        # page stored
+        self.assertViewQueries(6 + 2 * GET + SET, reverse('authors'))
+
+    def test_author_detail(self):
+        # change marker, versions, page, author, views, books, page stored
+        self.assertViewQueries(4 + 2 * GET + SET, reverse('author-detail', args=[Author.objects.first().pk]))
+
+    def test_my_borrowed(self):
+        self.client.force_login(self.librarian)
+        # copies with their book, holds with their book
+        self.assertViewQueries(self.AUTH_QUERIES + 2, reverse('my-borrowed'))
+
+    def test_all_borrowed(self):
+        self.client.force_login(self.librarian)
+        # copies with their book and borrower
+        self.assertViewQueries(self.AUTH_QUERIES + 1, reverse('all-borrowed'))
@@ -0,0 +1,168 @@
+from django.test import TestCase
+
+from unittest import mock
+from django.db import connection
+from django.urls import reverse
+from catalog.models import Author, Book, Genre, Language
+from catalog.search import FTS_TABLE, count_matches, install_search_index, rank_matches, search_books
+
+class SearchBooksTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poems = Genre.objects.create(name='Poems')
+        language = Language.objects.create(name='English')
+        cls.tolkien = Author.objects.create(first_name='John', last_name='Tolkien')
+        cls.hobbit = Book.objects.create(
+            title='The Hobbit',
+            author=cls.tolkien,
+            summary='A hobbit goes on an unexpected journey with dwarves.',
+            isbn='9780261102217',
+            language=language,
+        )
+        cls.hobbit.genre.add(cls.fantasy)
+        cls.lays = Book.objects.create(
+            title='The Lay of Aotrou and Itroun',
+            author=cls.tolkien,
+            summary='A Breton lay about a lord and a corrigan, in verse.',
+            isbn='9780008202132',
+            language=language,
+        )
+        cls.lays.genre.add(cls.poems)
+        cls.other = Book.objects.create(
+            title='Journey of hobbit fans',
+            author=None,
+            summary='Essays.',
+            isbn='1234567890123',
+            language=language,
+        )
+
+    def search(self, query):
+        return [book.pk for book in search_books(query)]
+
+    def test_search_document_built_on_save(self):
+        hobbit = Book.objects.get(pk=self.hobbit.pk)
+        for text in ('The Hobbit', '9780261102217', 'unexpected journey', 'John', 'Tolkien', 'Fantasy'):
+            self.assertIn(text, hobbit.search_document)
+
+    def test_search_fields(self):
+        self.assertEqual(self.search('hobbit dwarves'), [self.hobbit.pk])
+        self.assertEqual(self.search('9780008202132'), [self.lays.pk])
+        self.assertCountEqual(self.search('Tolkien'), [self.hobbit.pk, self.lays.pk])
+        self.assertEqual(self.search('poems'), [self.lays.pk])
+
+    def test_search_prefix_and_all_words(self):
+        self.assertCountEqual(self.search('tolk'), [self.hobbit.pk, self.lays.pk])
+        self.assertEqual(self.search('tolkien verse'), [self.lays.pk])
+        self.assertEqual(self.search('tolkien unknownword'), [])
+
+    def test_search_ranked(self):
+        # Documents of the same length: the more occurrences, the better
+        tales = Book.objects.create(title='Dragon tales', summary='Sea', isbn='1')
+        dragons = Book.objects.create(title='Dragon dragon', summary='Dragon', isbn='2')
+        self.assertEqual(self.search('dragon'), [dragons.pk, tales.pk])
+        # Ranked before being limited and paged
+        self.assertEqual([pk for pk, rank in rank_matches('dragon', limit=1)], [dragons.pk])
+        self.assertEqual([pk for pk, rank in rank_matches('dragon', limit=1, offset=1)], [tales.pk])
+        self.assertEqual([book.pk for book in search_books('dragon')[1:2]], [tales.pk])
+
+    def test_search_empty_or_syntax(self):
+        self.assertEqual(self.search(''), [])
+        self.assertEqual(self.search('  ?! '), [])
+        # Characters of the search syntaxes are not interpreted
+        self.assertEqual(self.search('"hobbit" AND (dwarves* OR -x'), [])
+        self.assertEqual(self.search('hobbit" dwarves'), [self.hobbit.pk])
+
+    def test_book_update(self):
+        hobbit = Book.objects.get(pk=self.hobbit.pk)
+        hobbit.title = 'There and back again'
+        hobbit.save()
+        self.assertEqual(self.search('back again'), [self.hobbit.pk])
+        hobbit.delete()
+        self.assertEqual(self.search('back again'), [])
+
+    def test_genre_changes(self):
+        hobbit = Book.objects.get(pk=self.hobbit.pk)
+        hobbit.genre.add(self.poems)
+        self.assertCountEqual(self.search('poems'), [self.hobbit.pk, self.lays.pk])
+        hobbit.genre.remove(self.poems)
+        self.assertEqual(self.search('poems'), [self.lays.pk])
+        self.poems.book_set.add(self.other)
+        self.assertCountEqual(self.search('poems'), [self.lays.pk, self.other.pk])
+        self.poems.book_set.clear()
+        self.assertEqual(self.search('poems'), [])
+
+    def test_genre_and_author_renamed_or_deleted(self):
+        fantasy = Genre.objects.get(pk=self.fantasy.pk)
+        fantasy.name = 'Adventure'
+        fantasy.save()
+        self.assertEqual(self.search('adventure'), [self.hobbit.pk])
+        fantasy.delete()
+        self.assertEqual(self.search('adventure'), [])
+        tolkien = Author.objects.get(pk=self.tolkien.pk)
+        tolkien.last_name = 'Tolkienne'
+        tolkien.save()
+        self.assertCountEqual(self.search('tolkienne'), [self.hobbit.pk, self.lays.pk])
+        tolkien.delete()
+        self.assertEqual(self.search('tolkienne'), [])
+
+    def test_search_limited_and_filtered(self):
+        self.assertEqual(len(rank_matches('hobbit')), 2)
+        self.assertEqual(len(rank_matches('hobbit', limit=1)), 1)
+        with mock.patch('catalog.search.SEARCH_MAX_RESULTS', 1):
+            self.assertEqual(count_matches('hobbit'), 1)
+            self.assertEqual(len(search_books('hobbit')), 1)
+        results = search_books('tolkien', Book.objects.filter(genre=self.poems))
+        self.assertEqual(len(results), 1)
+        self.assertEqual([book.pk for book in results[0:10]], [self.lays.pk])
+        self.assertIsNotNone(results[0].rank)
+
+    def test_refresh_search_documents(self):
+        Book.objects.update(search_document='')
+        self.assertEqual(self.search('hobbit'), [])
+        Book.objects.all().refresh_search_documents(batch_size=2)
+        self.assertCountEqual(self.search('hobbit'), [self.hobbit.pk, self.other.pk])
+
+    def test_install_search_index_restores_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite FTS5 index')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {FTS_TABLE}_update')
+        install_search_index(connection)
+        hobbit = Book.objects.get(pk=self.hobbit.pk)
+        hobbit.title = 'There and back again'
+        hobbit.save()
+        self.assertEqual(self.search('back again'), [self.hobbit.pk])
+
+class BookSearchViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='John', last_name='Tolkien')
+        for book_id in range(13):
+            Book.objects.create(title=f'Hobbit {book_id}', author=author, summary='Summary', isbn='ABCDEFG')
+
+    def test_view_url_exists_at_desired_location(self):
+        response = self.client.get('/catalog/books/search/?q=hobbit')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_search.html')
+
+    def test_results_paginated(self):
+        response = self.client.get(reverse('book-search'), {'q': 'hobbit'})
+        self.assertEqual(response.context['query'], 'hobbit')
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual(len(response.context['book_list']), 10)
+        self.assertEqual(response.context['paginator'].count, 13)
+        # Pagination links keep the query
+        self.assertContains(response, '?q=hobbit&amp;page=2')
+        response = self.client.get(reverse('book-search'), {'q': 'hobbit', 'page': 2})
+        self.assertEqual(len(response.context['book_list']), 3)
+
+    def test_num_queries(self):
+        # Count of the matches, ranked matches of the page, then the books of the page
+        with self.assertNumQueries(3):
+            self.client.get(reverse('book-search'), {'q': 'hobbit'})
+
+    def test_no_query(self):
+        response = self.client.get(reverse('book-search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['book_list']), 0)
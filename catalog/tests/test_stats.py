@@ -0,0 +1,83 @@
+from django.test import TestCase
+
+import datetime
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.stats import compute_stats, get_stats, invalidate_stats
+from catalog.tests.cache_queries import GET, SET
+
+class CatalogStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Genre.objects.create(name='Fantasy')
+        Genre.objects.create(name='Poems')
+        test_language = Language.objects.create(name='French')
+        test_author = Author.objects.create(first_name='Antoine', last_name='de Saint Exupéry')
+        cls.test_book = Book.objects.create(
+            title='Le petit prince',
+            author=test_author,
+            summary='a beautiful book',
+            isbn='123-567890123',
+            language=test_language,
+        )
+        # Create 10 book instances (copies) with rotating status
+        for book_copy in range(10):
+            BookInstance.objects.create(
+                book=cls.test_book,
+                imprint=f'Unlikely Imprint, 2016 #{book_copy}',
+                due_back=datetime.date.today() + datetime.timedelta(days=book_copy),
+                status=['m', 'o', 'a', 'r'][book_copy % 4],
+            )
+
+    def test_compute_stats_counts(self):
+        stats = compute_stats()
+        self.assertEqual(stats['num_books'], 1)
+        self.assertEqual(stats['num_instances'], 10)
+        self.assertEqual(stats['num_instances_maintenance'], 3)
+        self.assertEqual(stats['num_instances_loan'], 3)
+        self.assertEqual(stats['num_instances_available'], 2)
+        self.assertEqual(stats['num_instances_reserved'], 2)
+        self.assertEqual(stats['num_authors'], 1)
+        self.assertEqual(stats['num_genres'], 2)
+        self.assertEqual(stats['num_languages'], 1)
+
+    def test_compute_stats_single_query(self):
+        with self.assertNumQueries(1):
+            compute_stats()
+
+    def test_compute_stats_without_copies(self):
+        BookInstance.objects.all().delete()
+        stats = compute_stats()
+        self.assertEqual(stats['num_instances'], 0)
+        self.assertEqual(stats['num_instances_available'], 0)
+        self.assertEqual(stats['num_books'], 1)
+
+    def test_get_stats_is_cached(self):
+        with self.assertNumQueries(1 + GET + SET):
+            get_stats()
+        with self.assertNumQueries(GET):
+            self.assertEqual(get_stats()['num_instances'], 10)
+
+    def test_invalidate_stats(self):
+        get_stats()
+        invalidate_stats()
+        with self.assertNumQueries(1 + GET + SET):
+            get_stats()
+
+    def test_save_invalidates_stats(self):
+        self.assertEqual(get_stats()['num_genres'], 2)
+        Genre.objects.create(name='Poetry')
+        self.assertEqual(get_stats()['num_genres'], 3)
+
+    def test_status_change_invalidates_stats(self):
+        self.assertEqual(get_stats()['num_instances_available'], 2)
+        copy = BookInstance.objects.filter(status='m').first()
+        copy.status = 'a'
+        copy.save()
+        self.assertEqual(get_stats()['num_instances_available'], 3)
+        self.assertEqual(get_stats()['num_instances_maintenance'], 2)
+
+    def test_delete_invalidates_stats(self):
+        self.assertEqual(get_stats()['num_instances'], 10)
+        BookInstance.objects.filter(status='a').first().delete()
+        self.assertEqual(get_stats()['num_instances'], 9)
+        self.assertEqual(get_stats()['num_instances_available'], 1)
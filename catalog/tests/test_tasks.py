@@ -0,0 +1,178 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+
+import datetime, time
+from io import StringIO
+from unittest import mock, skipIf
+from django.db import connection
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management import call_command
+from django.utils import timezone
+from catalog import tasks
+from catalog.models import Task
+
+calls = []
+
+@tasks.task
+def record_call(*args, **kwargs):
+    calls.append((args, kwargs))
+
+@tasks.task(max_attempts=2)
+def fail():
+    raise ValueError('Failed')
+
+@tasks.task
+def record_lock_refresh():
+    """Record whether the lock of this task is refreshed while it runs."""
+    running = Task.objects.filter(name='catalog.tests.test_tasks.record_lock_refresh')
+    locked_at = running.get().locked_at
+    time.sleep(0.2)
+    calls.append(running.get().locked_at > locked_at)
+
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        task = record_call.delay(1, 'two', three=3)
+        self.assertEqual((task.name, task.status), ('catalog.tests.test_tasks.record_call', Task.QUEUED))
+        [(task_id, token)] = tasks.claim('worker', 10)
+        self.assertEqual(tasks.claim('worker', 10), [])
+        self.assertEqual(tasks.run_task(task_id, token), Task.DONE)
+        self.assertEqual(calls, [((1, 'two'), {'three': 3})])
+        task = Task.objects.get(pk=task_id)
+        self.assertEqual((task.status, task.attempts, task.locked_by), (Task.DONE, 1, ''))
+
+    def test_unknown_task(self):
+        with self.assertRaises(LookupError):
+            tasks.enqueue('catalog.tests.test_tasks.calls')
+        with self.assertRaises(LookupError):
+            tasks.enqueue('catalog.nothing.here')
+
+    def test_claim_order_and_limit(self):
+        now = timezone.now()
+        later = tasks.enqueue(record_call.task_name, run_at=now + datetime.timedelta(hours=1))
+        second = tasks.enqueue(record_call.task_name, run_at=now - datetime.timedelta(minutes=1))
+        first = tasks.enqueue(record_call.task_name, run_at=now - datetime.timedelta(minutes=2))
+        self.assertEqual([task_id for task_id, token in tasks.claim('worker', 1)], [first.pk])
+        self.assertEqual([task_id for task_id, token in tasks.claim('worker', 5)], [second.pk])
+        self.assertEqual(Task.objects.get(pk=later.pk).status, Task.QUEUED)
+
+    def test_retries_with_backoff(self):
+        task = fail.delay()
+        [(task_id, token)] = tasks.claim('worker', 1)
+        with self.assertLogs('catalog.tasks', 'WARNING'):
+            self.assertEqual(tasks.run_task(task_id, token), Task.QUEUED)
+        task = Task.objects.get(pk=task.pk)
+        self.assertIn('ValueError: Failed', task.last_error)
+        self.assertGreater(task.run_at, timezone.now() + tasks.retry_delay(1) - datetime.timedelta(seconds=5))
+        # Not due before the backoff
+        self.assertEqual(tasks.claim('worker', 1), [])
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        [(task_id, token)] = tasks.claim('worker', 1)
+        with self.assertLogs('catalog.tasks', 'ERROR'):
+            self.assertEqual(tasks.run_task(task_id, token), Task.FAILED)
+        self.assertEqual(Task.objects.get(pk=task.pk).attempts, 2)
+
+    def test_retry_delay(self):
+        self.assertEqual(tasks.retry_delay(1), datetime.timedelta(seconds=tasks.RETRY_DELAY))
+        self.assertEqual(tasks.retry_delay(3), datetime.timedelta(seconds=tasks.RETRY_DELAY * 4))
+        self.assertEqual(tasks.retry_delay(30), datetime.timedelta(seconds=tasks.RETRY_MAX_DELAY))
+
+    def test_lost_task_claimed_again(self):
+        record_call.delay()
+        [(task_id, token)] = tasks.claim('crashed', 1)
+        self.assertEqual(tasks.claim('worker', 1), [])
+        Task.objects.filter(pk=task_id).update(locked_at=timezone.now() - datetime.timedelta(seconds=tasks.LOCK_TIMEOUT + 1))
+        [(task_id, new_token)] = tasks.claim('worker', 1)
+        self.assertEqual(tasks.run_task(task_id, new_token), Task.DONE)
+        # The crashed worker doesn't overwrite the result
+        self.assertEqual(Task.objects.get(pk=task_id).attempts, 2)
+        Task.objects.filter(pk=task_id).update(status=Task.DONE)
+        tasks.run_task(task_id, token)
+        self.assertEqual(Task.objects.get(pk=task_id).status, Task.DONE)
+
+    def test_heartbeat(self):
+        record_call.delay()
+        claims = tasks.claim('worker', 1)
+        lost = timezone.now() - datetime.timedelta(seconds=tasks.LOCK_TIMEOUT + 1)
+        Task.objects.update(locked_at=lost)
+        tasks.heartbeat(claims)
+        self.assertEqual(tasks.claim('other', 1), [])
+        # Not the lock of another claim
+        Task.objects.update(locked_at=lost, locked_by='other:token')
+        tasks.heartbeat(claims)
+        self.assertEqual(Task.objects.get().locked_at, lost)
+
+    @override_settings(CATALOG_TASKS_SCHEDULE={'catalog.tests.test_tasks.record_call': 3600})
+    def test_schedule_once_per_period(self):
+        now = timezone.now()
+        tasks.schedule(now, {})
+        # Another worker
+        tasks.schedule(now, {})
+        self.assertEqual(Task.objects.count(), 1)
+        tasks.schedule(now + datetime.timedelta(hours=1), {})
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_purge_tasks(self):
+        done = record_call.delay()
+        Task.objects.filter(pk=done.pk).update(status=Task.DONE, finished_at=timezone.now() - datetime.timedelta(days=30))
+        queued = record_call.delay()
+        tasks.purge_tasks()
+        self.assertEqual(list(Task.objects.values_list('pk', flat=True)), [queued.pk])
+
+    @override_settings(CATALOG_TASKS_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_queued_email(self):
+        message = EmailMultiAlternatives('Subject', 'Body', 'from@example.com', ['to@example.com'], headers={'X-Test': '1'})
+        message.attach_alternative('<p>Body</p>', 'text/html')
+        message.attach('notes.txt', 'Notes', 'text/plain')
+        self.assertEqual(get_connection('catalog.mail.QueuedEmailBackend').send_messages([message]), 1)
+        self.assertEqual(mail.outbox, [])
+        [(task_id, token)] = tasks.claim('worker', 1)
+        self.assertEqual(tasks.run_task(task_id, token), Task.DONE)
+        [sent] = mail.outbox
+        self.assertEqual((sent.subject, sent.to, sent.extra_headers), ('Subject', ['to@example.com'], {'X-Test': '1'}))
+        self.assertEqual(sent.alternatives, [('<p>Body</p>', 'text/html')])
+        self.assertEqual(sent.attachments, [('notes.txt', 'Notes', 'text/plain')])
+
+    def test_password_reset_queued(self):
+        from django.contrib.auth.models import User
+        User.objects.create_user(username='patron', email='patron@example.com', password='2HJ1vRV0Z&3iD')
+        with self.settings(EMAIL_BACKEND='catalog.mail.QueuedEmailBackend'):
+            response = self.client.post('/accounts/password_reset/', {'email': 'patron@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Task.objects.get().name, 'catalog.tasks.send_emails')
+
+class RunWorkerCommandTest(TransactionTestCase):
+    """The worker runs the tasks in threads, with their own database connections."""
+    def setUp(self):
+        calls.clear()
+
+    def run_worker(self, concurrency):
+        for number in range(10):
+            record_call.delay(number)
+        fail.delay()
+        out = StringIO()
+        with self.assertLogs('catalog.tasks', 'WARNING'):
+            call_command('run_worker', burst=True, concurrency=concurrency, no_schedule=True, poll_interval=0.01, stdout=out)
+        return out
+
+    def test_burst(self):
+        out = self.run_worker(1)
+        self.assertEqual(sorted(args for args, kwargs in calls), [(number,) for number in range(10)])
+        self.assertIn('Ran 11 tasks', out.getvalue())
+        self.assertIn('10 done, 1 queued', out.getvalue())
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 10)
+
+    @mock.patch('catalog.tasks.HEARTBEAT', 0.05)
+    def test_heartbeat_while_running(self):
+        record_lock_refresh.delay()
+        call_command('run_worker', burst=True, concurrency=1, no_schedule=True, stdout=StringIO())
+        self.assertEqual(calls, [True])
+
+    @skipIf(connection.vendor == 'sqlite', 'The in-memory SQLite test database fails concurrent writes at once')
+    def test_concurrency(self):
+        out = self.run_worker(3)
+        self.assertEqual(len(calls), 10)
+        self.assertIn('10 done, 1 queued', out.getvalue())
@@ -3,7 +3,7 @@ from django.test import TestCase
 # Create your tests here.
 
 from django.urls import reverse
-import datetime, uuid
+import datetime, json, uuid
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User # Required to assign User as a borrower
@@ -74,7 +74,24 @@ class indexTest(TestCase):
         self.assertEqual(response.context['num_authors'], 2)
         self.assertEqual(response.context['num_genres'], 4)
         self.assertEqual(response.context['num_languages'], 3)
-        self.assertEqual(response.context['num_visits'], 1)
+
+    def test_anonymous_visits_session_free(self):
+        response = self.client.get(reverse('index'))
+        # Counted by the browser: no session cookie, and the page can be kept by a proxy
+        self.assertIsNone(response.context['num_visits'])
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertContains(response, "localStorage.getItem('numVisits')")
+
+    def test_user_visits_counted(self):
+        user = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 1)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 2)
+        self.assertContains(response, 'You have visited this page 2 times.')
+        self.assertIn('private', response['Cache-Control'])
 
 class BookListViewTest(TestCase):
     @classmethod
@@ -132,6 +149,58 @@ class BookListViewTest(TestCase):
         self.assertEqual(response.context['is_paginated'], True)
         self.assertEqual(len(response.context['book_list']), 2)
 
+    def test_copies_loaded_lazily(self):
+        book = Book.objects.first()
+        BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+        response = self.client.get(reverse('books'))
+        self.assertContains(response, f'data-copies-url="{reverse("book-copies", args=[book.pk])}"')
+        self.assertNotContains(response, 'Unlikely Imprint, 2016')
+
+    def test_available_filter(self):
+        books = Book.objects.order_by('title')
+        for book in books[:3]:
+            BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+        BookInstance.objects.create(book=books[3], imprint='Unlikely Imprint, 2016', status='o')
+        response = self.client.get(reverse('books') + '?available=1')
+        self.assertEqual(list(response.context['book_list']), list(books[:3]))
+        self.assertContains(response, '(1 available)', count=3)
+        self.assertContains(response, 'All books</a>')
+        self.assertEqual(len(self.client.get(reverse('books') + '?available=0').context['book_list']), 10)
+
+    def test_available_filter_pagination(self):
+        for book in Book.objects.all():
+            BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+        response = self.client.get(reverse('books') + '?available=1')
+        self.assertContains(response, 'href="/catalog/books/?available=1&amp;page=2"')
+        self.assertEqual(len(self.client.get(reverse('books') + '?available=1&page=2').context['book_list']), 2)
+
+class BookCopiesViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='English')
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        BookInstance.objects.create(book=cls.book, imprint='Unlikely Imprint, 2016', status='a', language=language)
+
+    def test_fragment(self):
+        response = self.client.get(reverse('book-copies', args=[self.book.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_copies.html')
+        self.assertTemplateNotUsed(response, 'base_generic.html')
+        self.assertContains(response, 'Unlikely Imprint, 2016')
+        self.assertContains(response, 'English')
+
+    def test_fragment_cached_until_copies_change(self):
+        url = reverse('book-copies', args=[self.book.pk])
+        self.client.get(url)
+        # change marker, book: the copies come from the fragment cache
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        BookInstance.objects.create(book=self.book, imprint='Folio, 1990', status='m')
+        self.assertContains(self.client.get(url), 'Folio, 1990')
+
+    def test_unknown_book(self):
+        self.assertEqual(self.client.get(reverse('book-copies', args=[999])).status_code, 404)
+
 class BookDetailViewTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -266,7 +335,8 @@ class BookInstanceListViewTest(TestCase):
 
     def test_lists_all_book_instances(self):
         # Get second page and confirm it has (exactly) 3 remaining items (8 b.i. - 5 of first page)
-        response = self.client.get(reverse('bookinstances')+'?page=2')
+        response = self.client.get(reverse('bookinstances'))
+        response = self.client.get(reverse('bookinstances'), {'cursor': response.context['page_obj'].next_cursor})
         self.assertEqual(response.status_code, 200)
         self.assertTrue('is_paginated' in response.context)
         self.assertEqual(response.context['is_paginated'], True)
@@ -443,6 +513,15 @@ class AuthorDetailViewTest(TestCase):
         self.assertEqual(response.context['author'].book_set.all()[0].title, 'Book Title')
         self.assertEqual(response.context['author'].book_set.all()[0].summary, 'My book summary')
 
+    def test_available_filter(self):
+        author = Author.objects.order_by('pk').first()
+        Book.objects.create(title='Unavailable Title', summary='My book summary', isbn='ABCDEFG', author=author)
+        url = reverse('author-detail', kwargs={'pk': author.pk})
+        self.assertEqual(self.client.get(url).context['author'].book_set.count(), 2)
+        response = self.client.get(url + '?available=1')
+        self.assertEqual([book.title for book in response.context['author'].book_set.all()], ['Book Title'])
+        self.assertContains(response, 'Books (1 available)')
+
 class LoanedBookInstancesByUserListViewTest(TestCase):
     def setUp(self):
         # Create two users
@@ -580,7 +659,8 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 
         login = self.client.login(username='testuser1', password='1X<ISRUkw+tuK')
         # Get second page and confirm it has (exactly) 5 remaining items (30 b.i. / 2 users - 10 of first page)
-        response = self.client.get(reverse('my-borrowed')+'?page=2')
+        response = self.client.get(reverse('my-borrowed'))
+        response = self.client.get(reverse('my-borrowed'), {'cursor': response.context['page_obj'].next_cursor})
         self.assertEqual(str(response.context['user']), 'testuser1')
         self.assertEqual(response.status_code, 200)
         self.assertTrue('is_paginated' in response.context)
@@ -724,13 +804,66 @@ class AllBorrowedListViewTest(TestCase):
 
         login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
         # Get second page and confirm it has (exactly) 6 remaining items (16 - 10 of first page)
-        response = self.client.get(reverse('all-borrowed')+'?page=2')
+        response = self.client.get(reverse('all-borrowed'))
+        response = self.client.get(reverse('all-borrowed'), {'cursor': response.context['page_obj'].next_cursor})
         self.assertEqual(str(response.context['user']), 'testuser2')
         self.assertEqual(response.status_code, 200)
         self.assertTrue('is_paginated' in response.context)
         self.assertEqual(response.context['is_paginated'], True)
         self.assertEqual(len(response.context['bookinstance_list']), 6)
 
+class OverdueListViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+        cls.patron = User.objects.create_user(username='patron', password='2HJ1vRV0Z&3iD')
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+        # Copies due 0 to 14 days ago, on loan to the librarian (even) or the patron (odd)
+        for days in range(15):
+            BookInstance.objects.create(
+                book=test_book,
+                imprint='Unlikely Imprint, 2016',
+                due_back=datetime.date.today() - datetime.timedelta(days=days),
+                borrower=cls.patron if days % 2 else cls.librarian,
+                status='o',
+            )
+        # Past due but not on loan
+        BookInstance.objects.create(
+            book=test_book, imprint='Unlikely Imprint, 2016', status='a',
+            due_back=datetime.date.today() - datetime.timedelta(days=3),
+        )
+
+    def test_permission_required(self):
+        self.assertEqual(self.client.get(reverse('overdue')).status_code, 302)
+        self.client.force_login(self.patron)
+        self.assertEqual(self.client.get(reverse('overdue')).status_code, 403)
+
+    def test_overdue_loans(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('overdue'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/bookinstance_list_overdue.html')
+        self.assertTrue(response.context['is_paginated'])
+        # Most overdue first
+        due_dates = [copy.due_back for copy in response.context['bookinstance_list']]
+        self.assertEqual(due_dates, sorted(due_dates))
+        self.assertEqual(due_dates[0], datetime.date.today() - datetime.timedelta(days=14))
+        response = self.client.get(reverse('overdue'), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual(len(response.context['bookinstance_list']), 4)
+        self.assertTrue(all(copy.due_back < datetime.date.today() for copy in response.context['bookinstance_list']))
+
+    def test_filters(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('overdue'), {'days': 10})
+        self.assertEqual(len(response.context['bookinstance_list']), 5)
+        response = self.client.get(reverse('overdue'), {'days': 10, 'borrower': 'patron'})
+        self.assertEqual([copy.borrower for copy in response.context['bookinstance_list']], [self.patron] * 2)
+        self.assertContains(response, 'value="patron"')
+        response = self.client.get(reverse('overdue'), {'days': 'x', 'borrower': 'nobody'})
+        self.assertEqual(response.context['days'], 1)
+        self.assertEqual(len(response.context['bookinstance_list']), 0)
+
 class RenewBookInstancesViewTest(TestCase):
     def setUp(self):
         # Create two users
@@ -1541,3 +1674,57 @@ class BookInstanceDeleteTest(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.client.post(reverse('bookinstance-delete', kwargs={'pk': self.test_bookinstance.pk}))
         self.assertEqual(response.status_code, 302)
+
+class CatalogExportViewTest(TestCase):
+    def setUp(self):
+        test_user1 = User.objects.create_user(username='testuser1', password='1X<ISRUkw+tuK')
+        test_user2 = User.objects.create_user(username='testuser2', password='2HJ1vRV0Z&3iD')
+        permission = Permission.objects.get(name='Can export the catalog')
+        test_user2.user_permissions.add(permission)
+
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        test_language = Language.objects.create(name='English')
+        # Create 5 books with 2 genres and a copy each
+        for book_id in range(5):
+            test_book = Book.objects.create(
+                title=f'Book Title {book_id}',
+                summary='My book summary',
+                isbn=f'ABCDEFG{book_id}',
+                author=test_author,
+                language=test_language,
+            )
+            test_book.genre.add(Genre.objects.create(name=f'Genre {book_id}'), Genre.objects.create(name=f'Other {book_id}'))
+            BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='a')
+
+    def test_redirect_if_not_logged_in(self):
+        response = self.client.get(reverse('catalog-export', args=['books', 'csv']))
+        self.assertRedirects(response, '/accounts/login/?next=/catalog/export/books.csv')
+
+    def test_forbidden_without_permission(self):
+        login = self.client.login(username='testuser1', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('catalog-export', args=['books', 'csv']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_books_csv(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('catalog-export', args=['books', 'csv']))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('id,isbn,title,'))
+        self.assertTrue(lines[1].endswith(',English,1,1,Genre 0;Other 0'))
+
+    def test_export_copies_jsonl(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('catalog-export', args=['copies', 'jsonl']))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['imprint'], 'Unlikely Imprint, 2016')
+
+    def test_unknown_dataset(self):
+        login = self.client.login(username='testuser2', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('catalog-export', args=['users', 'csv']))
+        self.assertEqual(response.status_code, 404)
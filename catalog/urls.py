@@ -6,14 +6,25 @@ urlpatterns = [
   path('genres/', views.GenreListView.as_view(), name='genres'),
   path('languages/', views.LanguageListView.as_view(), name='languages'),
   path('books/', views.BookListView.as_view(), name='books'),
+  path('books/search/', views.BookSearchView.as_view(), name='book-search'),
   path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
+  path('book/<int:pk>/copies', views.BookCopiesView.as_view(), name='book-copies'),
   path('bookinstances/', views.BookInstanceListView.as_view(), name='bookinstances'),
   path('bookinstance/<uuid:pk>', views.BookInstanceDetailView.as_view(), name='bookinstance-detail'),
   path('authors/', views.AuthorListView.as_view(), name='authors'),
   path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
   path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
   path('allborrowed/', views.AllBorrowedListView.as_view(), name='all-borrowed'),
+  path('overdue/', views.OverdueListView.as_view(), name='overdue'),
+  path('allborrowed/renew/', views.renew_books_librarian, name='renew-books-librarian'),
+  path('bookinstances/circulate/', views.circulate_books, name='circulate-books'),
+  path('export/<str:dataset>.<str:output_format>', views.export_catalog, name='catalog-export'),
   path('book/<uuid:pk>/renew/', views.renew_book_librarian, name='renew-book-librarian'),
+  path('book/<uuid:pk>/checkout/', views.checkout_book_librarian, name='checkout-book-librarian'),
+  path('book/<uuid:pk>/return/', views.return_book_librarian, name='return-book-librarian'),
+  path('book/<uuid:pk>/reserve/', views.reserve_book, name='reserve-book'),
+  path('book/<int:pk>/hold/', views.place_hold, name='place-hold'),
+  path('hold/<int:pk>/cancel/', views.cancel_hold, name='cancel-hold'),
   path('genre/create/', views.GenreCreate.as_view(), name='genre-create'),
   path('genre/<int:pk>/update/', views.GenreUpdate.as_view(), name='genre-update'),
   path('genre/<int:pk>/delete', views.GenreDelete.as_view(), name='genre-delete'),
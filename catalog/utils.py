@@ -0,0 +1,13 @@
+"""Helpers shared by the management commands."""
+
+import itertools
+
+
+def chunks(iterable, size):
+    """Yield lists of size items of iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
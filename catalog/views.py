@@ -1,107 +1,276 @@
 import datetime
+import json
 
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max, Prefetch
+from django.db.models.functions import Greatest
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse, reverse_lazy
+from django.utils.dateparse import parse_date
 from django.views import generic
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.auth.models import User
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import PermissionRequiredMixin
+from django.views.decorators.http import require_POST
 
 # Create your views here.
 
-from catalog.models import Book, Author, BookInstance, Genre, Language
+from catalog.models import Book, Author, BookInstance, Genre, Hold, Language, PageView
+from catalog import circulation, counters, facets
+from catalog.caching import VIEW_CACHE_TIMEOUT, CachedResponseMixin, ConditionalGetMixin, patch_public_cache_control
+from catalog.counters import PageViewMixin
+from catalog.export import DATASETS, FORMATS, export_lines
+from catalog.pagination import CursorPaginationMixin
+from catalog.search import search_books
+from catalog.stats import get_stats
 
 def index(request):
     """View function for home page of site."""
 
-    # Generate counts of some of the main objects
-    num_books = Book.objects.count()
-    num_instances = BookInstance.objects.count()
+    # Counts of the main objects, computed in one query and kept in cache
+    stats = get_stats()
 
-    # Available books (status = 'a')
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-    # Reserved books (status = 'r')
-    num_instances_reserved = BookInstance.objects.filter(status__exact='r').count()
-    # On loan books (status = 'o')
-    num_instances_loan = BookInstance.objects.filter(status__exact='o').count()
-    # On maintenance books (status = 'm')
-    num_instances_maintenance = BookInstance.objects.filter(status__exact='m').count()
-
-    num_authors = Author.objects.count()
-    num_genres = Genre.objects.count()
-    num_languages = Language.objects.count()
-
-    # Number of visits to this view, as counted in the session variable.
-    num_visits = request.session.get('num_visits', 0)
-    num_visits += 1
-    request.session['num_visits'] = num_visits
+    # Number of visits to this view of a logged in user (see catalog.counters). The browser
+    # counts the visits of anonymous visitors: their page writes no session and can be cached.
+    num_visits = None
+    if request.user.is_authenticated:
+        counters.record(PageView.INDEX, request.user.pk)
+        num_visits = PageView.objects.views(PageView.INDEX, request.user.pk) + counters.pending(PageView.INDEX, request.user.pk)
 
     context = {
-        'num_books': num_books,
-        'num_instances': num_instances,
-        'num_instances_available': num_instances_available,
-        'num_instances_reserved': num_instances_reserved,
-        'num_instances_loan': num_instances_loan,
-        'num_instances_maintenance': num_instances_maintenance,
-        'num_authors': num_authors,
-        'num_genres': num_genres,
-        'num_languages': num_languages,
+        **stats,
         'num_visits': num_visits,
     }
 
     # Render the HTML template index.html with the data in the context variable
-    return render(request, 'index.html', context=context)
+    response = render(request, 'index.html', context=context)
+    patch_public_cache_control(request, response)
+    return response
+
+def table_marker(model, field):
+    """
+    Return the change marker of all the rows of model: (Max(field), count).
 
-class GenreListView(generic.ListView): # add test case
+    Two queries: an index gives the maximum at once, unless computed with the count.
+    """
+    return model.objects.aggregate(last_changed=Max(field))['last_changed'], model.objects.count()
+
+class GenreListView(CachedResponseMixin, generic.ListView): # add test case
     model = Genre
+    cache_models = (Genre,)
     paginate_by = 10
 
-class LanguageListView(generic.ListView): # add test case
+class LanguageListView(CachedResponseMixin, generic.ListView): # add test case
     model = Language
+    cache_models = (Language,)
     paginate_by = 10
 
-class BookListView(generic.ListView):
+# Relations loaded with the listed copies, whatever the page size:
+# the templates display the book's title, ISBN, language, genres and author.
+BOOK_RELATIONS = ('book__author', 'book__language')
+
+def available_only(request):
+    """Whether the 'available' query string parameter restricts a list to the books with a copy available."""
+    return request.GET.get('available') == '1'
+
+class BookListView(ConditionalGetMixin, CachedResponseMixin, generic.ListView):
+    """
+    Books, with their copies loaded when expanded (see BookCopiesView), filtered by the genre,
+    language, author and available query string parameters, with the counts of each (see catalog.facets).
+    """
     model = Book
+    cache_models = (Book, Author, Genre, Language)
     paginate_by = 10
+    queryset = Book.objects.select_related('author')
 
-class BookDetailView(generic.DetailView):
+    def get_queryset(self):
+        self.filters = facets.parse_filters(self.request.GET)
+        return facets.filter_books(super().get_queryset(), self.filters)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        counts = facets.facet_counts(self.filters)
+        context['available'] = self.filters['available']
+        context['num_available'] = counts['available']
+        context['facets'] = facets.facet_links(self.request.GET, self.filters, counts)
+        return context
+
+    def get_change_marker(self):
+        return table_marker(Book, 'last_changed')
+
+class BookCopiesView(ConditionalGetMixin, generic.DetailView):
+    """Copies of a book, as the HTML fragment loaded by the book list."""
     model = Book
+    template_name = 'catalog/book_copies.html'
+    # Of the fragment cache of the template
+    cache_timeout = VIEW_CACHE_TIMEOUT
+
+    def get_change_marker(self):
+        # Copies and languages changes are book changes (see Book.last_changed)
+        last_changed = Book.objects.filter(pk=self.kwargs['pk']).values_list('last_changed', flat=True).first()
+        return last_changed and (last_changed, 1)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['copies'] = self.object.bookinstance_set.select_related('language').with_overdue()
+        return context
+
+class BookSearchView(generic.ListView):
+    """Books matching the 'q' query string parameter, best matches first (see catalog.search)."""
+    paginate_by = 10
+    template_name = 'catalog/book_search.html'
+    context_object_name = 'book_list'
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        return search_books(self.query, Book.objects.select_related('author'))
 
-class BookInstanceListView(generic.ListView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.query
+        return context
+
+class BookDetailView(PageViewMixin, ConditionalGetMixin, CachedResponseMixin, generic.DetailView):
+    model = Book
+    page_view_kind = PageView.BOOK
+    cache_models = (Book, Author, BookInstance, Genre, Language)
+    queryset = Book.objects.select_related('author', 'language').prefetch_related(
+        'genre', Prefetch('bookinstance_set', queryset=BookInstance.objects.with_overdue()),
+    )
+
+    def get_change_marker(self):
+        last_changed = Book.objects.filter(pk=self.kwargs['pk']).values_list('last_changed', flat=True).first()
+        return last_changed and (last_changed, 1)
+
+class BookInstanceListView(CursorPaginationMixin, generic.ListView):
     model = BookInstance
     paginate_by = 5
+    cursor_key = 'due_back'
+    queryset = BookInstance.objects.select_related(*BOOK_RELATIONS).prefetch_related('book__genre').with_overdue()
 
-class BookInstanceDetailView(generic.DetailView):
+class BookInstanceDetailView(ConditionalGetMixin, generic.DetailView):
     model = BookInstance
+    # Reserve, place a hold and return
+    renders_forms = True
+    queryset = BookInstance.objects.select_related(*BOOK_RELATIONS).prefetch_related('book__genre')
+
+    def get_change_marker(self):
+        copies = BookInstance.objects.filter(pk=self.kwargs['pk'])
+        last_changed = copies.values_list(Greatest('updated_at', 'book__last_changed'), flat=True).first()
+        return last_changed and (last_changed, 1)
 
-class AuthorListView(generic.ListView):
+class AuthorListView(ConditionalGetMixin, CachedResponseMixin, generic.ListView):
     model = Author
+    cache_models = (Author, Book)
     paginate_by = 10
+    queryset = Author.objects.annotate(num_books=Count('book'))
 
-class AuthorDetailView(generic.DetailView):
+    def get_change_marker(self):
+        # The numbers of books change with the books
+        authors_changed, num_authors = table_marker(Author, 'updated_at')
+        books_changed, num_books = table_marker(Book, 'last_changed')
+        if authors_changed is None:
+            return None
+        return max(filter(None, [authors_changed, books_changed])), (num_authors, num_books)
+
+class AuthorDetailView(PageViewMixin, ConditionalGetMixin, CachedResponseMixin, generic.DetailView):
     model = Author
+    page_view_kind = PageView.AUTHOR
+    cache_models = (Author, Book, BookInstance)
 
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+    def get_queryset(self):
+        books = Book.objects.available() if available_only(self.request) else Book.objects.all()
+        return Author.objects.prefetch_related(Prefetch('book_set', queryset=books))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['available'] = available_only(self.request)
+        return context
+
+    def get_change_marker(self):
+        authors = Author.objects.filter(pk=self.kwargs['pk']).annotate(
+            books_changed=Max('book__last_changed'), num_books=Count('book'),
+        )
+        marker = authors.values_list('updated_at', 'books_changed', 'num_books').first()
+        if marker is None:
+            return None
+        updated_at, books_changed, num_books = marker
+        return max(filter(None, [updated_at, books_changed])), num_books
+
+class LoanedBooksByUserListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing books on loan to current user."""
     model = BookInstance
     template_name ='catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
+    cursor_key = 'due_back'
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').select_related('book').with_overdue()
 
-class AllBorrowedListView(PermissionRequiredMixin, generic.ListView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        holds = Hold.objects.filter(patron=self.request.user, status__in=Hold.ACTIVE).select_related('book')
+        context['holds'] = holds.with_positions()
+        return context
+
+class AllBorrowedListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing all books on loan with specific permission (granted to librarians)."""
     permission_required = 'catalog.can_mark_returned'
     model = BookInstance
     template_name ='catalog/bookinstance_list_borrowed_all.html'
     paginate_by = 10
+    cursor_key = 'due_back'
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        return BookInstance.objects.filter(status__exact='o').select_related('book', 'borrower').with_overdue()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['renew_form'] = BulkRenewForm(initial={'due_back': datetime.date.today() + circulation.LOAN_PERIOD})
+        return context
+
+class OverdueListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
+    """
+    Report of the loans past their due date, most overdue first (granted to librarians). The 'days'
+    query string parameter keeps the loans at least that many days overdue, 'borrower' those of a user.
+    """
+    permission_required = 'catalog.can_mark_returned'
+    model = BookInstance
+    template_name = 'catalog/bookinstance_list_overdue.html'
+    paginate_by = 10
+    cursor_key = 'due_back'
+    cursor_key_nullable = False
 
-from catalog.forms import RenewBookModelForm
+    def get_queryset(self):
+        try:
+            self.days = max(int(self.request.GET.get('days') or 1), 1)
+        except ValueError:
+            self.days = 1
+        queryset = BookInstance.objects.overdue_loans(self.days)
+        self.borrower = self.request.GET.get('borrower', '').strip()
+        if self.borrower:
+            queryset = queryset.filter(borrower__username=self.borrower)
+        return queryset.select_related('book', 'borrower')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['days'] = self.days
+        context['borrower'] = self.borrower
+        return context
+
+@permission_required('catalog.can_export_catalog')
+def export_catalog(request, dataset, output_format):
+    """Stream a catalog dataset (books, authors or copies) as CSV or JSON Lines."""
+    if dataset not in DATASETS or output_format not in FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(export_lines(dataset, output_format), content_type=FORMATS[output_format])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{output_format}"'
+    return response
+
+from catalog.forms import BulkRenewForm, CheckoutForm, RenewBookModelForm, validate_renewal_date
 
 @permission_required('catalog.can_mark_returned')
 def renew_book_librarian(request, pk):
@@ -134,6 +303,126 @@ def renew_book_librarian(request, pk):
 
     return render(request, 'catalog/book_renew_librarian.html', context)
 
+@require_POST
+@permission_required('catalog.can_mark_returned')
+def renew_books_librarian(request):
+    """View function for renewing the selected loans, or all the loans due before a date, at once."""
+    form = BulkRenewForm(request.POST)
+    if form.is_valid():
+        renewed, rejected = circulation.renew(form.get_copies(), form.cleaned_data['due_back'])
+        messages.success(request, f'{renewed} loan(s) renewed until {form.cleaned_data["due_back"]}, {rejected} rejected.')
+    else:
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+    return HttpResponseRedirect(reverse('all-borrowed'))
+
+def loan_conflict(request, conflict):
+    """Response to a loan operation on a copy whose status changed meanwhile."""
+    copy = BookInstance.objects.select_related('book', 'borrower').get(pk=conflict.copy_id)
+    return render(request, 'catalog/loan_conflict.html', {'conflict': conflict, 'bookinstance': copy}, status=409)
+
+@permission_required('catalog.can_mark_returned')
+def checkout_book_librarian(request, pk):
+    """View function for lending an available (or reserved) copy to a borrower."""
+    book_instance = get_object_or_404(BookInstance.objects.select_related('book'), pk=pk)
+
+    if request.method == 'POST':
+        form = CheckoutForm(request.POST)
+        if form.is_valid():
+            try:
+                circulation.checkout(pk, form.cleaned_data['borrower'], form.cleaned_data['due_back'])
+            except circulation.LoanConflict as conflict:
+                return loan_conflict(request, conflict)
+            return HttpResponseRedirect(reverse('all-borrowed'))
+    else:
+        initial = {'due_back': datetime.date.today() + circulation.LOAN_PERIOD}
+        if book_instance.status == circulation.RESERVED:
+            initial['borrower'] = book_instance.borrower_id
+        form = CheckoutForm(initial=initial)
+
+    return render(request, 'catalog/book_checkout_librarian.html', {'form': form, 'book_instance': book_instance})
+
+@require_POST
+@permission_required('catalog.can_mark_returned')
+def return_book_librarian(request, pk):
+    """View function for marking a copy on loan as returned."""
+    try:
+        circulation.return_copy(pk)
+    except BookInstance.DoesNotExist:
+        raise Http404('No copy found matching the query')
+    except circulation.LoanConflict as conflict:
+        return loan_conflict(request, conflict)
+    return HttpResponseRedirect(reverse('bookinstance-detail', args=[pk]))
+
+@require_POST
+@login_required
+def reserve_book(request, pk):
+    """View function for reserving an available copy for the current user."""
+    try:
+        circulation.reserve(pk, request.user)
+    except BookInstance.DoesNotExist:
+        raise Http404('No copy found matching the query')
+    except circulation.LoanConflict as conflict:
+        return loan_conflict(request, conflict)
+    return HttpResponseRedirect(reverse('bookinstance-detail', args=[pk]))
+
+@require_POST
+@login_required
+def place_hold(request, pk):
+    """View function for queuing the current user for a copy of a book."""
+    book = get_object_or_404(Book, pk=pk)
+    hold = circulation.place_hold(book.pk, request.user)
+    if hold.status == Hold.READY:
+        messages.success(request, f'A copy of {book.title} is reserved for you.')
+    else:
+        messages.success(request, f'You are number {hold.position()} in the queue for {book.title}.')
+    return HttpResponseRedirect(reverse('my-borrowed'))
+
+@require_POST
+@login_required
+def cancel_hold(request, pk):
+    """View function for cancelling a hold of the current user."""
+    if not circulation.cancel_hold(pk, request.user):
+        raise Http404('No hold found matching the query')
+    messages.success(request, 'Your hold is cancelled.')
+    return HttpResponseRedirect(reverse('my-borrowed'))
+
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def circulate_books(request):
+    """
+    Check out or return a batch of scanned copies. The JSON body has an action ('checkout'
+    or 'return'), the copy ids, and for a checkout the borrower's username and an optional
+    due_back date (within the renewal limit); the response lists the result of each copy (see circulation.batch_circulate).
+    """
+    try:
+        data = json.loads(request.body)
+        action, ids = data['action'], data['ids']
+        if not isinstance(ids, list):
+            raise ValueError('ids must be a list.')
+        borrower = None
+        if action == 'checkout':
+            borrower = User.objects.get(username=data.get('borrower'))
+        due_back = None
+        if data.get('due_back'):
+            due_back = parse_date(data['due_back'])
+            if due_back is None:
+                raise ValueError('Invalid due_back date.')
+            # The rule of the checkout form
+            validate_renewal_date(due_back)
+        results = circulation.batch_circulate(action, ids, borrower, due_back)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'Unknown borrower.'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'error': str(e) or 'Invalid request.'}, status=400)
+    return JsonResponse({
+        'results': [{'id': copy_id, 'result': result, 'status': status} for copy_id, result, status in results],
+        'ok': sum(result == 'ok' for copy_id, result, status in results),
+    })
+
 class GenreCreate(PermissionRequiredMixin, generic.edit.CreateView):
     permission_required = 'catalog.can_edit_book'
     model = Genre
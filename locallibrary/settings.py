@@ -43,12 +43,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'catalog.middleware.PerformanceMiddleware', #Measures sampled requests (first, to include the other middleware)
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware', #Manages sessions across requests
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware', #Associates users with requests using sessions.
+    'catalog.middleware.SessionlessAnonymousMiddleware', #Anonymous without a session cookie: no Vary: Cookie on public pages
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -131,7 +133,105 @@ STATIC_URL = '/static/'
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# E-mails (e.g. password resets) are queued, and sent by the task worker (catalog.mail)
+# through CATALOG_TASKS_EMAIL_BACKEND
+EMAIL_BACKEND = 'catalog.mail.QueuedEmailBackend'
+CATALOG_TASKS_EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# One cache shared by the web and worker processes, so that the caches refreshed by the
+# worker (catalog.tasks) are those the pages read, and edits reach every process at once:
+# Memcached at MEMCACHED_LOCATION (host:port, several separated by ';'), read without a
+# database round trip. Without it, a table of the database (created by migration 0019),
+# sized for the pages, facet counts and versions cached: every set counts the rows and
+# culls a tenth of them past MAX_ENTRIES.
+CATALOG_CACHE_TABLE = 'catalog_cache'
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(';'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': CATALOG_CACHE_TABLE,
+            'OPTIONS': {'MAX_ENTRIES': 50000, 'CULL_FREQUENCY': 10},
+        },
+    }
+# Template fragments ({% cache %}), keyed by the last change of their book: each process
+# keeps its own, out of the shared cache
+CACHES['fragments'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'catalog-fragments',
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
+# Seconds the catalog statistics (home page counters) are kept in cache
+CATALOG_STATS_CACHE_TIMEOUT = 300
+
+# Seconds the rendered catalog pages are kept in cache (catalog.caching)
+CATALOG_VIEW_CACHE_TIMEOUT = 600
+
+# Seconds a front proxy and the browsers may keep the catalog pages of anonymous
+# visitors (Cache-Control: public, without Vary: Cookie), which write no session;
+# pages of logged in users are private, and the proxy must pass the requests with
+# a session cookie.
+CATALOG_PUBLIC_MAX_AGE = 60
+
+# Page view counters (catalog.counters) are buffered by each process and flushed
+# in bulk every CATALOG_COUNTERS_FLUSH_INTERVAL seconds, when CATALOG_COUNTERS_MAX_PENDING
+# pages are pending, and at exit: a crashing worker loses at most one interval of views.
+CATALOG_COUNTERS_FLUSH_INTERVAL = 10
+CATALOG_COUNTERS_MAX_PENDING = 1000
+
+# The tests drop the page views they buffer, and don't flush them at exit (catalog.counters)
+TEST_RUNNER = 'catalog.tests.runner.CatalogTestRunner'
+
+# Request performance measures (catalog.middleware.PerformanceMiddleware):
+# share of the requests measured, and budgets over which a request is logged as a warning
+CATALOG_PERF_SAMPLE_RATE = float(os.environ.get('DJANGO_PERF_SAMPLE_RATE', '0.1'))
+CATALOG_PERF_QUERY_BUDGET = 20
+CATALOG_PERF_LATENCY_BUDGET_MS = 500
+# The Server-Timing header exposes the query counts and timings of the sampled requests
+# to any client: sent in development only, unless DJANGO_PERF_SERVER_TIMING=True
+CATALOG_PERF_SERVER_TIMING = os.environ.get('DJANGO_PERF_SERVER_TIMING', str(DEBUG)) == 'True'
+
+# Background tasks (catalog.tasks), run by `manage.py run_worker` (the worker process of the Procfile):
+# tasks run at once by a worker, and tasks enqueued periodically by the workers ({task: seconds})
+CATALOG_TASKS_CONCURRENCY = int(os.environ.get('CATALOG_TASKS_CONCURRENCY', '4'))
+CATALOG_TASKS_SCHEDULE = {
+    'catalog.tasks.refresh_stats': 60,
+    'catalog.tasks.refresh_facets': 240,
+    'catalog.tasks.send_overdue_notices': 24 * 3600,
+    'catalog.tasks.purge_tasks': 24 * 3600,
+    'catalog.tasks.expire_holds': 3600,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # Set DJANGO_PERF_LOG_LEVEL to INFO to log the measures of every sampled request
+        'catalog.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('DJANGO_PERF_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        # Failed tasks are logged as warnings (retried) or errors (given up)
+        'catalog.tasks': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
 
 # Heroku: Update database configuration from $DATABASE_URL.
 import dj_database_url